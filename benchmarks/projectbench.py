@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    projectbench.py
+#
+#    Generates synthetic projects of a given size and measures how long it
+#    takes to save and open them, how much memory that needs and how large
+#    the files are. Runs without a display or a sound card, and writes the
+#    results as JSON so that they can be compared between commits:
+#
+#        python3 benchmarks/projectbench.py --output before.json
+#        git checkout other-branch
+#        python3 benchmarks/projectbench.py --compare before.json
+#
+#-------------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+""" The directory holding this script, and the source tree around it """
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+SCHEMA_FILE = os.path.join(os.path.dirname(BENCHMARKS_DIR), "data", "org.gnome.Jokosher.gschema.xml")
+
+""" Increased whenever the layout of the results changes """
+RESULTS_VERSION = 1
+
+""" The ways a project can be opened, see OpenWorker """
+LOADERS = ("snapshot", "streaming", "dom")
+
+""" The name of the audio file every synthetic event plays """
+AUDIO_FILE = "silence.wav"
+
+class BenchmarkWorker:
+    """
+    Runs one measurement in a process of its own, so that the peak memory
+    use of every measurement starts from a fresh interpreter. Jokosher is
+    imported from the source tree and set up with an application which has
+    no windows, and a project which plays to a fakesink.
+    """
+
+    def __init__(self, options):
+        """
+        Creates a new instance of BenchmarkWorker.
+
+        Parameters:
+            options -- the parsed command line options.
+        """
+        self.options = options
+        self.projectfile = os.path.join(options.project_dir, "project.jokosher")
+        self.results = {}
+
+        import gi
+        gi.require_version("Gtk", "4.0")
+        gi.require_version("Gst", "1.0")
+        gi.require_version("GstController", "1.0")
+        from gi.repository import Gio, Gst
+        Gst.init(None)
+
+        self.__ImportSources(options.source)
+        from jokosher.settings import Settings
+        from jokosher.levelscache import LevelsCache
+        from jokosher.waveformtilecache import WaveformTileCache
+
+        class BenchmarkApplication(Gio.Application):
+            """
+            Stands in for JokosherApplication, which needs a display.
+            """
+            def __init__(self):
+                Gio.Application.__init__(self, application_id="org.gnome.Jokosher.Benchmark",
+                                         flags=Gio.ApplicationFlags.NON_UNIQUE)
+                self.settings = Settings()
+                self.settings.playback["audiosink"] = "fakesink"
+                self.settings.gsettings.set_boolean("lazy-event-loading", not options.eager)
+                self.levels_cache = LevelsCache(os.path.join(self.settings.JOKOSHER_DATA_HOME, "levelscache"),
+                                                self.settings.get_levels_cache_size() * 1024 * 1024)
+                self.waveform_tiles = WaveformTileCache(self.settings.get_waveform_cache_size() * 1024 * 1024)
+                self.project = None
+
+            def getCachedInstruments(self, checkForNew=False):
+                return []
+
+            def getCachedInstrumentPixbuf(self, get_type):
+                return None
+
+        self.app = BenchmarkApplication()
+        self.app.set_default()
+        self.results["gstreamer"] = Gst.version_string()
+
+    #_____________________________________________________________________
+
+    def run(self):
+        """
+        Runs the measurement chosen on the command line and writes its
+        results to the result file.
+        """
+        self.results["rss_before"] = self.__PeakRSS()
+        phase = self.options.worker
+        if phase == "save":
+            self.SaveWorker()
+        elif phase == "levels":
+            self.LevelsWorker()
+        else:
+            self.OpenWorker(phase.split("-", 1)[1])
+        self.results["peak_rss"] = self.__PeakRSS()
+
+        with open(self.options.result, "w") as f:
+            json.dump(self.results, f)
+
+    #_____________________________________________________________________
+
+    def SaveWorker(self):
+        """
+        Generates the synthetic project and saves it a few times.
+        """
+        from jokosher.project import Project
+
+        begin = time.perf_counter()
+        project = Project()
+        self.app.project = project
+        self.__GenerateProject(project)
+        self.results["generate"] = [time.perf_counter() - begin]
+
+        project.projectfile = self.projectfile
+        samples = []
+        for i in range(self.options.saves):
+            begin = time.perf_counter()
+            project.save_project_file()
+            samples.append(time.perf_counter() - begin)
+        self.results["time"] = samples
+
+    #_____________________________________________________________________
+
+    def OpenWorker(self, loader):
+        """
+        Opens the saved project with one of the loaders:
+            snapshot -- Project.load_project_file() reading the snapshot.
+            streaming -- Project.load_project_file() with snapshots turned
+                         off, which streams the XML.
+            dom -- FormatOneZero reading the whole XML document first.
+        """
+        from jokosher.project import Project
+        from jokosher.projectutilities import FormatOneZero, ProjectUtilities
+        import xml.dom.minidom as xml
+
+        self.app.settings.gsettings.set_boolean("project-snapshots", loader == "snapshot")
+
+        begin = time.perf_counter()
+        if loader == "dom":
+            project = Project()
+            project.projectfile = self.projectfile
+            project.audio_path = os.path.join(self.options.project_dir, "audio")
+            project.levels_path = os.path.join(self.options.project_dir, "levels")
+            xmlFile, rawFile = ProjectUtilities.open_project_xml(self.projectfile)
+            with rawFile, xmlFile:
+                doc = xml.parse(xmlFile)
+            FormatOneZero(project, doc)
+        else:
+            project = Project.load_project_file("file://" + self.projectfile)
+        self.results["time"] = [time.perf_counter() - begin]
+        self.app.project = project
+
+        # lazily loaded events are set up when they are first played
+        begin = time.perf_counter()
+        project.materialize_events()
+        self.results["materialize"] = [time.perf_counter() - begin]
+
+        self.results["events"] = sum(len(instr.events) for instr in project.instruments)
+
+    #_____________________________________________________________________
+
+    def LevelsWorker(self):
+        """
+        Reads every levels file of the saved project.
+        """
+        from jokosher.levelslist import LevelsList
+
+        levelsDir = os.path.join(self.options.project_dir, "levels")
+        paths = [os.path.join(levelsDir, name) for name in sorted(os.listdir(levelsDir))]
+
+        levels = []
+        begin = time.perf_counter()
+        for path in paths:
+            levels_list = LevelsList()
+            levels_list.fromfile(path)
+            levels.append(levels_list)
+        self.results["time"] = [time.perf_counter() - begin]
+        self.results["files"] = len(paths)
+
+    #_____________________________________________________________________
+
+    def __GenerateProject(self, project):
+        """
+        Fills a Project with instruments, each with a row of events playing
+        the same silent file, with fade points and levels spread over them.
+        """
+        from jokosher.event import Event
+        from jokosher.levelslist import LevelsList
+        from jokosher.utils import Utils
+
+        options = self.options
+        project.name = "Benchmark"
+        project.audio_path = os.path.join(options.project_dir, "audio")
+        project.levels_path = os.path.join(options.project_dir, "levels")
+        os.makedirs(project.audio_path, exist_ok=True)
+        os.makedirs(project.levels_path, exist_ok=True)
+        self.__WriteSilence(os.path.join(project.audio_path, AUDIO_FILE), options.levels_length)
+
+        # the same pseudo random levels and fades every run
+        rand = random.Random(options.seed)
+        interval = int(Event.LEVEL_INTERVAL * 1000)
+        points = max(1, int(options.levels_length / Event.LEVEL_INTERVAL))
+        endtimes = [interval * (i + 1) for i in range(points)]
+        decibels = [[rand.uniform(-60.0, 0.0) for i in range(points)] for channel in range(2)]
+        levels = [Utils.DecibelsToLevels(channel) for channel in decibels]
+        peaks = [Utils.DecibelsToLevels([min(0.0, db + 6.0) for db in channel]) for channel in decibels]
+        template = LevelsList()
+        template.append_block(endtimes, levels, peaks)
+
+        for i in range(options.instruments):
+            instr = project.add_instrument("Instrument %d" % (i + 1), "audiofile")
+            instr.volume = rand.uniform(0.5, 1.0)
+            instr.pan = rand.uniform(-1.0, 1.0)
+            with instr.batch_composition():
+                for j in range(options.events):
+                    event = Event(instr, AUDIO_FILE, lazy=True)
+                    event.name = "Event %d" % (j + 1)
+                    event.start = j * options.levels_length
+                    event.duration = options.levels_length
+                    event.levels_list = template.copy()
+
+                    fadePoints = {}
+                    for k in range(options.fade_points):
+                        fadePoints[round(rand.uniform(0.0, event.duration), 3)] = round(rand.random(), 3)
+                    event._Event__fadePointsDict = fadePoints
+                    instr.events.append(event)
+
+    #_____________________________________________________________________
+
+    def __WriteSilence(self, path, seconds):
+        """
+        Records the given length of silence from audiotestsrc to a wave file.
+        """
+        from gi.repository import Gst
+
+        buffers = max(1, int(seconds * 10))
+        pipeline = Gst.parse_launch("audiotestsrc wave=silence samplesperbuffer=4410 num-buffers=%d ! "
+                                    "audio/x-raw,rate=44100,channels=2 ! audioconvert ! wavenc ! "
+                                    "filesink name=sink" % buffers)
+        pipeline.get_by_name("sink").set_property("location", path)
+        pipeline.set_state(Gst.State.PLAYING)
+        message = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                                                        Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        pipeline.set_state(Gst.State.NULL)
+        if message.type == Gst.MessageType.ERROR:
+            error, debug = message.parse_error()
+            raise RuntimeError("Cannot write %s: %s" % (path, error.message))
+
+    #_____________________________________________________________________
+
+    def __ImportSources(self, source):
+        """
+        Imports the source directory as the jokosher package, the way it
+        is installed.
+        """
+        spec = importlib.util.spec_from_file_location("jokosher", os.path.join(source, "__init__.py"),
+                                                      submodule_search_locations=[source])
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["jokosher"] = module
+        spec.loader.exec_module(module)
+        return module
+
+    #_____________________________________________________________________
+
+    def __PeakRSS(self):
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    #_____________________________________________________________________
+
+#=========================================================================
+
+def prepare_environment(workdir):
+    """
+    Compiles the settings schema and keeps the settings, caches and
+    configuration of the benchmark inside workdir.
+
+    Returns:
+        the environment to run the workers with.
+    """
+    schemaDir = os.path.join(workdir, "schemas")
+    os.makedirs(schemaDir)
+    shutil.copy(SCHEMA_FILE, schemaDir)
+    subprocess.run(["glib-compile-schemas", schemaDir], check=True)
+
+    env = dict(os.environ)
+    env["GSETTINGS_SCHEMA_DIR"] = schemaDir
+    # the settings changed by the benchmark are forgotten when it exits
+    env["GSETTINGS_BACKEND"] = "memory"
+    for name in ("XDG_CONFIG_HOME", "XDG_DATA_HOME", "XDG_CACHE_HOME"):
+        env[name] = os.path.join(workdir, name.lower())
+    return env
+
+#_____________________________________________________________________
+
+def run_worker(phase, projectDir, options, env):
+    """
+    Runs one BenchmarkWorker and returns its results.
+    """
+    resultPath = os.path.join(os.path.dirname(projectDir), "%s.json" % phase)
+    command = [sys.executable, os.path.abspath(__file__), "--worker", phase,
+               "--project-dir", projectDir, "--result", resultPath, "--source", options.source]
+    for name in ("instruments", "events", "fade_points", "levels_length", "saves", "seed"):
+        command += ["--" + name.replace("_", "-"), str(getattr(options, name))]
+    if options.eager:
+        command.append("--eager")
+
+    # Jokosher is chatty on stdout
+    output = None if options.verbose else subprocess.DEVNULL
+    subprocess.run(command, env=env, stdout=output, check=True)
+    with open(resultPath) as f:
+        return json.load(f)
+
+#_____________________________________________________________________
+
+def directory_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+#_____________________________________________________________________
+
+def summarize(samples):
+    return {
+        "samples" : samples,
+        "median" : statistics.median(samples),
+        "min" : min(samples),
+    }
+
+#_____________________________________________________________________
+
+def run_benchmarks(options):
+    """
+    Saves and opens the synthetic project options.repeat times.
+
+    Returns:
+        the results, as written to the output file.
+    """
+    workdir = tempfile.mkdtemp(prefix="jokosher-bench-")
+    try:
+        env = prepare_environment(workdir)
+        measurements = {}
+        sizes = {}
+        gstreamer = None
+        for i in range(options.repeat):
+            projectDir = os.path.join(workdir, "run%d" % i, "project")
+            os.makedirs(projectDir)
+
+            phases = ["save"] + ["open-%s" % loader for loader in options.loaders] + ["levels"]
+            for phase in phases:
+                results = run_worker(phase, projectDir, options, env)
+                gstreamer = results.pop("gstreamer", gstreamer)
+                for key, value in results.items():
+                    if not isinstance(value, list):
+                        value = [value]
+                    measurements.setdefault(phase, {}).setdefault(key, []).extend(value)
+
+            projectfile = os.path.join(projectDir, "project.jokosher")
+            sizes = {
+                "project_file" : os.path.getsize(projectfile),
+                "snapshot" : os.path.getsize(os.path.join(projectDir, "project.snapshot")) \
+                             if os.path.exists(os.path.join(projectDir, "project.snapshot")) else 0,
+                "levels" : directory_size(os.path.join(projectDir, "levels")),
+                "audio" : directory_size(os.path.join(projectDir, "audio")),
+            }
+    finally:
+        if options.keep:
+            print("Benchmark projects kept in", workdir, file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "version" : RESULTS_VERSION,
+        "commit" : git_commit(),
+        "python" : sys.version.split()[0],
+        "gstreamer" : gstreamer,
+        "parameters" : {name : getattr(options, name) for name in
+                        ("instruments", "events", "fade_points", "levels_length", "saves", "repeat", "eager", "seed")},
+        "results" : {phase : {key : summarize(samples) for key, samples in values.items()}
+                     for phase, values in measurements.items()},
+        "sizes" : sizes,
+    }
+
+#_____________________________________________________________________
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#_____________________________________________________________________
+
+def compare(old, new, threshold):
+    """
+    Prints the change of every measurement from an earlier run.
+
+    Returns:
+        True if any time or memory measurement got worse by more than
+        threshold, as a fraction.
+    """
+    if old.get("parameters") != new.get("parameters"):
+        print("Warning: the runs were made with different parameters", file=sys.stderr)
+
+    regressed = False
+    print("%-20s %-12s %14s %14s %8s" % ("phase", "measure", "before", "after", "change"))
+    rows = []
+    for phase, values in sorted(new["results"].items()):
+        for key, summary in sorted(values.items()):
+            before = old.get("results", {}).get(phase, {}).get(key)
+            if before:
+                rows.append((phase, key, before["median"], summary["median"]))
+    for key, value in sorted(new["sizes"].items()):
+        if key in old.get("sizes", {}):
+            rows.append(("size", key, old["sizes"][key], value))
+
+    for phase, key, before, after in rows:
+        change = (after - before) / before if before else 0.0
+        print("%-20s %-12s %14.4f %14.4f %+7.1f%%" % (phase, key, before, after, change * 100))
+        if key in ("time", "peak_rss", "materialize") and change > threshold:
+            regressed = True
+
+    return regressed
+
+#_____________________________________________________________________
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Measures saving and opening synthetic Jokosher projects.")
+    parser.add_argument("--instruments", type=int, default=8, help="number of instruments")
+    parser.add_argument("--events", type=int, default=100, help="number of events on each instrument")
+    parser.add_argument("--fade-points", type=int, default=4, help="number of fade points on each event")
+    parser.add_argument("--levels-length", type=float, default=30.0,
+                        help="length of each event and its levels, in seconds")
+    parser.add_argument("--saves", type=int, default=3, help="number of times the project is saved in a row")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times every measurement is repeated")
+    parser.add_argument("--loaders", nargs="+", choices=LOADERS, default=list(LOADERS),
+                        help="the ways of opening the project to measure")
+    parser.add_argument("--eager", action="store_true",
+                        help="set up every event while the project is opened, instead of lazily")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated levels and fades")
+    parser.add_argument("--source", default=SOURCE_DIR, help="the Jokosher source directory to measure")
+    parser.add_argument("--output", help="file to write the results to, instead of stdout")
+    parser.add_argument("--compare", metavar="RESULTS", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fraction by which a measurement may get worse before --compare fails")
+    parser.add_argument("--keep", action="store_true", help="keep the generated projects")
+    parser.add_argument("--verbose", action="store_true", help="show the debug output of Jokosher")
+    # used when running a measurement in a process of its own
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--project-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+#_____________________________________________________________________
+
+def main(argv):
+    options = parse_arguments(argv)
+    options.source = os.path.abspath(options.source)
+
+    if options.worker:
+        BenchmarkWorker(options).run()
+        return 0
+
+    results = run_benchmarks(options)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    elif not options.compare:
+        print(text)
+
+    if options.compare:
+        with open(options.compare) as f:
+            old = json.load(f)
+        if compare(old, results, options.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
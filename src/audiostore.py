@@ -0,0 +1,361 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    audiostore.py
+#
+#    Keeps every imported audio file in the project's audio directory once,
+#    named after a hash of its contents, however many times it is imported.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject, Gio
+from .globals import Globals
+import concurrent.futures
+import fcntl
+import hashlib
+import os
+import string
+
+class AudioStore:
+    """
+    The imported audio files of a project, each named after the hash of its
+    contents and the extension of the file it was imported from. Importing
+    the same audio again only makes a new event use the stored file. New
+    files are cloned where the filesystem supports it, hard linked if they
+    come from the audio directory itself, and copied by the MediaImporter
+    otherwise.
+    """
+
+    """ The number of bytes of audio hashed at a time """
+    HASH_CHUNK_SIZE = 1 << 20
+    """ The size of the hash in bytes, twice as many hex digits name the files """
+    DIGEST_SIZE = 20
+    """ The FICLONE ioctl, which makes a copy on write clone of a file on Linux """
+    FICLONE = 0x40049409
+
+    def __init__(self, project, workers=2):
+        """
+        Creates a new instance of AudioStore.
+
+        Parameters:
+            project -- the Project whose audio directory holds the files.
+            workers -- the number of files hashed at the same time.
+        """
+        self.project = project
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers),
+                                                              thread_name_prefix="AudioStore")
+        self.pending = {}        # names of the files being added -> functions waiting for them
+        self.hashing = {}        # paths of the files being hashed -> functions waiting for the key
+        self.closed = False
+
+    #_____________________________________________________________________
+
+    def get_key(self, path):
+        """
+        Calculates the hash a file is stored under.
+
+        Parameters:
+            path -- path to the audio file.
+
+        Returns:
+            the hash as hex digits, or None if the file can't be read.
+        """
+        digest = hashlib.blake2b(digest_size=self.DIGEST_SIZE)
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+
+        return digest.hexdigest()
+
+    #_____________________________________________________________________
+
+    def get_stored_key(self, path):
+        """
+        Returns:
+            the hash of a file of this store, which is part of its name,
+            or None if the path isn't one of the files of this store.
+        """
+        if not self.is_stored(path):
+            return None
+        return os.path.splitext(os.path.basename(path))[0]
+
+    #_____________________________________________________________________
+
+    def hash_file(self, path, callback):
+        """
+        Hashes a file on a worker thread, and calls callback with the key
+        from the main loop. A file which is being hashed already isn't read
+        again, callback gets the same key.
+
+        Parameters:
+            path -- path to the file.
+            callback -- function called with the key, or with None if the
+                        file can't be read.
+        """
+        path = os.path.abspath(path)
+        if path in self.hashing:
+            self.hashing[path].append(callback)
+            return
+
+        self.hashing[path] = [callback]
+        def hashed(key):
+            for waiting in self.hashing.pop(path, []):
+                waiting(key)
+        self.__Hash(path, hashed)
+
+    #_____________________________________________________________________
+
+    def is_stored(self, path):
+        """
+        Returns:
+            True if the path is one of the files of this store.
+        """
+        return self.__IsStoreName(os.path.basename(path)) and \
+               os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.project.audio_path)
+
+    #_____________________________________________________________________
+
+    def import_file(self, source, tempname, progress, finished):
+        """
+        Adds a file to the store in the background.
+
+        Parameters:
+            source -- the Gio.File to import.
+            tempname -- a unique file name to copy the file to before its
+                        hash is known, with the extension to keep.
+            progress -- function called with the fraction copied so far.
+            finished -- function called with the name of the stored file,
+                        or with None if the file could not be imported.
+        """
+        extension = os.path.splitext(tempname)[1]
+        path = source.get_path()
+        if path:
+            # hashed first, so that audio which is already stored isn't copied at all
+            self.hash_file(path, lambda key: self.__ImportHashed(source, key, extension, tempname,
+                                                                progress, finished))
+        else:
+            self.__ImportUnhashed(source, extension, tempname, progress, finished)
+
+    #_____________________________________________________________________
+
+    def collect_garbage(self):
+        """
+        Deletes the stored files which no event uses anymore, including
+        the events in the graveyard, which may be brought back by undo.
+        """
+        referenced = set()
+        for instr in self.project.instruments + self.project.graveyard:
+            for event in instr.events + instr.graveyard:
+                if event.file:
+                    referenced.add(os.path.basename(event.file))
+
+        try:
+            names = os.listdir(self.project.audio_path)
+        except OSError:
+            return
+
+        for name in names:
+            if not self.__IsStoreName(name) or name in referenced or name in self.pending:
+                continue
+            path = os.path.join(self.project.audio_path, name)
+            Globals.debug("Deleting unused audio file:", path)
+            self.__Forget(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    #_____________________________________________________________________
+
+    def close(self):
+        """
+        Stops hashing files. Imports which haven't finished are dropped.
+        """
+        self.closed = True
+        self.hashing = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    #_____________________________________________________________________
+
+    def __ImportHashed(self, source, key, extension, tempname, progress, finished):
+        """
+        Stores a local file once its hash is known.
+        """
+        if key is None:
+            finished(None)
+            return
+
+        name = key + extension
+        path = os.path.join(self.project.audio_path, name)
+        if name in self.pending:
+            # the same audio is being imported for another event
+            self.pending[name].append(finished)
+            return
+        if os.path.exists(path):
+            Globals.debug("Audio already stored as", name)
+            finished(name)
+            return
+
+        self.pending[name] = [finished]
+        if self.__Clone(source.get_path(), path):
+            self.__Added(name)
+            self.__Finish(name, True)
+            return
+
+        def copied(tempPath):
+            if tempPath:
+                self.__Store(tempPath, name)
+            self.__Finish(name, tempPath is not None)
+
+        self.__CopyToTemp(source, tempname, progress, copied)
+
+    #_____________________________________________________________________
+
+    def __ImportUnhashed(self, source, extension, tempname, progress, finished):
+        """
+        Stores a file which can only be hashed after it has been copied.
+        """
+        def hashed(tempPath, key):
+            if key is None:
+                self.__Remove(tempPath)
+                finished(None)
+                return
+            name = key + extension
+            self.__Store(tempPath, name)
+            finished(name)
+
+        def copied(tempPath):
+            if tempPath:
+                self.__Hash(tempPath, lambda key: hashed(tempPath, key))
+            else:
+                finished(None)
+
+        self.__CopyToTemp(source, tempname, progress, copied)
+
+    #_____________________________________________________________________
+
+    def __CopyToTemp(self, source, tempname, progress, finished):
+        """
+        Copies a file into the audio directory under a temporary name, so
+        that a half written file is never taken for a stored one.
+        """
+        tempPath = os.path.join(self.project.audio_path, tempname)
+        # deleted on exit if Jokosher quits before it is stored
+        self.project.deleteOnCloseAudioFiles.append(tempPath)
+
+        def copied(success):
+            if not success:
+                self.__Remove(tempPath)
+            finished(tempPath if success else None)
+
+        self.project.mediaImporter.copy(source, Gio.File.new_for_path(tempPath), progress, copied)
+
+    #_____________________________________________________________________
+
+    def __Store(self, tempPath, name):
+        """
+        Moves a copied file into the store, unless a file with the same
+        audio has been stored in the meantime.
+        """
+        path = os.path.join(self.project.audio_path, name)
+        if os.path.exists(path):
+            self.__Remove(tempPath)
+            return
+
+        os.replace(tempPath, path)
+        self.__Forget(tempPath)
+        self.__Added(name)
+
+    #_____________________________________________________________________
+
+    def __Clone(self, source, path):
+        """
+        Makes the stored file without copying the audio, if the filesystem
+        can do that.
+
+        Returns:
+            True if the file was cloned or linked.
+        """
+        try:
+            with open(source, "rb") as src, open(path + "~", "wb") as dst:
+                fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+            os.replace(path + "~", path)
+            return True
+        except OSError:
+            self.__Remove(path + "~")
+
+        # the files in the audio directory are never changed, so they can share their data
+        if os.path.dirname(os.path.abspath(source)) == os.path.abspath(self.project.audio_path):
+            try:
+                os.link(source, path)
+                return True
+            except OSError:
+                pass
+
+        return False
+
+    #_____________________________________________________________________
+
+    def __Finish(self, name, success):
+        """
+        Tells everyone waiting for a file whether it has been stored.
+        """
+        for finished in self.pending.pop(name, []):
+            finished(name if success else None)
+
+    #_____________________________________________________________________
+
+    def __Added(self, name):
+        """
+        Called when a new file is in the store. It stays there only if the
+        project is saved with an event using it.
+        """
+        self.project.deleteOnCloseAudioFiles.append(os.path.join(self.project.audio_path, name))
+
+    #_____________________________________________________________________
+
+    def __Forget(self, path):
+        if path in self.project.deleteOnCloseAudioFiles:
+            self.project.deleteOnCloseAudioFiles.remove(path)
+
+    #_____________________________________________________________________
+
+    def __Remove(self, path):
+        self.__Forget(path)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+    #_____________________________________________________________________
+
+    def __Hash(self, path, callback):
+        """
+        Hashes a file on a worker thread, and calls callback with the key
+        from the main loop.
+        """
+        future = self.executor.submit(self.get_key, path)
+        future.add_done_callback(lambda future: GObject.idle_add(self.__OnHashed, future, callback))
+
+    #_____________________________________________________________________
+
+    def __OnHashed(self, future, callback):
+        if not self.closed and not future.cancelled():
+            callback(future.result())
+        #Stop idle_add from calling us again
+        return False
+
+    #_____________________________________________________________________
+
+    def __IsStoreName(self, name):
+        key = os.path.splitext(name)[0]
+        return len(key) == 2 * self.DIGEST_SIZE and all(c in string.hexdigits for c in key)
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -2,8 +2,12 @@ from gi.repository import GObject
 from gi.repository import Gst
 from .globals import Globals
 from .platform_utils import PlatformUtils
-from .levelslist import LevelsList
+from .levelslist import LevelsList, CorruptFileError
+from . import levelslist
 from .utils import Utils
+from .waveformanalyser import WaveformAnalyser
+from .levelscache import LevelsCache
+from .incrementalsave import IncrementalSave
 import os
 
 class Event(GObject.GObject):
@@ -18,9 +22,29 @@ class Event(GObject.GObject):
 
     """ The level sample interval in seconds """
     LEVEL_INTERVAL = 0.1
+    """ The number of level messages which are converted together """
+    LEVEL_BATCH_SIZE = 10
+    """ How the channels are stored in the levels list, part of the levels cache key """
+    LEVEL_CHANNEL_MODE = "per-channel"
     LEVELS_FILE_EXTENSION = ".leveldata"
+    """ The properties saved in the project file and in the .incremental file """
+    SAVED_PARAMETERS = ["start", "duration", "isSelected",
+                        "name", "offset", "file", "filelabel", "levels_file",
+                        "isLoading", "isRecording"
+                       ]
 
-    def __init__(self, instrument, file=None, id=None, filelabel=None):
+    def __init__(self, instrument, file=None, id=None, filelabel=None, lazy=False):
+        """
+        Creates a new instance of Event.
+
+        Parameters:
+            instrument -- the Instrument this Event belongs to.
+            file -- the audio file this Event plays.
+            id -- the unique id to use, or None to generate one.
+            filelabel -- the file name to show in error messages.
+            lazy -- True to leave out the GStreamer source and the levels
+                    until materialize() is called.
+        """
         GObject.GObject.__init__(self)
 
         self.id = instrument.project.generate_unique_id(id)  #check is id is already taken, then set it.
@@ -60,13 +84,21 @@ class Event(GObject.GObject):
         self.offset = 0.0            # Offset through the file in seconds
         self.isLoading = False        # True if the event is currently loading level data
         self.isDownloading = False    # True if the event is currently loading from a remote source.
+        self.isImporting = False    # True if the event's file is being copied into the project
+        self.importProgress = 0.0    # The fraction of the file copied so far
         self.isRecording = False        # True if the event is currently loading level data from a live recording
         self.loadingLength = 0         # The length of the file in seconds as its being rendered
         self.lastEnd = 0             # The last length of the loading file - used to minimise redraws
         self.loadingPipeline = None    # The Gstreamer pipeline used to load the waveform
         self.bus = None            # The bus to monitor messages on the loadingPipeline
+        self.analyser = None        # The WaveformAnalyser used instead of loadingPipeline when available
+        self.levelsCacheKey = None    # Key to store the levels in the LevelsCache with once they are generated
+        self.__pendingLevels = []    # level messages received but not yet added to levels_list
+        self.isMaterialized = not lazy    # False until the source and levels of a lazily loaded event are attached
+        self.levelsOutOfDate = False    # True if the levels file was written before the event was last split or joined
 
-        self.CreateFilesource()
+        if not lazy:
+            self.CreateFilesource()
 
         # a private dictionary containing the audio fade point times as keys
         # and the volume for that point between 0 and 1 as the values.
@@ -82,6 +114,10 @@ class Event(GObject.GObject):
         #Just like self.levels_list except with all the levels scaled according to the
         #points in self.audioFadePoints.
         self.fadeLevels = LevelsList()
+        #The levels_list which fadeLevels was made from, and the (start, stop) span
+        #in seconds where the fade has changed since (stop is None for the end).
+        self.__fadeSource = None
+        self.__fadeChangedSpan = None
 
     def GetFilename(self):
         return os.path.basename(self.file)
@@ -122,21 +158,49 @@ class Event(GObject.GObject):
         if not self.gnlsrc in compositionElementsList:
             print("***** Adding event object to composition")
             self.instrument.composition.add(self.gnlsrc)
-            self.instrument.composition.emit("commit", True)
+            self.instrument.commit_composition()
         self.SetProperties()
-        self.instrument.composition.emit("commit", True)
+        self.instrument.commit_composition()
         for pad in self.instrument.composition.pads:
             print(pad.get_peer())
 
     #_____________________________________________________________________
 
+    def materialize(self):
+        """
+        Attaches the GStreamer source and the levels to an Event which
+        was loaded lazily, the first time it is needed for drawing,
+        playback or editing. Does nothing if that has already happened.
+        """
+        if self.isMaterialized:
+            return
+        self.isMaterialized = True
+        Globals.debug("Materializing event", self.id)
+
+        if self.isLoading or self.isRecording or self.levelsOutOfDate:
+            self.levelsOutOfDate = False
+            self.generate_waveform()
+        else:
+            levels_path = self.GetAbsLevelsFile()
+            try:
+                # mapped, so only the parts which get drawn are read from disk
+                self.levels_list.fromfile(levels_path)
+            except CorruptFileError:
+                Globals.debug("Cannot load levels from file", levels_path)
+            if not self.levels_list:
+                self.generate_waveform()
+        self.__UpdateAudioFadePoints()
+        self.CreateFilesource()
+
+    #_____________________________________________________________________
+
     def DestroyFilesource(self):
         """
         Removes the Gstreamer file source from the instrument's composition.
         """
         if self.gnlsrc in self.instrument.composition.children:
             self.instrument.composition.remove(self.gnlsrc)
-            self.instrument.composition.emit("commit", True)
+            self.instrument.commit_composition()
 
     #_____________________________________________________________________
 
@@ -146,6 +210,9 @@ class Event(GObject.GObject):
         """
         Globals.debug('hitting SetProperties')
         Globals.debug(self.file)
+        # materialize() sets them once there is a source
+        if not self.isMaterialized:
+            return
         if self.file:
             if self.single_decode_bin:
                 self.gnlsrc.remove(self.single_decode_bin)
@@ -201,10 +268,7 @@ class Event(GObject.GObject):
         params = doc.createElement("Parameters")
         ev.appendChild(params)
 
-        items = ["start", "duration", "isSelected",
-                  "name", "offset", "file", "filelabel", "levels_file",
-                  "isLoading", "isRecording"
-                ]
+        items = self.SAVED_PARAMETERS
 
         #Since we are saving the path to the project file, don't delete it on exit
         if self.GetAbsFile() in self.instrument.project.deleteOnCloseAudioFiles:
@@ -268,6 +332,8 @@ class Event(GObject.GObject):
         self.SetProperties()
         self.emit("position")
 
+        self.instrument.project.SaveIncrementalAction(IncrementalSave.EventAction(self))
+
     #_____________________________________________________________________
 
     def _Compat09_Move(self, frm, to, _undoAction_):
@@ -318,9 +384,11 @@ class Event(GObject.GObject):
         if eventID >= 0:
             e = [x for x in self.instrument.graveyard if x.id == eventID][0]
             self.instrument.graveyard.remove(e)
+            e.materialize()
         else:
             e = Event(self.instrument, self.file)
         e.name = self.name
+        self.materialize()
 
         dur = self.selection[1] - self.selection[0]
 
@@ -370,12 +438,14 @@ class Event(GObject.GObject):
         Returns:
             the newly created event.
         """
+        self.materialize()
         dur = self.duration
 
         #if we were given an event ID, reuse that event instead of creating a new one
         if eventID >= 0:
             e = [x for x in self.instrument.graveyard if x.id == eventID][0]
             self.instrument.graveyard.remove(e)
+            e.materialize()
         else:
             e = Event(self.instrument, self.file)
         e.name = self.name
@@ -429,6 +499,10 @@ class Event(GObject.GObject):
         self.emit("position")
         self.instrument.emit("event::added", e)
 
+        project = self.instrument.project
+        project.SaveIncrementalAction(IncrementalSave.EventAction(self))
+        project.SaveIncrementalAction(IncrementalSave.EventAction(e))
+
         #undo parameters
         #self.temp = e.id
         #self.temp2 = cutRightSide
@@ -448,14 +522,16 @@ class Event(GObject.GObject):
         eventObjectList = [x for x in self.instrument.events if x.id == joinEvent]
         if eventObjectList:
             joinEvent = eventObjectList[0]
+        self.materialize()
+        joinEvent.materialize()
 
         if joinToRight:
             self.temp = self.duration
 
-            for key, value in joinEvent.__fadePointsDict.iteritems():
+            for key, value in joinEvent.__fadePointsDict.items():
                 self.__fadePointsDict[key + self.duration] = value
             #remove the point on either edge that was created when they were split
-            if self.__fadePointsDict.has_key(self.duration):
+            if self.duration in self.__fadePointsDict:
                 del self.__fadePointsDict[self.duration]
 
             old_duration = int(self.duration * 1000)
@@ -469,28 +545,30 @@ class Event(GObject.GObject):
             self.start = joinEvent.start
             self.offset = joinEvent.offset
 
-            old_duration = int(self.duration * 1000)
             self.duration += joinEvent.duration
-            #self.levels_list = LevelsList.add(old_duration, joinEvent.levels_list, self.levels_list)
-            self.levels_list = LevelsList.add(joinEvent.levels_list, self.levels_list)
+            # our levels now come after the ones of the joined event
+            self.levels_list = levelslist.add(joinEvent.levels_list, self.levels_list,
+                                              int(joinEvent.duration * 1000))
             newDict = joinEvent.__fadePointsDict.copy()
-            for key, value in self.__fadePointsDict.iteritems():
+            for key, value in self.__fadePointsDict.items():
                 newDict[key + joinEvent.duration] = value
             #remove the point on either edge that was created when they were split
-            if newDict.has_key(joinEvent.duration):
+            if joinEvent.duration in newDict:
                 del newDict[joinEvent.duration]
             self.__fadePointsDict = newDict
             self.__UpdateAudioFadePoints()
 
         #create an undo action that is not attached to the project so that
         # the following delete will not be undone (it will be re-split not resurrected)
-        nullAction = UndoSystem.AtomicUndoAction()
+        #nullAction = UndoSystem.AtomicUndoAction()
         # Now that they're joined, move delete the rightEvent
-        joinEvent.Delete(_undoAction_=nullAction)
+        joinEvent.Delete() #_undoAction_=nullAction)
 
         self.emit("length")
         self.emit("position")
 
+        self.instrument.project.SaveIncrementalAction(IncrementalSave.EventAction(self))
+
         self.temp2 = joinToRight
         self.temp3 = joinEvent.id
 
@@ -651,41 +729,54 @@ class Event(GObject.GObject):
         """
         if message.type == Gst.MessageType.EOS:
             Globals.debug("Victory flag")
+            self.__FlushLevels()
             # Update levels for partial events
             q = self.loadingPipeline.query_duration(Gst.Format.TIME)
             length = float(q[0] / float(Gst.SECOND))
 
-            #we're at EOS, and still have no value for duration
-            if not self.duration or self.duration < 1:
-                if length:
-                    self.duration = length
-                else:
-                    self.duration = self.loadingLength
-
-            if self.levels_list:
-                final_endtime = self.levels_list[-1][0]
-                if final_endtime > int(self.duration * 1000):
-                    Globals.debug("Event %d: duration (%f) is less than last level endtime (%d)."
-                                  % (self.id, self.duration, final_endtime))
-                    self.duration = final_endtime / 1000.0
-                    #self.SetProperties()
-                    Globals.debug("\tduration has been increased to", self.duration)
-
-            if length and (self.offset > 0 or self.duration != length):
-                starttime = int(self.offset * 1000)
-                stoptime = int((self.offset + self.duration) * 1000)
-                self.levels_list = self.levels_list.slice_by_endtime(starttime, stoptime)
-
-            # We're done with the bin so release it
-
-            self.StopGenerateWaveform()
-
-            # Signal to interested objects that we've changed
-            self.emit("waveform")
+            self.__FinishLoading(length)
             return False
 
     #_____________________________________________________________________
 
+    def __FinishLoading(self, length):
+        """
+        Finalises the levels list once the whole file has been rendered,
+        and stops the loading.
+
+        Parameters:
+            length -- the length of the audio file in seconds, or 0 if unknown.
+        """
+        #we're at EOS, and still have no value for duration
+        if not self.duration or self.duration < 1:
+            if length:
+                self.duration = length
+            else:
+                self.duration = self.loadingLength
+
+        if self.levels_list:
+            final_endtime = self.levels_list[-1][0]
+            if final_endtime > int(self.duration * 1000):
+                Globals.debug("Event %d: duration (%f) is less than last level endtime (%d)."
+                              % (self.id, self.duration, final_endtime))
+                self.duration = final_endtime / 1000.0
+                #self.SetProperties()
+                Globals.debug("\tduration has been increased to", self.duration)
+
+        if length and (self.offset > 0 or self.duration != length):
+            starttime = int(self.offset * 1000)
+            stoptime = int((self.offset + self.duration) * 1000)
+            self.levels_list = self.levels_list.slice_by_endtime(starttime, stoptime)
+
+        # We're done with the bin so release it
+
+        self.StopGenerateWaveform()
+
+        # Signal to interested objects that we've changed
+        self.emit("waveform")
+
+    #_____________________________________________________________________
+
     def bus_message_statechange(self, bus, message):
         """
         Handler for the GStreamer statechange message.
@@ -758,8 +849,39 @@ class Event(GObject.GObject):
 
     def generate_waveform(self):
         """
-        Renders the level information for the GUI.
+        Renders the level information for the GUI. The event is queued in
+        the project's WaveformScheduler, which starts the rendering once
+        there is a free worker for it.
         """
+        self.levels_list = LevelsList()
+        self.__pendingLevels = []
+        self.isLoading = True
+        self.emit("loading")
+
+        self.instrument.project.waveformScheduler.schedule(self)
+
+    #_____________________________________________________________________
+
+    def start_waveform_generation(self):
+        """
+        Starts rendering the level information, called by the WaveformScheduler.
+        When numpy is available the file is analysed faster than real time
+        on a worker thread, otherwise the levels are collected from the
+        level messages of a pipeline playing the file.
+        """
+        if WaveformAnalyser.is_available():
+            self.levels_list = LevelsList()
+            self.__pendingLevels = []
+            self.analyser = WaveformAnalyser(self.GetAbsFile(), self.LEVEL_INTERVAL)
+            self.analyser.connect("progress", self.analyser_progress)
+            self.analyser.connect("finished", self.analyser_finished)
+            self.analyser.connect("error", self.analyser_error)
+            self.isLoading = True
+            self.emit("loading")
+
+            self.analyser.start()
+            return
+
         pipe = """filesrc name=src ! decodebin ! audioconvert ! level message=true name=level_element ! fakesink"""
         self.loadingPipeline = Gst.parse_launch(pipe)
 
@@ -778,6 +900,7 @@ class Event(GObject.GObject):
         self.bus.connect("message::error", self.bus_error)
 
         self.levels_list = LevelsList()
+        self.__pendingLevels = []
         self.isLoading = True
         self.emit("loading")
 
@@ -785,6 +908,48 @@ class Event(GObject.GObject):
 
     #_____________________________________________________________________
 
+    def analyser_progress(self, analyser, seconds):
+        """
+        Callback for when the WaveformAnalyser has analysed more of the file.
+
+        Parameters:
+            analyser -- the WaveformAnalyser reporting the progress.
+            seconds -- the amount of audio analysed so far.
+        """
+        self.loadingLength = seconds
+        if self.loadingLength != self.lastEnd:
+            self.lastEnd = self.loadingLength
+            self.emit("length") # tell the GUI
+
+    #_____________________________________________________________________
+
+    def analyser_finished(self, analyser, levels_list, length):
+        """
+        Callback for when the WaveformAnalyser has analysed the whole file.
+
+        Parameters:
+            analyser -- the WaveformAnalyser which is done.
+            levels_list -- the LevelsList of the whole file.
+            length -- the length of the file in seconds.
+        """
+        self.levels_list = levels_list
+        self.__FinishLoading(length)
+
+    #_____________________________________________________________________
+
+    def analyser_error(self, analyser, message):
+        """
+        Callback for when the WaveformAnalyser could not decode the file.
+
+        Parameters:
+            analyser -- the WaveformAnalyser which failed.
+            message -- the error message.
+        """
+        Globals.debug("Event analyser error:", message)
+        self.emit("corrupt", message)
+
+    #_____________________________________________________________________
+
     def CopyAndGenerateWaveform(self, uri):
         """
         Copies the audio file to the new file location and reads the levels
@@ -828,6 +993,44 @@ class Event(GObject.GObject):
 
     #_____________________________________________________________________
 
+    def import_progress(self, fraction):
+        """
+        Called by the AudioStore as more of the file is copied.
+
+        Parameters:
+            fraction -- the fraction of the file copied so far.
+        """
+        changed = int(fraction * 100) != int(self.importProgress * 100)
+        self.importProgress = fraction
+        if changed:
+            self.emit("loading") # tell the GUI
+
+    #_____________________________________________________________________
+
+    def finish_import(self, file):
+        """
+        Called by the AudioStore once the file is stored in the project's
+        audio directory. From then on the stored file is played instead of
+        the original one.
+
+        Parameters:
+            file -- the name of the stored file, or None if it couldn't be stored.
+        """
+        self.isImporting = False
+        if file:
+            self.file = file
+            self.SetProperties()
+            self.instrument.commit_composition()
+            self.instrument.project.SaveIncrementalAction(IncrementalSave.EventAction(self))
+            # the original file couldn't be analysed while it was copied
+            if not self.isLoading and not self.levels_list:
+                self.instrument.load_or_generate_levels(self)
+        elif not os.path.exists(self.GetAbsFile()):
+            self.emit("corrupt", _("The file could not be copied into the project."))
+        self.emit("loading")
+
+    #_____________________________________________________________________
+
     def StopGenerateWaveform(self, finishedLoading=True):
         """
         Stops the internal pipeline that loads the waveform from this event's file.
@@ -838,22 +1041,36 @@ class Event(GObject.GObject):
         """
         Globals.debug("Running stop generate wave form")
 
+        # also cancels the rendering if it hasn't started yet
+        self.instrument.project.waveformScheduler.remove(self)
+
         if self.bus:
             self.bus.remove_signal_watch()
             self.bus = None
-        if self.loadingPipeline:
-            self.loadingPipeline.set_state(Gst.State.NULL)
+        if self.loadingPipeline or self.analyser:
+            if self.analyser:
+                # does nothing if the analysis has already finished
+                self.analyser.cancel()
+                self.analyser = None
+            if self.loadingPipeline:
+                self.loadingPipeline.set_state(Gst.State.NULL)
 
             if finishedLoading and self.levels_list:
                 self.levels_list.tofile(self.GetAbsLevelsFile())
                 del_on_close_list = self.instrument.project.deleteOnCloseAudioFiles
                 # this event might not be in the project file yet
                 # if so, levels_file should be deleted when audio file is deleted on exit
-                if self.GetAbsFile() in del_on_close_list:
+                if self.GetAbsFile() in del_on_close_list and \
+                        self.GetAbsLevelsFile() not in del_on_close_list:
                     del_on_close_list.append(self.GetAbsLevelsFile())
 
-                #inc = IncrementalSave.CompleteLoading(self.id, self.duration, self.levels_file)
-                #self.instrument.project.SaveIncrementalAction(inc)
+                # only the levels of the whole file are worth sharing
+                if self.levelsCacheKey and not self.offset:
+                    LevelsCache.get_cache().store(self.levelsCacheKey, self.levels_list)
+                self.levelsCacheKey = None
+
+                inc = IncrementalSave.EventAction(self)
+                self.instrument.project.SaveIncrementalAction(inc)
 
             if self.isDownloading:
                 # If we are currently downloading, we can't restart later,
@@ -902,24 +1119,57 @@ class Event(GObject.GObject):
     #_____________________________________________________________________
 
     def __AppendLevelToList(self, structure):
-        (end, peaks) = Utils.CalculateAudioLevelFromStructure(structure)
-
-        # the last level may be sent twice. If timestamp is the same, ignore it.
-        # print(self.levels_list)
-        # print(len(self.levels_list))
-        # FIXME this is sus
-        # if self.levels_list and len(self.levels_list) > 100 and self.levels_list[-1][0] == end:
-        #     return
+        """
+        Queues the per channel RMS and peak levels of a level message.
+        They are converted and added to the levels list in batches of
+        LEVEL_BATCH_SIZE messages.
 
+        Parameters:
+            structure -- the structure of the level message.
+        """
         # work around GStreamer bug where stream time will be -1 (indicating error)
         # and then cast to guint64 which results in the maximum 64-bit integer value.
         # In this case stream-time and endtime are bogus values, but duration is still correct.
         stream_time = structure.get_value("stream-time")
         if stream_time == ((2**64) - 1):
+            end = None
             delta = int(structure.get_value("duration") / Utils.NANO_TO_MILLI_DIVISOR)
-            self.levels_list.append_time_delta(delta, peaks)
         else:
-            self.levels_list.append(end, peaks)
+            end = int(structure.get_value("endtime") / Utils.NANO_TO_MILLI_DIVISOR)
+            delta = None
+
+        self.__pendingLevels.append((end, delta, structure.get_value("rms"), structure.get_value("peak")))
+        if len(self.__pendingLevels) >= self.LEVEL_BATCH_SIZE:
+            self.__FlushLevels()
+
+    #_____________________________________________________________________
+
+    def __FlushLevels(self):
+        """
+        Converts all the queued level messages at once and adds them to the levels list.
+        """
+        pending = self.__pendingLevels
+        if not pending:
+            return
+        self.__pendingLevels = []
+
+        decibels = []
+        for end, delta, rms, peak in pending:
+            decibels.extend(rms)
+            decibels.extend(peak)
+        levels = Utils.DecibelsToLevels(decibels)
+
+        index = 0
+        for end, delta, rms, peak in pending:
+            channels = len(rms)
+            rmsLevels = levels[index:index + channels]
+            peakLevels = levels[index + channels:index + channels * 2]
+            index += channels * 2
+
+            if end is None:
+                self.levels_list.append_time_delta(delta, rmsLevels, peakLevels)
+            else:
+                self.levels_list.append(end, rmsLevels, peakLevels)
 
     #_____________________________________________________________________
 
@@ -1035,6 +1285,7 @@ class Event(GObject.GObject):
             self.__fadePointsDict[secondPoint] = secondVolume
 
         self.__UpdateAudioFadePoints()
+        self.instrument.project.SaveIncrementalAction(IncrementalSave.EventAction(self))
 
     #_____________________________________________________________________
 
@@ -1078,6 +1329,34 @@ class Event(GObject.GObject):
             del self.__fadePointsDict[secondPoint]
 
         self.__UpdateAudioFadePoints()
+        self.instrument.project.SaveIncrementalAction(IncrementalSave.EventAction(self))
+
+    #_____________________________________________________________________
+
+    def get_audio_fade_points(self):
+        """
+        Works out the fade points of this Event from the saved ones, which
+        are there whether or not the Event has been materialized.
+
+        Returns:
+            a list of (time, volume) tuples ordered by time, with points at
+            the beginning and the end of the event, or an empty list if
+            there are no fade points at all.
+        """
+        fadePoints = sorted(self.__fadePointsDict.items())
+
+        #only add beginning and end points if there are some other points already in the list
+        if fadePoints:
+            #if there is no point at the beginning, make one with the
+            #same value as the first fade point. This makes the first fade
+            #extend back to the beginning.
+            if fadePoints[0][0] != 0.0:
+                fadePoints.insert(0, (0.0, fadePoints[0][1]))
+            #same as above but for the end of the event.
+            if fadePoints[-1][0] != self.duration:
+                fadePoints.append((self.duration, fadePoints[-1][1]))
+
+        return fadePoints
 
     #_____________________________________________________________________
 
@@ -1091,28 +1370,52 @@ class Event(GObject.GObject):
         it is a list, so accessing the contents in order is much faster.
         """
 
-        #update the fade points list from the dictionary
-        # self.audioFadePoints = self.__fadePointsDict.items()
-        #dicts dont have order, so sort after update
-        # self.audioFadePoints.sort(key=lambda x: x[0])
-        self.audioFadePoints = list({k: self.__fadePointsDict[k] for k in sorted(self.__fadePointsDict)}.items())
+        oldFadePoints = self.audioFadePoints
+        self.audioFadePoints = self.get_audio_fade_points()
 
+        # the fade levels are only calculated when they are drawn
+        self.__AddChangedFadeSpan(oldFadePoints, self.audioFadePoints)
+        self.emit("waveform")
 
-        #only add beginning and end points if there are some other points already in the list
-        if self.audioFadePoints:
-            #if there is no point at the beginning, make one with the
-            #same value as the first fade point. This makes the first fade
-            #extend back to the beginning.
-            if self.audioFadePoints[0][0] != 0.0:
-                first = (0.0, self.audioFadePoints[0][1])
-                self.audioFadePoints.insert(0, first)
-            #same as above but for the end of the event.
-            if self.audioFadePoints[-1][0] != self.duration:
-                last = (self.duration, self.audioFadePoints[-1][1])
-                self.audioFadePoints.append(last)
+    #_____________________________________________________________________
 
-        self.__UpdateFadeLevels()
-        self.emit("waveform")
+    def __AddChangedFadeSpan(self, oldFadePoints, newFadePoints):
+        """
+        Private function that works out which part of the event is
+        affected by a change of the fade points, and adds it to the span
+        which __UpdateFadeLevels has to scale again.
+
+        Parameters:
+            oldFadePoints -- the audioFadePoints before the change.
+            newFadePoints -- the audioFadePoints after the change.
+        """
+        if oldFadePoints == newFadePoints:
+            return
+
+        shortest = min(len(oldFadePoints), len(newFadePoints))
+
+        #the points at the beginning which haven't changed
+        front = 0
+        while front < shortest and oldFadePoints[front] == newFadePoints[front]:
+            front += 1
+        #the points at the end which haven't changed
+        back = 0
+        while back < shortest - front and oldFadePoints[-1 - back] == newFadePoints[-1 - back]:
+            back += 1
+
+        #the curve changes from the last unchanged point before the
+        #changed ones, up to the first unchanged point after them
+        start = newFadePoints[front - 1][0] if front else 0.0
+        stop = newFadePoints[-back][0] if back else None
+
+        if self.__fadeChangedSpan:
+            oldStart, oldStop = self.__fadeChangedSpan
+            start = min(start, oldStart)
+            if stop is not None and oldStop is not None:
+                stop = max(stop, oldStop)
+            else:
+                stop = None
+        self.__fadeChangedSpan = (start, stop)
 
     #_____________________________________________________________________
 
@@ -1122,56 +1425,28 @@ class Event(GObject.GObject):
         all the fade leves to update the fadeLevels list. The fadeLevels
         list is a cache of faded levels as they will be shown on the screen
         so that we don't have to calculate them everytime we draw.
+        If the levels haven't changed, only the span where the fade points
+        have changed is scaled again.
         """
         if not self.audioFadePoints or len(self.audioFadePoints) < 2:
             Globals.debug("Event", self.id, ": no fade points to use")
             #there are no fade points for us to use
             return
 
-        self.fadeLevels = LevelsList()
+        fadeTimes = [int(sec * 1000) for sec, vol in self.audioFadePoints]    #convert to milliseconds
+        fadeValues = [vol for sec, vol in self.audioFadePoints]
 
-        iterFadePoints = iter(self.audioFadePoints)
-        firstFadeTime, firstFadeValue = next(iterFadePoints)
-        firstFadeTime = int(firstFadeTime * 1000)    #convert to milliseconds
-        secondFadeTime, secondFadeValue = next(iterFadePoints)
-        secondFadeTime = int(secondFadeTime * 1000)    #convert to milliseconds
-        # if less than one percent difference, assume they are the same
-        sameValues = abs(firstFadeValue - secondFadeValue) < 0.01
-
-        if not sameValues:
-            slope = (secondFadeValue - firstFadeValue) / (secondFadeTime - firstFadeTime)
-
-        for endtime, peak in self.levels_list:
-            # check if we have moved into the next fade point pair
-            # don't care about 1 millisecond difference, its rounding error
-            if endtime > (secondFadeTime + 1):
-                firstFadeTime = secondFadeTime
-                firstFadeValue = secondFadeValue
-                try:
-                    secondFadeTime, secondFadeValue = next(iterFadePoints)
-                except StopIteration:
-                    Globals.debug("Event %d: endtime (%d) is after last fade point (%d,%d)"
-                                  % (self.id, endtime, secondFadeTime, secondFadeValue))
-
-                secondFadeTime = int(secondFadeTime * 1000)    #convert to milliseconds
-
-                # if less than one percent difference, assume they are the same
-                sameValues = abs(firstFadeValue - secondFadeValue) < 0.01
-                if not sameValues:
-                    # the fade line is not flat, so calculate the slope of it
-                    slope = (secondFadeValue - firstFadeValue) / (secondFadeTime - firstFadeTime)
-
-            if sameValues:
-                #no fade here, the same volume continues across
-                self.fadeLevels.append(endtime, [int(peak * firstFadeValue)])
-            else:
-                rel_time = endtime - firstFadeTime
-                peak_delta = slope * rel_time
-                new_fade_value = firstFadeValue + peak_delta
-                assert new_fade_value <= 1.0        # a fade cannot be more than 100%
-                peak = int(peak * new_fade_value)
+        if self.__fadeSource is not self.levels_list or len(self.fadeLevels) != len(self.levels_list):
+            self.fadeLevels = self.levels_list.scale_by_fade(fadeTimes, fadeValues)
+            self.__fadeSource = self.levels_list
+        elif self.__fadeChangedSpan:
+            start, stop = self.__fadeChangedSpan
+            if stop is not None:
+                stop = int(stop * 1000)
+            self.fadeLevels.refade(self.levels_list, fadeTimes, fadeValues, int(start * 1000), stop)
+
+        self.__fadeChangedSpan = None
 
-                self.fadeLevels.append(endtime, [peak])
     #_____________________________________________________________________
 
     def GetFadeLevels(self):
@@ -1188,7 +1463,8 @@ class Event(GObject.GObject):
         if not self.audioFadePoints:
             return self.levels_list
 
-        if len(self.fadeLevels) != len(self.levels_list):
+        if self.__fadeChangedSpan or self.__fadeSource is not self.levels_list or \
+                len(self.fadeLevels) != len(self.levels_list):
             self.__UpdateFadeLevels()
             assert len(self.fadeLevels) == len(self.levels_list)
 
@@ -1250,7 +1526,7 @@ class Event(GObject.GObject):
             for i in removeList:
                 self.RemoveAudioFadePoints(i, None)
 
-    def store_to_xml(self, doc, parent, graveyard=False):
+    def store_to_xml(self, doc, parent, graveyard=False, levels_files=None):
         """
         Converts this Event into an XML representation suitable for saving to a file.
 
@@ -1260,6 +1536,9 @@ class Event(GObject.GObject):
                         be added to.
             graveyard -- True if this Event is on the graveyard stack,
                         and should be serialized as a dead Event.
+            levels_files -- a list to add the (LevelsList, path) pair of the
+                        levels file to, for writing it later, or None to
+                        write the levels file right away.
         """
         if graveyard:
             ev = doc.createElement("DeadEvent")
@@ -1271,10 +1550,7 @@ class Event(GObject.GObject):
         params = doc.createElement("Parameters")
         ev.appendChild(params)
 
-        items = ["start", "duration", "isSelected",
-                  "name", "offset", "file", "filelabel", "levels_file",
-                  "isLoading", "isRecording"
-                ]
+        items = self.SAVED_PARAMETERS
 
         #Since we are saving the path to the project file, don't delete it on exit
         if self.GetAbsFile() in self.instrument.project.deleteOnCloseAudioFiles:
@@ -1287,8 +1563,12 @@ class Event(GObject.GObject):
         # FIXME restore fade point system
         Utils.store_dictionary_to_xml(doc, xmlPoints, self.__fadePointsDict, "FadePoint")
 
-        if self.levels_list:
+        if self.levels_list and levels_files is None:
             self.levels_list.tofile(self.GetAbsLevelsFile())
+        elif self.levels_list:
+            # written by another thread, while the levels may still be
+            # loaded, joined, split or refaded here
+            levels_files.append((self.levels_list.copy(), self.GetAbsLevelsFile()))
         if self.GetAbsLevelsFile() in self.instrument.project.deleteOnCloseAudioFiles:
             self.instrument.project.deleteOnCloseAudioFiles.remove(self.GetAbsLevelsFile())
 
@@ -1,10 +1,10 @@
 from gi.repository import Gtk, Gdk, Graphene, Gio
 import cairo
 from .utils import Utils
-import itertools
 import sys
 import os
 from .settings import Settings
+from .waveformtilecache import WaveformTileCache
 
 class EventViewer(Gtk.DrawingArea):
     """
@@ -22,6 +22,10 @@ class EventViewer(Gtk.DrawingArea):
     #making this bigger will make the waveform less crowed but also less detailed
     _MIN_POINT_SEPARATION = 2
 
+    #how far outside of a tile its waveform is drawn from, so that
+    #the ends of the waveform path don't show at the edges of the tile
+    _TILE_MARGIN = 8
+
     #the width and height of the volume curve handles
     _PIXX_FADEMARKER_WIDTH = 30
     _PIXY_FADEMARKER_HEIGHT = 11
@@ -44,6 +48,7 @@ class EventViewer(Gtk.DrawingArea):
     _PLAY_POSITION_RGB = (1, 0, 0)
     _HIGHLIGHT_POSITION_RGB = (0, 0, 1)
     _FADELINE_RGB = (1, 0.6, 0.6)
+    _PEAK_RGBA = (114./255, 159./255, 207./255, 0.4)
 
     def __init__(self, lane, project, event, height):
         """
@@ -94,7 +99,7 @@ class EventViewer(Gtk.DrawingArea):
         self.isDraggingFade = False        # True if the user is dragging a fade marker
         self.lane = lane                # The parent lane for this object
         self.currentScale = 0            # Tracks if the project view_scale has changed
-        self.redrawWaveform = False        # Force redraw the cached waveform on next expose event
+        self.redrawWaveform = False        # Force redraw the cached waveform tiles on next expose event
         #boolean; if the drawer should be at the left of current selection
         #otherwise it will be put on the right
         self.drawerAlignToLeft = True
@@ -105,16 +110,9 @@ class EventViewer(Gtk.DrawingArea):
         # self.SetAccessibleName()
         # self.set_property("can-focus", True)
 
-        # sourceSmall/Large are offscreen canvases to hold our waveform images
-        # self.sourceSmall = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
-        self.sourceLarge = cairo.ImageSurface(cairo.FORMAT_ARGB32, 0, 0)
-
-        # rectangle of cached draw areas
-        # self.cachedDrawAreaSmall = Utils.GdkRectangle(0, 0, 0, 0)
-        self.cachedDrawAreaLarge = Utils.GdkRectangle(0, 0, 0, 0)
-
         # Monitor the things this object cares about
         self.project.connect("zoom", self.OnProjectZoom)
+        self.project.connect("view-start", self.OnProjectViewStart)
         self.event.connect("waveform", self.OnEventWaveform)
         self.event.connect("position", self.OnEventPosition)
         self.event.connect("length", self.OnEventLength)
@@ -191,34 +189,31 @@ class EventViewer(Gtk.DrawingArea):
             False -- stop propagating the GTK signal. *CHECK*
         """
         #print("********* DRAW HAPPENS")
-        # if self.small:
-        #     cache = self.cachedDrawAreaSmall
-        #     source = self.sourceSmall
-        # else:
-        cache = self.cachedDrawAreaLarge
-        source = self.sourceLarge
         #success, area = Gdk.cairo_get_clip_rectangle(cairo_ctx)
         area = Utils.GdkRectangle(0, 0, self.get_width(), self.get_height())
+        visibleArea = self.GetVisibleArea()
+
+        # waveforms which can be seen are generated before the others
+        scheduler = self.project.waveformScheduler
+        if self.event.isLoading and scheduler.is_queued(self.event) and visibleArea:
+            scheduler.prioritise(self.event)
 
-        #check if the expose area is within the already cached rectangle
-        if area.x < cache.x or (area.x + area.width > cache.x + cache.width) or self.redrawWaveform:
-            self.DrawWaveform(area)
-            # if self.small:
-            #     cache = self.cachedDrawAreaSmall
-            #     source = self.sourceSmall
-            # else:
-            cache = self.cachedDrawAreaLarge
-            source = self.sourceLarge
+        # events of a project being opened are only set up once they are seen
+        if visibleArea:
+            self.event.materialize()
+
+        if self.redrawWaveform:
+            WaveformTileCache.get_cache().invalidate(self)
+            self.redrawWaveform = False
 
         # Get a cairo surface for this drawing op
         #context = widget.get_window().cairo_create()
         context = cairo_ctx
 
-        # Give it our waveform image as a source
-        context.set_source_surface(source, cache.x, cache.y)
-
         # Blit our waveform across
-        context.paint()
+        if visibleArea:
+            self.DrawWaveform(context, visibleArea)
+        self.DrawLabel(context)
 
         # Overlay an extra rect if we're selected
         if self.event.isSelected:
@@ -323,41 +318,93 @@ class EventViewer(Gtk.DrawingArea):
 
     #_____________________________________________________________________
 
-    def DrawWaveform(self, exposeArea):
+    def GetVisibleArea(self):
+        """
+        Obtain the part of this widget which is scrolled into view.
+
+        Returns:
+            the visible rectangle in widget coordinates,
+            or None if no part of this widget can be seen.
+        """
+        scrolledWindow = self.get_ancestor(Gtk.ScrolledWindow)
+        if not scrolledWindow:
+            return Utils.GdkRectangle(0, 0, self.get_width(), self.get_height())
+
+        # the bounds of the scrolled window, relative to us
+        success, bounds = scrolledWindow.compute_bounds(self)
+        if not success:
+            return None
+
+        x1 = max(0, int(bounds.origin.x))
+        y1 = max(0, int(bounds.origin.y))
+        x2 = min(self.get_width(), int(bounds.origin.x + bounds.size.width + 1))
+        y2 = min(self.get_height(), int(bounds.origin.y + bounds.size.height + 1))
+        if x2 <= x1 or y2 <= y1:
+            return None
+
+        return Utils.GdkRectangle(x1, y1, x2 - x1, y2 - y1)
+
+    #_____________________________________________________________________
+
+    def DrawWaveform(self, context, exposeArea):
         """
-        Uses Cairo to draw the waveform level information onto a canvas in memory.
+        Paints the waveform tiles which cover the exposed area, drawing
+        the ones which are not in the WaveformTileCache yet.
 
         Parameters:
-            exposeArea -- Cairo exposed area in which to draw the waveform.
+            context -- Cairo context of this widget.
+            exposeArea -- area of this widget in which to paint the waveform.
+        """
+        cache = WaveformTileCache.get_cache()
+        tileWidth = WaveformTileCache.TILE_WIDTH
+        height = self.get_height()
+        if height <= 0:
+            return
+
+        # one more tile on either side is ready for when we are scrolled
+        first = max(exposeArea.x // tileWidth - 1, 0)
+        last = min((exposeArea.x + exposeArea.width) // tileWidth + 1,
+                   max(self.get_width() - 1, 0) // tileWidth)
+
+        for index in range(first, last + 1):
+            surface = cache.lookup(self, self.project.view_scale, index, height)
+            if surface is None:
+                surface = self.DrawTile(index, height)
+                cache.store(self, self.project.view_scale, index, height, surface)
+
+            context.set_source_surface(surface, index * tileWidth, 0)
+            context.rectangle(index * tileWidth, 0, tileWidth, height)
+            context.fill()
+
+    #_____________________________________________________________________
+
+    def DrawTile(self, index, height):
         """
-        allocArea = self.get_allocation()
+        Uses Cairo to draw one tile of the waveform level information onto a canvas in memory.
 
-        rect = Utils.GdkRectangle(exposeArea.x - exposeArea.width, exposeArea.y,
-                                 exposeArea.width*3, exposeArea.height)
+        Parameters:
+            index -- the position of the tile, counting from the left in tile widths.
+            height -- the height of the tile in pixels.
 
-        #Check if our area to cache is outside the allocated area
-        if rect.x < 0:
-            rect.x = 0
-        if rect.x + rect.width > allocArea.width:
-            rect.width = allocArea.width - rect.x
+        Returns:
+            the cairo.ImageSurface of the tile.
+        """
+        tileWidth = WaveformTileCache.TILE_WIDTH
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, tileWidth, height)
+        context = cairo.Context(surface)
 
-        #set area to record where the cached surface goes
-        # if self.small:
-        #     self.cachedDrawAreaSmall = rect
-        #     self.sourceSmall = cairo.ImageSurface(cairo.FORMAT_ARGB32,
-        #                                           rect.width, rect.height)
-        #     context = cairo.Context(self.sourceSmall)
-        # else:
-        self.cachedDrawAreaLarge = rect
-        self.sourceLarge = cairo.ImageSurface(cairo.FORMAT_ARGB32,
-                                              rect.width, rect.height)
-        context = cairo.Context(self.sourceLarge)
+        # the waveform is drawn from a little to the left of the tile
+        # up to a little to the right of it
+        x = index * tileWidth
+        origin = max(x - self._TILE_MARGIN, 0)
+        width = x + tileWidth + self._TILE_MARGIN - origin
+        context.translate(origin - x, 0)
 
         context.set_line_width(2)
         context.set_antialias(cairo.ANTIALIAS_SUBPIXEL)
 
         # Draw white background
-        context.rectangle(0, 0, rect.width, rect.height)
+        context.rectangle(0, 0, width, height)
         context.set_source_rgb(*self._BACKGROUND_RGB)
         context.fill()
 
@@ -367,49 +414,43 @@ class EventViewer(Gtk.DrawingArea):
             else:
                 duration = self.event.duration
 
-            context.move_to(0,rect.height)
-
-            levels = self.event.GetFadeLevels()
-            length = len(levels)
-
-            # time offset of the start of the drawing area in milliseconds
-            starting_time = int(rect.x / self.project.view_scale * 1000)
-            starting_index = levels.find_endtime_index(starting_time)
-
-            x = 0
-            last_x = -2
-            skip_list = []
-            iterator = itertools.islice(levels, starting_index, length)
-            for endtime, peak in iterator:
-                x = int((endtime - starting_time) * self.project.view_scale / 1000)
-
-                peakOnScreen = int(peak * rect.height / sys.maxsize)
-                skip_list.append(peakOnScreen)
-                if (x - last_x) < self._MIN_POINT_SEPARATION:
-                    continue
-
-                peakOnScreen = sum(skip_list) / len(skip_list)
-                context.line_to(x, rect.height - peakOnScreen)
-
-                skip_list = []
-                last_x = x
-                if x > rect.width:
-                    break
-
-            context.line_to(x, rect.height)
-
-            #levels gradient fill
-            gradient = cairo.LinearGradient(0.0, 0.0, 0, rect.height)
-            gradient.add_color_stop_rgba(*self._OPAQUE_GRADIENT_STOP_ORGBA)
-            gradient.add_color_stop_rgba(*self._TRANSPARENT_GRADIENT_STOP_ORGBA)
-            context.set_source(gradient)
-            context.fill_preserve()
-
-            #levels path (on top of the fill)
-            context.set_source_rgb(*self._BORDER_RGB)
-            context.set_line_join(cairo.LINE_JOIN_ROUND)
-            context.set_line_width(self._LINE_WIDTH)
-            context.stroke()
+            # pick the level of detail from the peak pyramid which has
+            # about one point per _MIN_POINT_SEPARATION pixels at this zoom
+            min_interval = self._MIN_POINT_SEPARATION * 1000.0 / self.project.view_scale
+            levels = self.event.GetFadeLevels().get_tier(min_interval)
+
+            # start with the last point before the drawing area, so that
+            # the waveform path doesn't begin inside of it
+            starting_time = int(origin / self.project.view_scale * 1000)
+            starting_index = max(levels.find_endtime_index(starting_time) - 1, 0)
+
+            # every channel is drawn in a lane of its own
+            laneHeight = height / float(max(len(levels.channels), 1))
+            for channel in range(len(levels.channels)):
+                top = channel * laneHeight
+
+                if levels.peaks:
+                    #peak levels behind the RMS levels
+                    self.TraceLevels(context, levels.iter_channel(starting_index, channel, True),
+                                     origin, top, laneHeight, width)
+                    context.set_source_rgba(*self._PEAK_RGBA)
+                    context.fill()
+
+                self.TraceLevels(context, levels.iter_channel(starting_index, channel),
+                                 origin, top, laneHeight, width)
+
+                #levels gradient fill
+                gradient = cairo.LinearGradient(0.0, top, 0, top + laneHeight)
+                gradient.add_color_stop_rgba(*self._OPAQUE_GRADIENT_STOP_ORGBA)
+                gradient.add_color_stop_rgba(*self._TRANSPARENT_GRADIENT_STOP_ORGBA)
+                context.set_source(gradient)
+                context.fill_preserve()
+
+                #levels path (on top of the fill)
+                context.set_source_rgb(*self._BORDER_RGB)
+                context.set_line_join(cairo.LINE_JOIN_ROUND)
+                context.set_line_width(self._LINE_WIDTH)
+                context.stroke()
 
         if self.event.audioFadePoints:
             pixelPoints = []
@@ -417,11 +458,11 @@ class EventViewer(Gtk.DrawingArea):
             context.set_source_rgb(*self._FADELINE_RGB)
 
             firstPoint = self.event.audioFadePoints[0]
-            pixx = self.PixXFromSec(firstPoint[0]) - rect.x
+            pixx = self.PixXFromSec(firstPoint[0]) - origin
             pixy = self.PixYFromVol(firstPoint[1])
             context.move_to(pixx, pixy)
             for sec, vol in self.event.audioFadePoints[1:]:
-                pixx = self.PixXFromSec(sec) - rect.x
+                pixx = self.PixXFromSec(sec) - origin
                 pixy = self.PixYFromVol(vol)
                 pixelPoints.append((pixx, pixy))
                 context.line_to(pixx,pixy)
@@ -432,46 +473,96 @@ class EventViewer(Gtk.DrawingArea):
                 context.arc(pixx, pixy, 3.5, 0, 7)
                 context.fill()
 
-        # Reset the drawing scale
-        context.identity_matrix()
-        context.scale(1.0, 1.0)
-
-        #check if we are at the beginning
-        if rect.x == 0:
-            context.set_source_rgb(*self._TEXT_RGB)
-            context.move_to(5, 15)
-
-            if self.event.isLoading:
-                # Write "Loading..." or "Downloading..."
-                if self.event.duration <= 0:
-                    # for some file types gstreamer doesn't give us a duration
-                    # so don't display the percentage
-                    if self.event.isDownloading:
-                        message = _("Downloading...")
-                    else:
-                        message = _("Loading...")
-                else:
-                    displayLength = int(100 * self.event.loadingLength / self.event.duration)
-                    if self.event.isDownloading:
-                        message = _("Downloading (%d%%)...") % displayLength
-                    else:
-                        message = _("Loading (%d%%)...") % displayLength
+        return surface
 
-                # show the appropriate message
-                context.show_text(message)
+    #_____________________________________________________________________
 
-                # FIXME display a cancel button
-                # self.cancelButtonArea.x = context.get_current_point()[0]+3    # take the current context.x and pad it a bit
-                # context.set_source_surface(self.cancelImg, self.cancelButtonArea.x, self.cancelButtonArea.y)
-                # context.paint()
+    def DrawLabel(self, context):
+        """
+        Writes the name or the loading status of the event at its beginning.
 
-            elif self.event.isRecording:
-                context.show_text(_("Recording..."))
+        Parameters:
+            context -- Cairo context of this widget.
+        """
+        context.set_source_rgb(*self._TEXT_RGB)
+        context.move_to(5, 15)
+
+        if self.event.isImporting:
+            displayLength = int(100 * self.event.importProgress)
+            context.show_text(_("Importing (%d%%)...") % displayLength)
+
+        elif self.event.isLoading:
+            # Write "Loading..." or "Downloading..."
+            if self.event.duration <= 0:
+                # for some file types gstreamer doesn't give us a duration
+                # so don't display the percentage
+                if self.event.isDownloading:
+                    message = _("Downloading...")
+                else:
+                    message = _("Loading...")
             else:
-                #Draw event name
-                context.show_text(self.event.name)
+                displayLength = int(100 * self.event.loadingLength / self.event.duration)
+                if self.event.isDownloading:
+                    message = _("Downloading (%d%%)...") % displayLength
+                else:
+                    message = _("Loading (%d%%)...") % displayLength
+
+            # show the appropriate message
+            context.show_text(message)
+
+            # FIXME display a cancel button
+            # self.cancelButtonArea.x = context.get_current_point()[0]+3    # take the current context.x and pad it a bit
+            # context.set_source_surface(self.cancelImg, self.cancelButtonArea.x, self.cancelButtonArea.y)
+            # context.paint()
+
+        elif self.event.isRecording:
+            context.show_text(_("Recording..."))
+        else:
+            #Draw event name
+            context.show_text(self.event.name)
 
-        self.redrawWaveform = False
+    #_____________________________________________________________________
+
+    def TraceLevels(self, context, levels, origin, top, height, width):
+        """
+        Adds a path for the given levels of one channel to the Cairo context.
+
+        Parameters:
+            context -- Cairo context to draw the path on.
+            levels -- iterator of (endtime, level) pairs, starting around origin.
+            origin -- position in pixels from the start of the event at the left of the context.
+            top -- the top of the lane to draw in, in pixels.
+            height -- the height of the lane in pixels.
+            width -- the width of the context in pixels.
+        """
+        bottom = top + height
+        context.move_to(0, bottom)
+
+        x = 0
+        last_bucket = None
+        skip_list = []
+        # only the points from the start of the drawing area onwards are read
+        for endtime, peak in levels:
+            pixx = int(endtime * self.project.view_scale / 1000)
+            x = pixx - origin
+
+            peakOnScreen = peak * height / sys.maxsize
+            skip_list.append(peakOnScreen)
+            # points are averaged in steps of _MIN_POINT_SEPARATION counted from the
+            # start of the event, so neighbouring tiles draw the same points
+            bucket = pixx // self._MIN_POINT_SEPARATION
+            if bucket == last_bucket:
+                continue
+
+            peakOnScreen = sum(skip_list) / len(skip_list)
+            context.line_to(x, bottom - peakOnScreen)
+
+            skip_list = []
+            last_bucket = bucket
+            if x > width:
+                break
+
+        context.line_to(x, bottom)
 
     #_____________________________________________________________________
 
@@ -489,9 +580,10 @@ class EventViewer(Gtk.DrawingArea):
         self.event.disconnect_by_func(self.OnEventPosition)
         self.event.disconnect_by_func(self.OnEventWaveform)
 
+        self.project.disconnect_by_func(self.OnProjectViewStart)
+
         #delete the cached images
-        #del self.sourceSmall
-        del self.sourceLarge
+        WaveformTileCache.get_cache().invalidate(self)
         del self.cancelImg
         # FIXME due of gtk 4 / python lack of support for dispose() we have to carefully remove all references
         self.run_dispose()
@@ -1261,14 +1353,26 @@ class EventViewer(Gtk.DrawingArea):
         Parameters:
             project -- The project instance that send the signal.
         """
+        # tiles are kept for each zoom level, so there is nothing to redraw
         if self.currentScale != self.project.view_scale:
-            self.redrawWaveform = True
             self.queue_resize()
             self.currentScale = self.project.view_scale
             self.queue_draw()
 
     #_____________________________________________________________________
 
+    def OnProjectViewStart(self, project):
+        """
+        Callback for when the project is scrolled, to paint the
+        waveform tiles which have come into view.
+
+        Parameters:
+            project -- The project instance that send the signal.
+        """
+        self.queue_draw()
+
+    #_____________________________________________________________________
+
     def PixXFromSec(self, sec):
         """
         Converts seconds to an X pixel position in the waveform.
@@ -1,6 +1,6 @@
 from gi.repository import Gtk, Adw
 from .settings import Settings
-from .project import Project
+from .project import Project, ProjectExportException
 
 class ExportDialog(Gtk.Box):
     def __init__(self):
@@ -47,12 +47,49 @@ class ExportDialog(Gtk.Box):
         self.export_accept_button.set_margin_top(10)
         self.export_accept_button.set_margin_bottom(20)
 
+        self.export_progress_bar = Gtk.ProgressBar()
+        self.export_progress_bar.set_show_text(True)
+        self.export_progress_bar.set_visible(False)
+        self.export_pane_main_part.append(self.export_progress_bar)
+
         self.export_accept_button.connect("clicked", self.on_export_accept_button)
+        self.project = None
 
     def on_export_accept_button(self, button):
-        # get file path
-        audio_export_file_path = self.export_dialog_filename_entry.get_text()
         project = Project.get_current_project()
+        if project.GetIsExporting():
+            project.terminate_export()
+            return
+
+        # get file path
+        audio_export_file_path = self.export_dialog_filename_entry2.get_text()
         element_string = ["flacenc", "vorbisenc ! oggmux", "lame"]
-        project.export(audio_export_file_path, element_string[self.export_format_select.get_selected()])
+        if self.project is not project:
+            project.connect("export-progress", self.on_export_progress)
+            project.connect("export-complete", self.on_export_complete)
+            self.project = project
+        try:
+            project.export(audio_export_file_path, element_string[self.export_format_select.get_selected()])
+        except ProjectExportException as e:
+            self.export_progress_bar.set_text(_("Export failed: %s") % e.message)
+            self.export_progress_bar.set_visible(True)
+            return
+
+        self.export_progress_bar.set_fraction(0.0)
+        self.export_progress_bar.set_text(_("Exporting"))
+        self.export_progress_bar.set_visible(True)
+        self.export_accept_button.set_label(_("Cancel export"))
+
+    def on_export_progress(self, project, fraction):
+        self.export_progress_bar.set_fraction(fraction)
+        self.export_progress_bar.set_text(_("Exporting %d%%") % int(fraction * 100))
+
+    def on_export_complete(self, project, filename, success, message):
+        self.export_accept_button.set_label(_("Export audio"))
+        if success:
+            self.export_progress_bar.set_text(_("Exported to %s") % filename)
+        elif message:
+            self.export_progress_bar.set_text(_("Export failed: %s") % message)
+        else:
+            self.export_progress_bar.set_visible(False)
 
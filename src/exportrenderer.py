@@ -0,0 +1,281 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    exportrenderer.py
+#
+#    Renders a project to audio files in a pipeline of its own, as fast as
+#    they can be encoded, while the playback pipeline stays free to use.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject, Gst
+from .globals import Globals
+import math
+import os
+
+class ExportRenderer(GObject.GObject):
+    """
+    Mixes all the audible instruments of a Project once, and writes the
+    mix through a tee to any number of encoders and files, each in its own
+    thread. The output of single instruments, after their volume and pan,
+    can be written as stems by the same render, starting at the start of
+    the Project just like the mix. There is no audio device and no clock to
+    keep up with. Reports how much of the Project has been rendered.
+
+    Signals:
+        "progress" -- the fraction of the Project rendered so far.
+        "finished" -- the render is over. True if all the files were written,
+                      and the error message if it failed, None otherwise.
+    """
+
+    """ How often the progress is reported, in milliseconds """
+    PROGRESS_INTERVAL = 250
+    """ The format all the instruments are mixed in """
+    MIX_CAPS = "audio/x-raw, format=F32LE, rate=44100, channels=2"
+    """ The number of samples in each buffer of the silence under the mix """
+    SILENCE_BUFFER_SAMPLES = 1024
+
+    __gsignals__ = {
+        "progress"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_DOUBLE,) ),
+        "finished"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_BOOLEAN, GObject.TYPE_STRING) ),
+    }
+
+    def __init__(self, project, targets, stemTargets=None, preFader=False, length=None):
+        """
+        Creates a new instance of ExportRenderer.
+
+        Parameters:
+            project -- the Project to render.
+            targets -- a list of (filename, encodebin) tuples, with the
+                    filename where the rendered audio will be saved and a
+                    Gst.Bin which encodes and muxes the mix for it.
+            stemTargets -- a dictionary of Instruments -> lists of
+                    (filename, encodebin) tuples like targets, to write the
+                    stem of that Instrument to.
+            preFader -- True to take the stems before the volume and pan of
+                    their Instruments.
+            length -- how much to render in seconds, the whole Project if None.
+        """
+        GObject.GObject.__init__(self)
+        self.project = project
+        self.targets = targets
+        self.stemTargets = stemTargets or {}
+        self.preFader = preFader
+        self.length = project.GetProjectLength() if length is None else length
+        self.pipeline = None        # the render pipeline, while rendering
+        self.progressSource = None    # the timeout reporting the progress, while rendering
+
+    #_____________________________________________________________________
+
+    def start(self):
+        """
+        Builds the render pipeline and starts it.
+        """
+        if self.pipeline:
+            return
+
+        self.pipeline = Gst.Pipeline.new("export")
+        mixer = None
+        if self.targets:
+            mixer = Gst.ElementFactory.make("audiomixer", None)
+            self.pipeline.add(mixer)
+            mixer.link(self.__AddOutputs(self.targets))
+
+            # silence for the whole length, so the file is as long as the
+            # Project even when the instruments at its end are muted
+            rate = Gst.Caps.from_string(self.MIX_CAPS).get_structure(0).get_value("rate")
+            silence = Gst.ElementFactory.make("audiotestsrc", None)
+            silence.set_property("wave", 4)    #4 is silence
+            silence.set_property("samplesperbuffer", self.SILENCE_BUFFER_SAMPLES)
+            silence.set_property("num-buffers", math.ceil(self.length * rate / self.SILENCE_BUFFER_SAMPLES))
+            self.pipeline.add(silence)
+            silence.link(mixer)
+
+        for instr in self.project.instruments:
+            instr.check_mute_status()
+            inMix = mixer is not None and not instr.actuallyIsMuted and instr.events
+            stems = self.stemTargets.get(instr)
+            if not inMix and not stems:
+                continue
+            Globals.debug("Rendering instrument", instr.name)
+            # the composition of each instrument covers the whole Project, so the stems line up with the mix
+            renderBin = instr.make_render_bin(self.length, preFader=self.preFader and bool(stems))
+            self.pipeline.add(renderBin)
+            if not stems:
+                renderBin.link(mixer)
+                continue
+            if self.preFader:
+                # the mix needs the volume and pan, so it can't share the bin
+                renderBin.link(self.__AddOutputs(stems))
+                if inMix:
+                    mixBin = instr.make_render_bin(self.length)
+                    self.pipeline.add(mixBin)
+                    mixBin.link(mixer)
+                continue
+
+            tee = Gst.ElementFactory.make("tee", None)
+            stemQueue = Gst.ElementFactory.make("queue", None)
+            for element in (tee, stemQueue):
+                self.pipeline.add(element)
+            renderBin.link(tee)
+            tee.link(stemQueue)
+            stemQueue.link(self.__AddOutputs(stems))
+            if inMix:
+                mixQueue = Gst.ElementFactory.make("queue", None)
+                self.pipeline.add(mixQueue)
+                tee.link(mixQueue)
+                mixQueue.link(mixer)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message::eos", self.__OnEOS)
+        bus.connect("message::error", self.__OnError)
+
+        Globals.debug("Rendering export to", ", ".join(self.get_filenames()))
+        self.pipeline.set_state(Gst.State.PLAYING)
+        self.progressSource = GObject.timeout_add(self.PROGRESS_INTERVAL, self.__UpdateProgress)
+
+    #_____________________________________________________________________
+
+    def cancel(self):
+        """
+        Stops rendering and deletes the parts of the files written so far.
+        """
+        if not self.pipeline:
+            return
+        Globals.debug("Cancelling export")
+        self.__Stop()
+        self.__RemoveFiles()
+        self.emit("finished", False, None)
+
+    #_____________________________________________________________________
+
+    def is_rendering(self):
+        """
+        Returns:
+            True if the render is running.
+        """
+        return self.pipeline is not None
+
+    #_____________________________________________________________________
+
+    def get_filenames(self):
+        """
+        Returns:
+            the names of all the files written, the mix first and then the stems.
+        """
+        filenames = [filename for filename, encodebin in self.targets]
+        for stems in self.stemTargets.values():
+            filenames += [filename for filename, encodebin in stems]
+        return filenames
+
+    #_____________________________________________________________________
+
+    def __AddOutputs(self, targets):
+        """
+        Adds a branch which encodes its audio into each of the targets,
+        each encoder running in its own thread.
+
+        Parameters:
+            targets -- a list of (filename, encodebin) tuples.
+
+        Returns:
+            the element to link the audio to.
+        """
+        capsfilter = Gst.ElementFactory.make("capsfilter", None)
+        tee = Gst.ElementFactory.make("tee", None)
+        capsfilter.set_property("caps", Gst.Caps.from_string(self.MIX_CAPS))
+        self.pipeline.add(capsfilter)
+        self.pipeline.add(tee)
+        capsfilter.link(tee)
+
+        # the queue starts a thread for each encoder, so they run side by side
+        for filename, encodebin in targets:
+            queue = Gst.ElementFactory.make("queue", None)
+            convert = Gst.ElementFactory.make("audioconvert", None)
+            filesink = Gst.ElementFactory.make("filesink", None)
+            filesink.set_property("location", filename)
+            # write as fast as the audio is encoded rather than in real time
+            filesink.set_property("sync", False)
+
+            for element in (queue, convert, encodebin, filesink):
+                self.pipeline.add(element)
+            tee.link(queue)
+            queue.link(convert)
+            convert.link(encodebin)
+            encodebin.link(filesink)
+
+        return capsfilter
+
+    #_____________________________________________________________________
+
+    def __UpdateProgress(self):
+        """
+        Reports how far the render has got.
+        """
+        if not self.pipeline:
+            #Stop timeout_add from calling us again
+            return False
+
+        success, position = self.pipeline.query_position(Gst.Format.TIME)
+        if success and self.length > 0:
+            self.emit("progress", min(1.0, position / (self.length * Gst.SECOND)))
+        return True
+
+    #_____________________________________________________________________
+
+    def __OnEOS(self, bus, message):
+        """
+        GStreamer End Of Stream handler, called once all the files have
+        been written.
+
+        Parameters:
+            bus -- reserved for GStreamer callbacks, don't use it explicitly.
+            message -- reserved for GStreamer callbacks, don't use it explicitly.
+        """
+        self.__Stop()
+        self.emit("progress", 1.0)
+        self.emit("finished", True, None)
+
+    #_____________________________________________________________________
+
+    def __OnError(self, bus, message):
+        """
+        GStreamer error handler. Stops the render and deletes the files,
+        since they all hold the same mix.
+
+        Parameters:
+            bus -- reserved for GStreamer callbacks, don't use it explicitly.
+            message -- reserved for GStreamer callbacks, don't use it explicitly.
+        """
+        error, debug = message.parse_error()
+        Globals.debug("Export failed:", error.message, debug)
+        self.__Stop()
+        self.__RemoveFiles()
+        self.emit("finished", False, error.message)
+
+    #_____________________________________________________________________
+
+    def __Stop(self):
+        if self.progressSource:
+            GObject.source_remove(self.progressSource)
+            self.progressSource = None
+        bus = self.pipeline.get_bus()
+        bus.remove_signal_watch()
+        self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline = None
+
+    #_____________________________________________________________________
+
+    def __RemoveFiles(self):
+        for filename in self.get_filenames():
+            try:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            except OSError:
+                pass
+
+    #_____________________________________________________________________
+
+#=========================================================================
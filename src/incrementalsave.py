@@ -0,0 +1,238 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    incrementalsave.py
+#
+#    Keeps a journal of the changes made to a project since it was last
+#    saved, in the .incremental file next to the project file, so that
+#    they can be restored if Jokosher quits before the project is saved.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject
+from .globals import Globals
+import json
+import os
+
+class IncrementalSave:
+    """
+    Append-only log of actions, one JSON object per line. Every action
+    holds the whole new state of the event or instrument it changed, so
+    replaying them in order gives the same result however many times a
+    change is repeated. Lines are flushed as soon as they are written,
+    but only synced to disk once every SYNC_INTERVAL, so that a burst of
+    changes costs a single fsync.
+    """
+
+    """ How long an action may wait before it is synced to disk, in milliseconds """
+    SYNC_INTERVAL = 1000
+
+    def __init__(self, path):
+        """
+        Creates a new instance of IncrementalSave.
+
+        Parameters:
+            path -- the .incremental file to append the actions to.
+        """
+        self.path = path
+        self.file = None            # opened when the first action is appended
+        self.syncSource = None        # the timeout which will sync the file, if any
+        self.compacted = 0            # the number of bytes dropped from the start so far
+
+    #_____________________________________________________________________
+
+    def append(self, action):
+        """
+        Adds an action to the end of the journal.
+
+        Parameters:
+            action -- a dictionary made by one of the *Action() methods.
+        """
+        if not self.file:
+            self.__Open()
+
+        self.file.write(json.dumps(action, separators=(",", ":")).encode("utf-8") + b"\n")
+        # on disk if Jokosher crashes, even though the system may still lose it
+        self.file.flush()
+
+        if self.syncSource is None:
+            self.syncSource = GObject.timeout_add(self.SYNC_INTERVAL, self.sync)
+
+    #_____________________________________________________________________
+
+    def sync(self):
+        """
+        Makes sure all the appended actions are stored on disk.
+        """
+        if self.syncSource is not None:
+            GObject.source_remove(self.syncSource)
+            self.syncSource = None
+        if self.file:
+            os.fsync(self.file.fileno())
+        #Stop timeout_add from calling us again
+        return False
+
+    #_____________________________________________________________________
+
+    def get_position(self):
+        """
+        Returns:
+            the number of bytes of actions appended to the journal so far,
+            including those dropped by compact().
+        """
+        if self.file:
+            return self.compacted + self.file.tell()
+        if os.path.exists(self.path):
+            return self.compacted + os.path.getsize(self.path)
+        return self.compacted
+
+    #_____________________________________________________________________
+
+    def compact(self, position):
+        """
+        Drops the actions which are already in the project file. Actions
+        appended after the project was written are kept.
+
+        Parameters:
+            position -- the value of get_position() when the project
+                        was written.
+        """
+        # an earlier save may have finished after this one started
+        if position <= self.compacted:
+            return
+        self.close()
+
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(position - self.compacted)
+                remainder = f.read()
+        except OSError:
+            return
+
+        self.compacted = position
+        if not remainder:
+            self.remove()
+            return
+
+        try:
+            with open(self.path + "~", "wb") as f:
+                f.write(remainder)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path + "~", self.path)
+        except OSError as e:
+            Globals.debug("Compacting .incremental failed:", e)
+
+    #_____________________________________________________________________
+
+    def close(self):
+        """
+        Syncs and closes the journal. It is opened again by append().
+        """
+        self.sync()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    #_____________________________________________________________________
+
+    def remove(self):
+        """
+        Closes and deletes the journal, once all of its actions are safe
+        in the project file or have been discarded.
+        """
+        self.close()
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError:
+            Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
+
+    #_____________________________________________________________________
+
+    def __Open(self):
+        self.file = open(self.path, "ab")
+        if self.file.tell():
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+            # a line cut short by a crash must not swallow the next action
+            if torn:
+                self.file.write(b"\n")
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def read(path):
+        """
+        Reads the actions of a journal, skipping any which are damaged.
+
+        Parameters:
+            path -- the .incremental file to read.
+
+        Returns:
+            a generator of the action dictionaries, in the order they happened.
+        """
+        with open(path, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    action = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    Globals.debug("Skipping damaged incremental save action:", line)
+                    continue
+                if isinstance(action, dict):
+                    yield action
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def EventAction(event):
+        """
+        Records the state of an Event which has been added or changed.
+        """
+        return {
+            "action" : "event",
+            "instrument" : event.instrument.id,
+            "id" : event.id,
+            "parameters" : {key : getattr(event, key) for key in event.SAVED_PARAMETERS},
+            "fadePoints" : sorted(event._Event__fadePointsDict.items()),
+        }
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def DeleteEventAction(event):
+        """
+        Records that an Event has been moved to the graveyard.
+        """
+        return {"action" : "delete-event", "instrument" : event.instrument.id, "id" : event.id}
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def InstrumentAction(instr):
+        """
+        Records the state of an Instrument which has been added or changed.
+        """
+        return {
+            "action" : "instrument",
+            "id" : instr.id,
+            "parameters" : {key : getattr(instr, key) for key in instr.SAVED_PARAMETERS},
+        }
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def DeleteInstrumentAction(instr):
+        """
+        Records that an Instrument has been moved to the graveyard.
+        """
+        return {"action" : "delete-instrument", "id" : instr.id}
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -1,21 +1,30 @@
 from gi.repository import GObject, Gio, Gst, GstController
 import os
-import shutil
+import contextlib
 from .event import Event
 from .platform_utils import PlatformUtils
 from .globals import Globals
 from urllib import parse
 from .utils import Utils
 from .settings import Settings
+from .levelscache import LevelsCache
+from .incrementalsave import IncrementalSave
+from .instrumentfreezer import InstrumentFreezer
+from .projectsnapshot import ProjectSnapshot
 
 class Instrument(GObject.GObject):
 
     LADSPA_ELEMENT_CAPS = "audio/x-raw, format=F32LE, rate=(int)[ 1, 2147483647 ], channels=(int)1"
+    """ The properties saved in the project file and in the .incremental file """
+    SAVED_PARAMETERS = ["name", "is_armed",
+                        "isMuted", "isSolo", "input", "output", "volume",
+                        "isSelected", "isVisible", "inTrack", "instrType", "pan"]
 
     __gsignals__ = {
         "arm"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "effect"        : ( GObject.SIGNAL_RUN_LAST | GObject.SIGNAL_DETAILED, GObject.TYPE_NONE, () ),
         "event"        : ( GObject.SIGNAL_RUN_LAST | GObject.SIGNAL_DETAILED, GObject.TYPE_NONE, (GObject.TYPE_PYOBJECT,) ),
+        "frozen"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "image"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "mute"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "name"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
@@ -56,6 +65,11 @@ class Instrument(GObject.GObject):
 
         self.input = None    # the device to use for recording on this instrument.
         self.inTrack = 0    # Input track to record from if device is multichannel.
+        self.compositionBatchDepth = 0        # number of open batch_composition() blocks
+        self.compositionCommitPending = False    # True if a commit was asked for during a batch
+        self.freezer = InstrumentFreezer(self)
+        self.frozenComposition = None    # plays the frozen file instead of composition, while frozen
+        self.frozenConvert = None
 
         # CREATE GSTREAMER ELEMENTS #
         self.playbackbin = Gst.ElementFactory.make("bin", "Instrument_%d"%self.id)
@@ -105,8 +119,7 @@ class Instrument(GObject.GObject):
         self.volumeFadeBin.add_pad(volumeFadeBinSrc)
 
         # SET ELEMENT PROPERTIES #
-        self.levelElement.set_property("interval", Gst.SECOND / 50)
-        self.levelElement.set_property("message", True)
+        self.project.levelMeter.add(self.levelElement, self)
         self.levelElement.set_property("peak-ttl", 0)
         self.levelElement.set_property("peak-falloff", 20)
 
@@ -173,6 +186,51 @@ class Instrument(GObject.GObject):
         #set the volume element since it depends on the project's volume as well
         self.UpdateVolume()
 
+    def commit_composition(self):
+        """
+        Commits the changes to the nlesources of the composition, or
+        leaves it for the end of the batch if one is open.
+        """
+        if self.compositionBatchDepth:
+            self.compositionCommitPending = True
+        else:
+            self.composition.emit("commit", True)
+
+    @contextlib.contextmanager
+    def batch_composition(self):
+        """
+        Context manager for adding, removing or changing many nlesources at
+        once. The composition is only rebuilt when the outermost block ends,
+        with a single commit, instead of once for every change.
+
+        Example:
+            with instrument.batch_composition():
+                for event in events:
+                    event.CreateFilesource()
+        """
+        self.begin_composition_batch()
+        try:
+            yield self
+        finally:
+            self.end_composition_batch()
+
+    def begin_composition_batch(self):
+        """
+        Starts deferring composition commits, for batches which can't be
+        written as a with block. Must be paired with end_composition_batch().
+        """
+        self.compositionBatchDepth += 1
+
+    def end_composition_batch(self):
+        """
+        Ends a batch started with begin_composition_batch(), committing the
+        composition if it changed and this was the outermost batch.
+        """
+        self.compositionBatchDepth -= 1
+        if not self.compositionBatchDepth and self.compositionCommitPending:
+            self.compositionCommitPending = False
+            self.composition.emit("commit", True)
+
     def OnMute(self):
         """
         Updates the GStreamer volume element to reflect the mute status.
@@ -240,31 +298,34 @@ class Instrument(GObject.GObject):
     def add_events_from_list(self, start, filelist):
         if not filelist:
             return
-        for uri in fileList:
-        # Parse the uri, and continue only if it is pointing to a local file
-            (scheme, domain, file, params, query, fragment) = parse.urlparse(uri, "file", False)
-            if scheme == "file":
-                file = PlatformUtils.url2pathname(file)
-                event = self.add_event_from_file(start, file)
-            else:
-                event = self.add_event_from_url(start, uri)
-
-            if event:
-                event.MoveButDoNotOverlap(event.start)
-                event.SetProperties()
-                start += event.duration
+        with self.batch_composition():
+            for uri in fileList:
+            # Parse the uri, and continue only if it is pointing to a local file
+                (scheme, domain, file, params, query, fragment) = parse.urlparse(uri, "file", False)
+                if scheme == "file":
+                    file = PlatformUtils.url2pathname(file)
+                    event = self.add_event_from_file(start, file)
+                else:
+                    event = self.add_event_from_url(start, uri)
+
+                if event:
+                    event.MoveButDoNotOverlap(event.start)
+                    event.SetProperties()
+                    start += event.duration
         print('AddEventsFromList called by:', inspect.stack()[1][3])
         Globals.debug("AddEventsFromList finished")
 
     def add_events_from_files(self, start, gfiles):
         if not gfiles:
             return
-        for gfile in gfiles:
-            event = self.add_event_from_gfile(start, gfile)
-            if event:
-                event.MoveButDoNotOverlap(event.start)
-                event.SetProperties()
-                start += event.duration
+        # one composition rebuild for all of the files
+        with self.batch_composition():
+            for gfile in gfiles:
+                event = self.add_event_from_gfile(start, gfile)
+                if event:
+                    event.MoveButDoNotOverlap(event.start)
+                    event.SetProperties()
+                    start += event.duration
 
     def add_event_from_gfile(self, start, gfile, name=None):
         event_id = self.project.generate_unique_id(None,  reserve=False)
@@ -277,25 +338,19 @@ class Instrument(GObject.GObject):
         else:
             newfile = "%s_%d" % (root, event_id)
 
-        # copy file over
-        audio_file = os.path.join(self.project.audio_path, newfile)
-
-        # append to clean up
-        self.project.deleteOnCloseAudioFiles.append(audio_file)
-
-        # TODO gfile copy
-        # TODO create destination gfile
-        destination_file = Gio.File.new_for_path(audio_file)
-        gfile.copy(destination=destination_file, flags=Gio.FileCopyFlags.NONE)
-        # TODO copy async
-        file = filelabel = destination_file.get_path()
+        # the event uses the original file until it is stored, if it can
+        source = gfile.get_path()
+        filelabel = source or gfile.get_parse_name()
 
         # event
-        ev = Event(self, file, event_id, filelabel)
+        ev = Event(self, source or newfile, event_id, filelabel)
         ev.start = start
         ev.name = name
+        ev.levels_file = "%s_%d%s" % (root, event_id, Event.LEVELS_FILE_EXTENSION)
         self.events.append(ev)
 
+        self.__StartImport(ev, gfile, newfile)
+
         # if duration and levels_file:
         #     ev.duration = duration
         #     ev.levels_file = levels_file
@@ -304,7 +359,11 @@ class Instrument(GObject.GObject):
         #     ev.MoveButDoNotOverlap(ev.start)
         #     ev.SetProperties()
         # else:
-        ev.generate_waveform()
+        # without the original file the levels have to wait for the copy
+        if source:
+            self.load_or_generate_levels(ev)
+
+        self.project.SaveIncrementalAction(IncrementalSave.EventAction(ev))
 
         self.temp = ev.id
 
@@ -337,29 +396,15 @@ class Instrument(GObject.GObject):
         else:
             newfile = "%s_%d" % (root, event_id)
 
-        # copy file over
-        audio_file = os.path.join(self.project.audio_path, newfile)
-
-        # append to clean up
-        self.project.deleteOnCloseAudioFiles.append(audio_file)
-
-        try:
-            shutil.copyfile(file, audio_file)
-        except IOError:
-            raise UndoSystem.CancelUndoCommand()
-
-        #self.project.deleteOnCloseAudioFiles.append(audio_file)
-        #inc = IncrementalSave.NewEvent(self.id, newfile, start, event_id)
-        #self.project.SaveIncrementalAction(inc)
-
-        file = newfile
-
-        # event
+        # event, using the original file until it is stored
         ev = Event(self, file, event_id, filelabel)
         ev.start = start
         ev.name = name
+        ev.levels_file = "%s_%d%s" % (root, event_id, Event.LEVELS_FILE_EXTENSION)
         self.events.append(ev)
 
+        self.__StartImport(ev, Gio.File.new_for_path(file), newfile)
+
         if duration and levels_file:
             ev.duration = duration
             ev.levels_file = levels_file
@@ -368,7 +413,10 @@ class Instrument(GObject.GObject):
             ev.MoveButDoNotOverlap(ev.start)
             ev.SetProperties()
         else:
-            ev.generate_waveform()
+            self.load_or_generate_levels(ev)
+
+        inc = IncrementalSave.EventAction(ev)
+        self.project.SaveIncrementalAction(inc)
 
         self.temp = ev.id
 
@@ -376,6 +424,77 @@ class Instrument(GObject.GObject):
         Globals.debug("addEventFromFile event added")
         return ev
 
+    def __StartImport(self, event, source, newfile):
+        """
+        Adds the audio file of a new Event to the project's AudioStore in
+        the background. The waveform is generated from the original file
+        while it is being copied.
+
+        Parameters:
+            event -- the Event the file is imported for.
+            source -- the Gio.File to import.
+            newfile -- the name to copy the file to until it is stored.
+        """
+        path = source.get_path()
+        if path and self.project.audioStore.is_stored(path):
+            # already in the project, for example when an event is pasted
+            return
+
+        event.isImporting = True
+        event.importProgress = 0.0
+        # the levels go with the audio if the project isn't saved
+        self.project.deleteOnCloseAudioFiles.append(event.GetAbsLevelsFile())
+        self.project.audioStore.import_file(source, newfile,
+                                            event.import_progress, event.finish_import)
+
+    def load_or_generate_levels(self, event):
+        """
+        Gives a newly added Event the levels of its audio file from the
+        LevelsCache, or generates them if the file hasn't been seen before.
+        The cache key comes from the hash of the file's contents, which the
+        AudioStore calculates on a worker thread while importing it anyway.
+
+        Parameters:
+            event -- the Event which has no levels yet.
+        """
+        audioStore = self.project.audioStore
+        path = event.GetAbsFile()
+        digest = audioStore.get_stored_key(path)
+        if digest:
+            self.__LoadOrGenerateLevels(event, digest)
+        else:
+            audioStore.hash_file(path, lambda digest: self.__LoadOrGenerateLevels(event, digest))
+
+    def __LoadOrGenerateLevels(self, event, digest):
+        """
+        Looks up the levels of an Event once the hash of its file is known.
+
+        Parameters:
+            event -- the Event which has no levels yet.
+            digest -- the hash of the contents of its file, or None if it
+                    couldn't be read.
+        """
+        # the levels may have been found or started in the meantime, once the file was stored
+        if event.levels_list or event.isLoading or event not in self.events:
+            return
+
+        cache = LevelsCache.get_cache()
+        key = cache.get_key(digest, Event.LEVEL_INTERVAL, Event.LEVEL_CHANNEL_MODE) if digest else None
+        levels_list = cache.lookup(key) if key else None
+
+        if levels_list:
+            Globals.debug("Using cached levels for", event.GetAbsFile())
+            event.levels_list = levels_list
+            # the last level ends with the audio
+            event.duration = levels_list[-1][0] / 1000.0
+            # update properties and position when duration changes.
+            event.MoveButDoNotOverlap(event.start)
+            event.SetProperties()
+            event.emit("waveform")
+        else:
+            event.levelsCacheKey = key
+            event.generate_waveform()
+
     def add_event_from_url(self, start, url):
         """
         Adds an Event from a URL to this Instrument.
@@ -412,7 +531,7 @@ class Instrument(GObject.GObject):
             self.events.remove(ev)
             raise UndoSystem.CancelUndoCommand()
 
-        inc = IncrementalSave.StartDownload(self.id, url, newfile, start, event_id)
+        inc = IncrementalSave.EventAction(ev)
         self.project.SaveIncrementalAction(inc)
 
         self.temp = ev.id
@@ -420,7 +539,7 @@ class Instrument(GObject.GObject):
 
         return ev
 
-    def store_to_xml(self, doc, parent, graveyard = False):
+    def store_to_xml(self, doc, parent, graveyard = False, levels_files=None):
         """
         Converts this Instrument into an XML representation suitable for saving to a file.
 
@@ -430,6 +549,7 @@ class Instrument(GObject.GObject):
                         be added to.
             graveyard -- True if this Instrument is on the graveyard stack,
                         and should be serialized as a dead Instrument.
+            levels_files -- see Event.store_to_xml().
         """
         if graveyard:
             ins = doc.createElement("DeadInstrument")
@@ -438,9 +558,7 @@ class Instrument(GObject.GObject):
         parent.appendChild(ins)
         ins.setAttribute("id", str(self.id))
 
-        items = ["name", "is_armed",
-                "isMuted", "isSolo", "input", "output", "volume",
-                "isSelected", "isVisible", "inTrack", "instrType", "pan"]
+        items = self.SAVED_PARAMETERS
 
         params = doc.createElement("Parameters")
         ins.appendChild(params)
@@ -460,9 +578,9 @@ class Instrument(GObject.GObject):
             Utils.store_dictionary_to_xml(doc, globaleffect, propsdict)
 
         for ev in self.events:
-            ev.store_to_xml(doc, ins)
+            ev.store_to_xml(doc, ins, levels_files=levels_files)
         for ev in self.graveyard:
-            ev.store_to_xml(doc, ins, graveyard=True)
+            ev.store_to_xml(doc, ins, graveyard=True, levels_files=levels_files)
 
     def add_and_link_playbackbin(self):
         """
@@ -503,28 +621,241 @@ class Instrument(GObject.GObject):
         # set the length of the operation to be the full length of the project
         self.volumeFadeOperation.set_property("duration", self.project.GetProjectLength() * Gst.SECOND)
         self.volumeFadeController.unset_all()
+        for point, vol in self.get_fade_points():
+            Globals.debug("FADE POINT: time(%.2f) vol(%.2f)" % (point, vol))
+            self.volumeFadeController.set(point * Gst.SECOND, vol)
+
+    def get_fade_points(self):
+        """
+        Collects the fade points of all the events of this Instrument.
+
+        Returns:
+            a list of (time, volume) tuples, with the time in seconds from
+            the start of the Project.
+        """
+        fadePoints = []
         firstpoint = False
         for ev in self.events:
-            if not ev.audioFadePoints:
+            eventFadePoints = ev.get_audio_fade_points()
+            if not eventFadePoints:
                 #there are no fade points, so just make it 100% all the way through
-                for point, vol in ((ev.start, 0.99), (ev.start+ev.duration, 0.99)):
-                    Globals.debug("FADE POINT: time(%.2f) vol(%.2f)" % (point, vol))
-                    self.volumeFadeController.set((point) * Gst.SECOND, vol)
+                fadePoints += [(ev.start, 0.99), (ev.start + ev.duration, 0.99)]
                 continue
 
-            for point in ev.audioFadePoints:
-                if ev.start + point[0] == 0.0:
+            for point, vol in eventFadePoints:
+                if ev.start + point == 0.0:
                     firstpoint = True
                 #FIXME: remove vol=0.99 when Gst.Controller is fixed to accept many consecutive 1.0 values.
-                if point[1] == 1.0:
+                if vol == 1.0:
                     vol = 0.99
-                else:
-                    vol = point[1]
-                Globals.debug("FADE POINT: time(%.2f) vol(%.2f)" % (ev.start + point[0], vol))
-                self.volumeFadeController.set((ev.start + point[0]) * Gst.SECOND, vol)
+                fadePoints.append((ev.start + point, vol))
         if not firstpoint:
             Globals.debug("Set extra zero fade point")
-            self.volumeFadeController.set(0, 0.99)
+            fadePoints.append((0, 0.99))
+
+        return fadePoints
+
+    def make_render_bin(self, length, preFader=False):
+        """
+        Creates a bin which plays this Instrument the way it sounds in the
+        Project, with its fades, effects, volume and pan, but from its own
+        composition, so it can be rendered while the playback pipeline is
+        left alone. A frozen Instrument is played from its frozen file.
+
+        Parameters:
+            length -- the length of the Project in seconds.
+            preFader -- True to leave out the volume and pan.
+
+        Returns:
+            a Gst.Bin with a "src" pad.
+        """
+        frozenFile = self.freezer.frozenFile
+        renderBin = Gst.ElementFactory.make("bin", "Render_Instrument_%d"%self.id)
+        composition = Gst.ElementFactory.make("nlecomposition", None)
+        convert = Gst.ElementFactory.make("audioconvert", None)
+        volume = Gst.ElementFactory.make("volume", None)
+        pan = Gst.ElementFactory.make("audiopanorama", None)
+        resample = Gst.ElementFactory.make("audioresample", None)
+
+        volume.set_property("volume", self.volume * self.project.volume)
+        pan.set_property("panorama", self.pan)
+
+        # the silence between the events
+        silentSource = Gst.ElementFactory.make("nlesource", None)
+        silenceAudioSource = Gst.ElementFactory.make("audiotestsrc", None)
+        silenceAudioSource.set_property("wave", 4)    #4 is silence
+        silentSource.add(silenceAudioSource)
+        silentSource.set_property("priority", 2 ** 32 - 1)
+        silentSource.set_property("start", 0)
+        silentSource.set_property("duration", int(length * Gst.SECOND))
+        silentSource.set_property("inpoint", 0)
+        composition.add(silentSource)
+
+        caps = Gst.Caps.from_string("audio/x-raw")
+        if frozenFile:
+            source = Gst.ElementFactory.make("nleurisource", None)
+            source.set_property("uri", PlatformUtils.pathname2url(frozenFile))
+            source.set_property("caps", caps)
+            source.set_property("start", 0)
+            source.set_property("duration", int(self.freezer.frozenLength * Gst.SECOND))
+            source.set_property("inpoint", 0)
+            source.set_property("priority", 2)
+            composition.add(source)
+
+        for ev in self.events:
+            if not ev.file or frozenFile:
+                continue
+            source = Gst.ElementFactory.make("nleurisource", None)
+            source.set_property("uri", PlatformUtils.pathname2url(ev.GetAbsFile()))
+            source.set_property("caps", caps)
+            source.set_property("start", int(ev.start * Gst.SECOND))
+            source.set_property("duration", int(ev.duration * Gst.SECOND))
+            source.set_property("inpoint", int(ev.offset * Gst.SECOND))
+            source.set_property("priority", 2)
+            composition.add(source)
+
+        # the fades, set as absolute volumes rather than fractions of the volume range
+        fadeBin = Gst.ElementFactory.make("bin", None)
+        fadeStartConvert = Gst.ElementFactory.make("audioconvert", None)
+        fadeElement = Gst.ElementFactory.make("volume", None)
+        fadeEndConvert = Gst.ElementFactory.make("audioconvert", None)
+        fadeBin.add(fadeStartConvert)
+        fadeBin.add(fadeElement)
+        fadeBin.add(fadeEndConvert)
+        fadeStartConvert.link(fadeElement)
+        fadeElement.link(fadeEndConvert)
+        fadeBin.add_pad(Gst.GhostPad.new("sink", fadeStartConvert.get_static_pad("sink")))
+        fadeBin.add_pad(Gst.GhostPad.new("src", fadeEndConvert.get_static_pad("src")))
+
+        fadeController = GstController.InterpolationControlSource.new()
+        fadeController.set_property("mode", GstController.InterpolationMode.LINEAR)
+        for point, vol in self.get_fade_points():
+            fadeController.set(int(point * Gst.SECOND), vol)
+        fadeElement.add_control_binding(GstController.DirectControlBinding.new_absolute(fadeElement, "volume", fadeController))
+
+        fadeOperation = Gst.ElementFactory.make("nleoperation", None)
+        fadeOperation.add(fadeBin)
+        fadeOperation.set_property("start", 0)
+        fadeOperation.set_property("duration", int(length * Gst.SECOND))
+        fadeOperation.set_property("priority", 1)
+        if not frozenFile:
+            composition.add(fadeOperation)
+
+        # copies of the effects, so their state in the playback pipeline isn't touched
+        chain = [convert]
+        for effect in ([] if frozenFile else self.effects):
+            effectCopy = Gst.ElementFactory.make(effect.get_factory().get_name(), None)
+            for name, value in ProjectSnapshot.get_effect_settings(effect).items():
+                effectCopy.set_property(name, value)
+            chain += [effectCopy, Gst.ElementFactory.make("audioconvert", None)]
+        if not preFader:
+            chain += [volume, pan]
+        chain.append(resample)
+
+        renderBin.add(composition)
+        for element in chain:
+            renderBin.add(element)
+        for upstream, downstream in zip(chain, chain[1:]):
+            upstream.link(downstream)
+        renderBin.add_pad(Gst.GhostPad.new("src", resample.get_static_pad("src")))
+
+        composition.connect("pad-added", lambda element, pad: pad.link(convert.get_static_pad("sink")))
+        composition.emit("commit", True)
+
+        return renderBin
+
+    def swap_in_frozen_source(self, path, duration):
+        """
+        Plays the frozen file instead of the events, fades and effects of
+        this Instrument, by taking the composition and the effects bin out
+        of the playback bin. The volume, level and pan stay live.
+
+        Parameters:
+            path -- path to the frozen file.
+            duration -- the length of the frozen file in seconds.
+        """
+        if self.frozenComposition:
+            self.swap_out_frozen_source()
+
+        self.frozenComposition = Gst.ElementFactory.make("nlecomposition", "frozen_composition_%d"%self.id)
+        self.frozenConvert = Gst.ElementFactory.make("audioconvert", "Frozen_Converter_%d"%self.id)
+
+        silentSource = Gst.ElementFactory.make("nlesource", None)
+        silenceAudioSource = Gst.ElementFactory.make("audiotestsrc", None)
+        silenceAudioSource.set_property("wave", 4)    #4 is silence
+        silentSource.add(silenceAudioSource)
+        silentSource.set_property("priority", 2 ** 32 - 1)
+        silentSource.set_property("start", 0)
+        silentSource.set_property("duration", 1000 * Gst.SECOND)
+        silentSource.set_property("inpoint", 0)
+
+        frozenSource = Gst.ElementFactory.make("nleurisource", None)
+        frozenSource.set_property("uri", PlatformUtils.pathname2url(path))
+        frozenSource.set_property("caps", Gst.Caps.from_string("audio/x-raw"))
+        frozenSource.set_property("start", 0)
+        frozenSource.set_property("duration", int(duration * Gst.SECOND))
+        frozenSource.set_property("inpoint", 0)
+        frozenSource.set_property("priority", 2)
+
+        self.frozenComposition.add(silentSource)
+        self.frozenComposition.add(frozenSource)
+
+        # take the live chain out
+        for pad in self.composition.pads:
+            peer = pad.get_peer()
+            if peer:
+                pad.unlink(peer)
+        self.effectsBin.unlink(self.volumeElement)
+        self.playbackbin.remove(self.composition)
+        self.playbackbin.remove(self.effectsBin)
+        self.composition.set_state(Gst.State.NULL)
+        self.effectsBin.set_state(Gst.State.NULL)
+
+        self.playbackbin.add(self.frozenComposition)
+        self.playbackbin.add(self.frozenConvert)
+        self.frozenConvert.link(self.volumeElement)
+        self.frozenComposition.connect("pad-added", lambda element, pad: pad.link(self.frozenConvert.get_static_pad("sink")))
+        self.frozenComposition.emit("commit", True)
+        # FIXME bind composition src pad manually for now, as in __init__
+        for pad in self.frozenComposition.pads:
+            if not pad.get_peer():
+                pad.link(self.frozenConvert.get_static_pad("sink"))
+            break
+
+        self.frozenConvert.sync_state_with_parent()
+        self.frozenComposition.sync_state_with_parent()
+
+    def swap_out_frozen_source(self):
+        """
+        Puts the composition and the effects bin back in the playback bin,
+        in place of the frozen file.
+        """
+        if not self.frozenComposition:
+            return
+
+        for pad in self.frozenComposition.pads:
+            peer = pad.get_peer()
+            if peer:
+                pad.unlink(peer)
+        self.frozenConvert.unlink(self.volumeElement)
+        self.playbackbin.remove(self.frozenComposition)
+        self.playbackbin.remove(self.frozenConvert)
+        self.frozenComposition.set_state(Gst.State.NULL)
+        self.frozenConvert.set_state(Gst.State.NULL)
+        self.frozenComposition = None
+        self.frozenConvert = None
+
+        self.playbackbin.add(self.composition)
+        self.playbackbin.add(self.effectsBin)
+        self.effectsBin.link(self.volumeElement)
+        self.commit_composition()
+        for pad in self.composition.pads:
+            if not pad.get_peer():
+                pad.link(self.effectsBin.get_compatible_pad(pad, pad.query_caps(None)))
+            break
+
+        self.effectsBin.sync_state_with_parent()
+        self.composition.sync_state_with_parent()
 
     def SetLevel(self, level):
         """
@@ -559,6 +890,7 @@ class Instrument(GObject.GObject):
         """
         self.is_armed = not self.is_armed
         self.emit("arm")
+        self.project.SaveIncrementalAction(IncrementalSave.InstrumentAction(self))
 
     def remove_and_unlink_playbackbin(self):
         """
@@ -634,6 +966,7 @@ class Instrument(GObject.GObject):
         """
         event.isRecording = False
         event.generate_waveform()
+        self.project.SaveIncrementalAction(IncrementalSave.EventAction(event))
         self.temp = event.id
         self.emit("recording-done")
 
@@ -648,12 +981,14 @@ class Instrument(GObject.GObject):
             self.volume = volume
             self.UpdateVolume()
             self.emit("volume")
+            self.project.SaveIncrementalAction(IncrementalSave.InstrumentAction(self))
 
     def set_pan(self, pan_value):
         pan_value = round(pan_value, 2)
         pan_value = pan_value / 100
         self.pan = pan_value
         self.panElement.set_property("panorama", pan_value)
+        self.project.SaveIncrementalAction(IncrementalSave.InstrumentAction(self))
 
     def toggle_mute(self):
         """
@@ -669,6 +1004,7 @@ class Instrument(GObject.GObject):
         """
         self.isMuted = not self.isMuted
         self.on_mute()
+        self.project.SaveIncrementalAction(IncrementalSave.InstrumentAction(self))
         # self.temp = self.isSolo
         # self.isMuted = not self.isMuted
         # if self.isSolo and not wasSolo:
@@ -692,6 +1028,7 @@ class Instrument(GObject.GObject):
 
         self.project.on_all_instruments_mute()
         self.emit("solo")
+        self.project.SaveIncrementalAction(IncrementalSave.InstrumentAction(self))
 
     def on_mute(self):
         """
@@ -739,6 +1076,7 @@ class Instrument(GObject.GObject):
 
         self.temp = eventid
         self.emit("event::removed", event)
+        self.project.SaveIncrementalAction(IncrementalSave.DeleteEventAction(event))
 
     @staticmethod
     def getInstruments():
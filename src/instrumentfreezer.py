@@ -0,0 +1,239 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    instrumentfreezer.py
+#
+#    Freezes an instrument: renders its events, fades and effects to an audio
+#    file once, and plays that file instead of running them live.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject, Gst
+from .globals import Globals
+from .exportrenderer import ExportRenderer
+from .projectsnapshot import ProjectSnapshot
+import hashlib
+import os
+
+class InstrumentFreezer:
+    """
+    Renders the events, fades and effects of an Instrument offline, before
+    its volume and pan, to a file which the Instrument plays while it is
+    frozen. The file is named after a hash of everything it was rendered
+    from. Changing any event, fade or effect of a frozen Instrument
+    unfreezes it and deletes the file. Emits "frozen" on the Instrument
+    whenever freezing starts, finishes, fails or is undone.
+    """
+
+    """ The encoder of the frozen files, quick to decode again """
+    ENCODER = "wavenc"
+    FROZEN_FILE_EXTENSION = ".wav"
+    """ The Event signals which mean the frozen file may be out of date """
+    EVENT_SIGNALS = ("position", "length", "waveform")
+
+    def __init__(self, instrument):
+        """
+        Creates a new instance of InstrumentFreezer.
+
+        Parameters:
+            instrument -- the Instrument to freeze.
+        """
+        self.instrument = instrument
+        self.renderer = None        # the ExportRenderer writing the frozen file, while freezing
+        self.frozenFile = None        # the file played instead of the events, while frozen
+        self.frozenLength = 0        # the length of the frozen file in seconds
+        self.frozenKey = None        # the key of the frozen file, while freezing or frozen
+        self.handlers = []        # (object, handler id) of the signals watched for changes
+        self.stopHandler = None    # waits for playback to stop before swapping in the frozen file
+
+    #_____________________________________________________________________
+
+    def get_key(self):
+        """
+        Calculates the key of the frozen file, from everything which
+        affects how the Instrument sounds before its volume and pan.
+
+        Returns:
+            the key as hex digits.
+        """
+        state = []
+        for ev in self.instrument.events:
+            state.append((ev.file, ev.start, ev.duration, ev.offset, ev.get_audio_fade_points()))
+        for effect in self.instrument.effects:
+            settings = sorted(ProjectSnapshot.get_effect_settings(effect).items())
+            state.append((effect.get_factory().get_name(), settings))
+
+        return hashlib.sha1(repr(state).encode("utf-8")).hexdigest()
+
+    #_____________________________________________________________________
+
+    def is_frozen(self):
+        """
+        Returns:
+            True if the Instrument plays its frozen file.
+        """
+        return self.frozenFile is not None
+
+    #_____________________________________________________________________
+
+    def is_freezing(self):
+        """
+        Returns:
+            True if the frozen file is being rendered, or waits for playback
+            to stop.
+        """
+        return self.renderer is not None or self.stopHandler is not None
+
+    #_____________________________________________________________________
+
+    def freeze(self):
+        """
+        Renders the frozen file in the background, or reuses it if it has
+        already been rendered, and swaps it in for the live chain.
+        """
+        if self.is_frozen() or self.is_freezing() or not self.instrument.events:
+            return
+
+        project = self.instrument.project
+        key = self.get_key()
+        path = os.path.join(project.get_frozen_path(), "%d-%s%s" % (self.instrument.id, key, self.FROZEN_FILE_EXTENSION))
+        # the key covers where the events end, so a reused file has the same length
+        length = max(ev.start + ev.duration for ev in self.instrument.events)
+        self.__Watch(key)
+
+        if os.path.exists(path):
+            Globals.debug("Reusing frozen file", path)
+            self.__Apply(path, length)
+            return
+
+        tempPath = path + ".part"
+        encodebin = Gst.parse_bin_from_description(self.ENCODER, True)
+        self.renderer = ExportRenderer(project, [], {self.instrument : [(tempPath, encodebin)]},
+                                       preFader=True, length=length)
+        self.renderer.connect("finished", self.__OnRendered, tempPath, path, length)
+        self.renderer.start()
+        self.instrument.emit("frozen")
+
+    #_____________________________________________________________________
+
+    def unfreeze(self):
+        """
+        Plays the events, fades and effects of the Instrument live again.
+        The frozen file is kept, so freezing it again without changes
+        doesn't need another render.
+        """
+        if self.renderer:
+            # __OnRendered stops watching
+            self.renderer.cancel()
+        if self.stopHandler:
+            self.instrument.project.disconnect(self.stopHandler)
+            self.stopHandler = None
+        if self.frozenFile:
+            self.instrument.swap_out_frozen_source()
+            self.frozenFile = None
+        self.__Unwatch()
+        self.instrument.emit("frozen")
+
+    #_____________________________________________________________________
+
+    def cancel(self):
+        """
+        Stops rendering the frozen file, without swapping anything.
+        """
+        if self.renderer:
+            self.renderer.cancel()
+
+    #_____________________________________________________________________
+
+    def __OnRendered(self, renderer, success, message, tempPath, path, length):
+        """
+        Called when the frozen file has been rendered, has failed or has
+        been cancelled.
+        """
+        self.renderer = None
+        if not success:
+            Globals.debug("Freezing instrument", self.instrument.name, "failed:", message)
+            self.__Unwatch()
+            self.instrument.emit("frozen")
+            return
+
+        os.replace(tempPath, path)
+        self.__Apply(path, length)
+
+    #_____________________________________________________________________
+
+    def __Apply(self, path, length):
+        """
+        Swaps in the frozen file, once playback has stopped.
+        """
+        project = self.instrument.project
+        if project.audioState != project.AUDIO_STOPPED:
+            def stopped(project):
+                project.disconnect(self.stopHandler)
+                self.stopHandler = None
+                self.__Apply(path, length)
+            self.stopHandler = project.connect("audio-state::stop", stopped)
+            return
+
+        Globals.debug("Freezing instrument", self.instrument.name, "to", path)
+        self.frozenFile = path
+        self.frozenLength = length
+        self.instrument.swap_in_frozen_source(path, length)
+        self.instrument.emit("frozen")
+
+    #_____________________________________________________________________
+
+    def __Watch(self, key):
+        """
+        Starts looking out for changes which make the frozen file with
+        the given key out of date.
+        """
+        self.frozenKey = key
+        self.handlers.append((self.instrument, self.instrument.connect("event", self.__OnChanged)))
+        self.handlers.append((self.instrument, self.instrument.connect("effect", self.__OnChanged)))
+        for ev in self.instrument.events:
+            for signal in self.EVENT_SIGNALS:
+                self.handlers.append((ev, ev.connect(signal, self.__OnChanged)))
+        # changing the settings of an effect doesn't emit "effect" on the Instrument
+        for effect in self.instrument.effects:
+            self.handlers.append((effect, effect.connect("notify", self.__OnEffectNotify)))
+
+    #_____________________________________________________________________
+
+    def __Unwatch(self):
+        for obj, handler in self.handlers:
+            obj.disconnect(handler)
+        self.handlers = []
+        self.frozenKey = None
+
+    #_____________________________________________________________________
+
+    def __OnEffectNotify(self, effect, pspec):
+        """
+        Called when a property of an effect changes. Properties which
+        can't be set, like statistics, change while the effect runs,
+        sometimes from the streaming thread, and are left alone.
+        """
+        if pspec.flags & GObject.PARAM_WRITABLE:
+            self.__OnChanged()
+
+    #_____________________________________________________________________
+
+    def __OnChanged(self, *args):
+        """
+        Unfreezes the Instrument and deletes its frozen file if the change
+        affects how it sounds.
+        """
+        if self.get_key() == self.frozenKey:
+            return
+
+        frozenFile = self.frozenFile
+        Globals.debug("Instrument", self.instrument.name, "changed, unfreezing")
+        self.unfreeze()
+        if frozenFile and os.path.exists(frozenFile):
+            os.remove(frozenFile)
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -46,9 +46,15 @@ class InstrumentInfoBox(Gtk.Box):
         self.solo_button.set_property("icon-name", "weather-clear")
         self.instrument_buttons.append(self.solo_button)
         self.solo_button.connect("toggled", self.on_solo_button_toggled)
+        self.freeze_button = Gtk.ToggleButton()
+        self.freeze_button.set_property("icon-name", "weather-snow")
+        self.freeze_button.set_tooltip_text("Freeze: play a render of this instrument instead of its live effects")
+        self.instrument_buttons.append(self.freeze_button)
+        self.freeze_button.connect("toggled", self.on_freeze_button_toggled)
         self.append(self.instrument_buttons)
 
         self.instrument.connect("selected", self.on_instrument_selected)
+        self.instrument.connect("frozen", self.on_instrument_frozen)
 
         self.set_margin_start(5)
         self.set_margin_end(5)
@@ -63,6 +69,21 @@ class InstrumentInfoBox(Gtk.Box):
     def on_solo_button_toggled(self, button):
         return True
 
+    def on_freeze_button_toggled(self, button):
+        freezer = self.instrument.freezer
+        if button.get_active():
+            freezer.freeze()
+        else:
+            freezer.unfreeze()
+        return True
+
+    def on_instrument_frozen(self, instrument):
+        freezer = instrument.freezer
+        self.freeze_button.handler_block_by_func(self.on_freeze_button_toggled)
+        self.freeze_button.set_active(freezer.is_frozen() or freezer.is_freezing())
+        self.freeze_button.handler_unblock_by_func(self.on_freeze_button_toggled)
+        return True
+
     def on_instrument_selected(self, instrument):
         print("Instrument Info Box gets callback on selection")
         if instrument.isSelected:
@@ -86,6 +107,8 @@ class InstrumentInfoBox(Gtk.Box):
     def destroy(self):
         self.record_button.disconnect_by_func(self.on_record_button_toggled)
         self.solo_button.disconnect_by_func(self.on_solo_button_toggled)
+        self.freeze_button.disconnect_by_func(self.on_freeze_button_toggled)
         self.instrument.disconnect_by_func(self.on_instrument_selected)
+        self.instrument.disconnect_by_func(self.on_instrument_frozen)
         self.unparent()
         self.run_dispose()
@@ -9,10 +9,13 @@ gi.require_version('Adw', '1')
 from gi.repository import Gtk, Gio, Adw, Gst, GObject, GdkPixbuf, Gdk
 from .window import JokosherWindow
 from .project import Project
+from .projectloader import ProjectLoader
 from .settings import Settings
 from .globals import Globals
 from .platform_utils import PlatformUtils
 from .jokosherpreferences import JokosherPreferences
+from .levelscache import LevelsCache
+from .waveformtilecache import WaveformTileCache
 
 class JokosherApplication(Adw.Application):
     """The main application singleton class."""
@@ -29,6 +32,8 @@ class JokosherApplication(Adw.Application):
         self.create_action('preferences', self.on_preferences_action)
         # initialise project stuff
         self.project = None
+        # the ProjectLoader of the project being opened, if any
+        self.projectLoader = None
         self.create_action('new-project', self.on_project_new_action)
         self.create_action('save-project', self.on_project_save_action)
         self.create_action('open-project', self.on_project_open_action)
@@ -39,6 +44,11 @@ class JokosherApplication(Adw.Application):
         # TODO initialise settings
         # setup global variables
         self.settings = Settings()
+        # levels of imported audio files, shared between projects
+        self.levels_cache = LevelsCache(os.path.join(self.settings.JOKOSHER_DATA_HOME, "levelscache"),
+                                        self.settings.get_levels_cache_size() * 1024 * 1024)
+        # drawn waveforms of the events of every open window
+        self.waveform_tiles = WaveformTileCache(self.settings.get_waveform_cache_size() * 1024 * 1024)
 
         # some app states
         self.isRecording = False
@@ -132,26 +142,86 @@ class JokosherApplication(Adw.Application):
         #self.props.active_window.on_open_project()
 
     def on_project_save_action(self, widget, _):
-        self.project.save_project_file()
+        self.project.save_project_file(background=True)
 
     def on_project_open_action(self, widget, _):
         # action for opening file dialog
         self.props.active_window.on_open_project_file()
 
     def open_project(self, project_file_path):
-        # try:
+        """
+        Starts opening a project in the background. "project::loading" is
+        emitted right away, with the ProjectLoader in self.projectLoader,
+        and "project::open" once the project has been loaded.
+
+        Parameters:
+            project_file_path -- path to the project file to open.
+
+        Returns:
+            True if opening the project has started.
+        """
+        # only one project is opened at a time
+        if self.projectLoader:
+            self.projectLoader.cancel()
         # we need to close project if any
         if self.project:
             self.close_project()
         uri = PlatformUtils.pathname2url(project_file_path)
-        self.set_project(Project.load_project_file(uri))
-        self.emit("project::open")
-        # app.on_project_open()
-        #self.on_project_open()
+        self.projectLoader = ProjectLoader(uri)
+        self.projectLoader.connect("finished", self.on_project_loaded)
+        self.projectLoader.connect("error", self.on_project_load_error)
+        self.projectLoader.connect("cancelled", self.on_project_load_cancelled)
+        self.projectLoader.start()
+        self.emit("project::loading")
         return True
-        # except ProjectManager.OpenProjectError as e:
-        #     self.ShowOpenProjectErrorDialog(e, parent)
-        #     return False
+
+    def on_project_loaded(self, loader, project):
+        if loader is not self.projectLoader:
+            return
+        self.projectLoader = None
+        self.set_project(project)
+        self.emit("project::open")
+
+    def on_project_load_error(self, loader, error):
+        if loader is not self.projectLoader:
+            return
+        Globals.debug("Opening project failed:", error.errno, error.info)
+        self.projectLoader = None
+        self.ShowOpenProjectErrorDialog(error, self.props.active_window)
+
+    def ShowOpenProjectErrorDialog(self, error, parent=None):
+        """
+        Creates and shows a dialog to inform the user about an error that
+        has ocurred while opening a Project.
+
+        Parameters:
+            error -- the OpenProjectError raised while opening the Project.
+            parent -- parent Gtk.Window of the dialog.
+        """
+        if error.errno == 0:
+            message = _("Unable to read or write to the audio or levels directory of the project.")
+        elif error.errno == 1:
+            message = _("The URI scheme '%s' is either invalid or not supported.") % error.info
+        elif error.errno == 2:
+            message = _("Unable to unzip the project file %s") % error.info
+        elif error.errno == 3:
+            message = _("The project was created with version %s of Jokosher, which is not compatible with this one.") % error.info
+        elif error.errno == 4:
+            message = _("The project file %s does not exist.") % error.info
+        else:
+            message = _("The project file could not be read.")
+
+        dlg = Gtk.MessageDialog(parent,
+            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+            Gtk.MessageType.ERROR,
+            Gtk.ButtonsType.OK,
+            "%s\n\n%s" % (_("Unable to open the project."), message))
+        dlg.connect('response', lambda dlg, response: dlg.destroy())
+        dlg.show()
+
+    def on_project_load_cancelled(self, loader):
+        if loader is self.projectLoader:
+            self.projectLoader = None
 
     def on_project_open(self):
         # method triggered on opening project from open project file dialog
@@ -417,6 +487,8 @@ class JokosherApplication(Adw.Application):
             self.project.Record()
 
     def on_shutdown(self, application):
+        if self.projectLoader:
+            self.projectLoader.cancel()
         self.close_project()
 
     def close_project(self):
@@ -0,0 +1,123 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    levelmeter.py
+#
+#    Collects the readings of the level elements of a project's pipeline and
+#    passes them on to their owners once per frame.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject, Gst
+from .settings import Settings
+from .utils import Utils
+
+class LevelMeter(GObject.GObject):
+    """
+    Finds the owner of each level message from a dictionary of the level
+    elements, keeps only the latest reading of each owner, and hands all
+    the readings over together at most once per frame.
+
+    Signals:
+        "levels" -- the readings since the last update, as a dictionary of
+                    owners -> levels in the range [0,1]. The owners have
+                    already had SetLevel() called with them.
+    """
+
+    """ The shortest time between two updates, in milliseconds """
+    FRAME_INTERVAL = 1000 // 60
+
+    __gsignals__ = {
+        "levels"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_PYOBJECT,) ),
+    }
+
+    def __init__(self):
+        """
+        Creates a new instance of LevelMeter.
+        """
+        GObject.GObject.__init__(self)
+        rate = max(1, Settings.get_settings().get_metering_rate())
+        self.interval = Gst.SECOND // rate    # time between the messages of each level element
+        self.owners = {}            # level elements -> objects with a SetLevel() method
+        self.pending = {}            # owners -> latest level not passed on yet
+        self.updateSource = None    # the timeout passing on the pending levels, if any
+
+    #_____________________________________________________________________
+
+    def add(self, element, owner):
+        """
+        Meters a level element, at the metering rate of the settings.
+
+        Parameters:
+            element -- the level element.
+            owner -- the object to pass its readings to with SetLevel().
+        """
+        element.set_property("interval", self.interval)
+        element.set_property("message", True)
+        self.owners[element] = owner
+
+    #_____________________________________________________________________
+
+    def remove(self, element):
+        """
+        Stops metering a level element.
+
+        Parameters:
+            element -- the level element.
+        """
+        owner = self.owners.pop(element, None)
+        self.pending.pop(owner, None)
+
+    #_____________________________________________________________________
+
+    def on_bus_message(self, bus, message):
+        """
+        Handles GStreamer element messages, keeping the readings of the
+        level elements being metered.
+
+        Parameters:
+            bus -- reserved for GStreamer callbacks, don't use it explicitly.
+            message -- reserved for GStreamer callbacks, don't use it explicitly.
+        """
+        owner = self.owners.get(message.src)
+        if owner is None:
+            return True
+
+        struct = message.get_structure()
+        if struct and struct.get_name() == "level":
+            self.pending[owner] = Utils.DbToFloat(struct["decay"][0])
+            if not self.updateSource:
+                self.updateSource = GObject.timeout_add(self.FRAME_INTERVAL, self.__Update)
+
+        return True
+
+    #_____________________________________________________________________
+
+    def clear(self):
+        """
+        Drops the readings not passed on yet.
+        """
+        if self.updateSource:
+            GObject.source_remove(self.updateSource)
+            self.updateSource = None
+        self.pending = {}
+
+    #_____________________________________________________________________
+
+    def __Update(self):
+        """
+        Passes the pending readings on to their owners.
+        """
+        self.updateSource = None
+        levels, self.pending = self.pending, {}
+        for owner, level in levels.items():
+            owner.SetLevel(level)
+        self.emit("levels", levels)
+
+        #Stop timeout_add from calling us again
+        return False
+
+    #_____________________________________________________________________
+
+#=========================================================================
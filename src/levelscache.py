@@ -0,0 +1,159 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    levelscache.py
+#
+#    A cache of the levels of audio files, shared by every project, so that
+#    a file which has already been imported once doesn't have to be decoded
+#    again to draw its waveform.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import Gio
+from .globals import Globals
+from .levelslist import LevelsList, CorruptFileError
+import hashlib
+import os
+
+class LevelsCache:
+    """
+    Levels files named after a hash of the audio data and of the parameters
+    the levels were calculated with. When the cache grows over its size
+    limit, the least recently used files are removed.
+    """
+
+    LEVELS_FILE_EXTENSION = ".leveldata"
+
+    def __init__(self, path, max_size):
+        """
+        Creates a new instance of LevelsCache.
+
+        Parameters:
+            path -- the directory to keep the levels files in.
+            max_size -- the largest total size of the cache in bytes.
+        """
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def get_cache():
+        app = Gio.Application.get_default()
+        return app.levels_cache
+
+    #_____________________________________________________________________
+
+    def get_key(self, digest, interval, channel_mode):
+        """
+        Calculates the key of the levels of an audio file.
+
+        Parameters:
+            digest -- the hash of the contents of the audio file, as
+                    AudioStore.get_key() calculates it.
+            interval -- the length of audio covered by each level, in seconds.
+            channel_mode -- how the channels of the audio are stored in the levels.
+
+        Returns:
+            the key as a string.
+        """
+        params = "%s:%s:%s:%d" % (digest, interval, channel_mode, LevelsList.VERSION)
+        return hashlib.blake2b(params.encode(), digest_size=20).hexdigest()
+
+    #_____________________________________________________________________
+
+    def lookup(self, key):
+        """
+        Obtain the cached levels for a key.
+
+        Parameters:
+            key -- the key returned by get_key().
+
+        Returns:
+            a LevelsList mapped from the cached file, or None if the levels
+            are not in the cache.
+        """
+        path = self.__GetPath(key)
+        if not os.path.exists(path):
+            return None
+
+        levels_list = LevelsList()
+        try:
+            levels_list.fromfile(path, mapped=True)
+        except CorruptFileError:
+            Globals.debug("Removing corrupt cached levels", path)
+            self.__Remove(path)
+            return None
+
+        try:
+            # mark it as recently used
+            os.utime(path)
+        except OSError:
+            pass
+
+        return levels_list or None
+
+    #_____________________________________________________________________
+
+    def store(self, key, levels_list):
+        """
+        Adds levels to the cache, and removes the least recently used
+        levels if the cache has become too big.
+
+        Parameters:
+            key -- the key returned by get_key().
+            levels_list -- the LevelsList of the whole audio file.
+        """
+        try:
+            levels_list.tofile(self.__GetPath(key))
+        except OSError as e:
+            Globals.debug("Cannot cache levels:", str(e))
+            return
+
+        self.evict()
+
+    #_____________________________________________________________________
+
+    def evict(self):
+        """
+        Removes the least recently used levels until the cache fits in max_size.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(self.LEVELS_FILE_EXTENSION):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.__Remove(path)
+            total -= size
+
+    #_____________________________________________________________________
+
+    def __GetPath(self, key):
+        return os.path.join(self.path, key + self.LEVELS_FILE_EXTENSION)
+
+    #_____________________________________________________________________
+
+    def __Remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -12,52 +12,131 @@
 #-------------------------------------------------------------------------------
 
 from array import array
-import itertools
+import os
+import mmap
+import struct
 import sys
 import bisect
 import copy
+import math
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, everything falls back to plain python loops without it
+    numpy = None
 
 class LevelsList:
     MAGIC_NUMBER = 0x00011011    # an integer with 4 unique bytes used to check endianness
-    VERSION = 1
+    VERSION = 2
     ARRAY_TYPE = 'l'
 
+    # magic, version, length, channels, block size, delta width, flags, number of blocks
+    HEADER_FORMAT = "<IIIHHHHI"
+    # set in the header flags when the peak of each channel follows the RMS levels
+    FLAG_PEAKS = 0x1
+    # number of points in each block of the file, a range can be read starting at any block
+    BLOCK_SIZE = 1024
+    # the largest quantized level stored in the file
+    QUANTIZED_MAX = 0xFFFF
+
+    # each tier of the peak pyramid holds this many times fewer points than the one below
+    PYRAMID_FACTOR = 2
+
     def __init__(self):
-        self.channels = []
+        self.channels = []        # the RMS level of each channel
+        self.peaks = []            # the peak level of each channel, empty if unknown
         self.times = array(self.ARRAY_TYPE)
+        # pre-reduced LevelsTier objects, tier n covers PYRAMID_FACTOR**(n+1) points per point
+        self.tiers = []
+        # the read only mapping of the levels file when times and channels are views into it
+        self.__mapping = None
+        self.__mappedPath = None
 
     #_____________________________________________________________________
 
-    def CreateChannels(self,  num_channels):
+    def CreateChannels(self,  num_channels, with_peaks=False):
         self.channels = []
+        self.peaks = []
+        self.tiers = []
+        self.__mapping = None
         for i in range(num_channels):
             self.channels.append(array(self.ARRAY_TYPE))
+            if with_peaks:
+                self.peaks.append(array(self.ARRAY_TYPE))
 
     #_____________________________________________________________________
 
     def copy(self):
+        """
+        Returns:
+            a LevelsList with the same levels, which doesn't change when
+            this one does. Levels still mapped from their file are shared
+            rather than copied, since they are read only and editing them
+            replaces them with copies first.
+        """
         levelslist = LevelsList()
-        levelslist.times = copy.copy(self.times)
-        levelslist.channels = []
-        for chan in self.channels:
-            levelslist.channels.append(copy.copy(chan))
+        if self.__mapping is not None:
+            levelslist.times = self.times
+            levelslist.channels = list(self.channels)
+            levelslist.peaks = list(self.peaks)
+            levelslist.__mapping = self.__mapping
+            levelslist.__mappedPath = self.__mappedPath
+            return levelslist
+
+        levelslist.times = _copy_values(self.times)
+        levelslist.channels = [_copy_values(chan) for chan in self.channels]
+        levelslist.peaks = [_copy_values(chan) for chan in self.peaks]
 
         return levelslist
 
     #_____________________________________________________________________
 
-    def append(self, endtime, levels):
+    def is_mapped(self):
+        """
+        Returns:
+            True if the levels are still read only views over the levels file.
+        """
+        return self.__mapping is not None
+
+    #_____________________________________________________________________
+
+    def __materialize(self):
+        """
+        Replaces the read only views over the levels file with private
+        copies, so that they can be modified. This is only done the first
+        time the levels are edited, until then nothing is copied.
+        """
+        if self.__mapping is None:
+            return
+
+        self.times = _copy_values(self.times)
+        self.channels = [_copy_values(chan) for chan in self.channels]
+        self.peaks = [_copy_values(chan) for chan in self.peaks]
+        # the file is unmapped once the last view into it goes away
+        self.__mapping = None
+        self.__mappedPath = None
+
+    #_____________________________________________________________________
+
+    def append(self, endtime, levels, peaks=None):
         """
         Append a set of waveforms to the current list,
         and associates them with the given end time.
+
+        Parameters:
+            endtime -- the end time of the levels in milliseconds.
+            levels -- the RMS level of each channel.
+            peaks -- the peak level of each channel, if known.
         """
         if not self.channels:
-            self.CreateChannels(len(levels))
+            self.CreateChannels(len(levels), peaks is not None)
 
+        self.__materialize()
         assert len(self.channels) == len(levels)
         # make sure the endtime is greater than the previous endtime
         # if this is the first endtime, make sure its bigger than 0
-        assert endtime > (self.times[-1] if self.times else 0)
+        assert endtime > (self.times[-1] if len(self.times) else 0)
 
         self.times.append(endtime)
 
@@ -65,46 +144,283 @@ class LevelsList:
             chan.append(level)
             assert len(self.times) == len(chan)
 
+        if self.peaks:
+            assert peaks is not None and len(self.peaks) == len(peaks)
+            for level, chan in zip(peaks, self.peaks):
+                chan.append(level)
+
     #_____________________________________________________________________
 
-    def append_time_delta(self, time_delta, levels):
-        if self.times:
+    def append_block(self, endtimes, levels, peaks=None):
+        """
+        Appends many points at once, which is a lot faster than calling
+        append() for each of them when the levels are numpy arrays.
+
+        Parameters:
+            endtimes -- the increasing end times of the points in milliseconds.
+            levels -- the RMS levels, as one sequence for each channel.
+            peaks -- the peak levels in the same form, if known.
+        """
+        if not self.channels:
+            self.CreateChannels(len(levels), peaks is not None)
+
+        self.__materialize()
+        assert len(self.channels) == len(levels)
+        if len(endtimes):
+            assert endtimes[0] > (self.times[-1] if len(self.times) else 0)
+
+        _concat(self.times, endtimes)
+        for values, chan in zip(levels, self.channels):
+            _concat(chan, values)
+            assert len(self.times) == len(chan)
+
+        if self.peaks:
+            assert peaks is not None and len(self.peaks) == len(peaks)
+            for values, chan in zip(peaks, self.peaks):
+                _concat(chan, values)
+
+    #_____________________________________________________________________
+
+    def append_time_delta(self, time_delta, levels, peaks=None):
+        if len(self.times):
             last_time = self.times[-1]
         else:
             last_time = 0
 
-        self.append(last_time + time_delta, levels)
+        self.append(last_time + time_delta, levels, peaks)
 
     #_____________________________________________________________________
 
     def extend(self, basetime, levelslist):
+        self.__materialize()
         old_length = len(self.times)
-        self.times.extend(levelslist.times)
+        _concat(self.times, levelslist.times)
 
         # shift the new endtimes to match the length of the original audio clip
-        for idx in range(old_length, len(self.times)):
-            time = self.times[idx]
-            self.times[idx] = time + basetime
+        if numpy is not None:
+            _view(self.times)[old_length:] += basetime
+        else:
+            for idx in range(old_length, len(self.times)):
+                self.times[idx] += basetime
 
         assert len(self.channels) == len(levelslist.channels)
-        for chan, lchan in itertools.izip(self.channels, levelslist.channels):
-            chan.extend(lchan)
+        for chan, lchan in zip(self.channels, levelslist.channels):
+            _concat(chan, lchan)
 
+        if len(self.peaks) == len(levelslist.peaks):
+            for chan, lchan in zip(self.peaks, levelslist.peaks):
+                _concat(chan, lchan)
+        else:
+            # only one side has peaks, they would no longer line up with the times
+            self.peaks = []
+
+        # the appended points can't be merged into the existing tiers
+        self.tiers = []
 
     #_____________________________________________________________________
 
-    def fromfile(self,  path):
+    def fromfile(self, path, mapped=True):
+        """
+        Loads the levels from the given file. Both the current format
+        and the older version 1 files are understood.
+
+        Parameters:
+            path -- the levels file to read.
+            mapped -- if True and numpy is available, the file is mapped
+                      into memory instead of being read, and the levels
+                      stay read only views into it until they are edited.
+                      The pages are then only read in when used, and the
+                      blocks of the current format are only decoded when
+                      their range is used.
+        """
+        mapped = mapped and numpy is not None
         try:
-            self.__fromfile(path)
-        except (EOFError, IOError):
+            with open(path, "rb") as f:
+                header = self.__readheader(f)
+                if header and not mapped:
+                    self.__fromfile_v2(f, header)
+                    return
+
+            if header:
+                self.__frommapping_v2(path, header)
+            elif not (mapped and self.__frommapping(path)):
+                self.__fromfile(path)
+        except (EOFError, IOError, ValueError, struct.error):
             # on error delete all partially loaded data
             self.channels = []
+            self.peaks = []
             self.times = array(self.ARRAY_TYPE)
+            self.tiers = []
+            self.__mapping = None
             raise CorruptFileError()
 
     #_____________________________________________________________________
 
+    def fromfile_range(self, path, starttime, stoptime=None):
+        """
+        Loads only the levels between the given times from a file. The end
+        times are made relative to starttime, so this gives the same result
+        as calling slice_by_endtime() on the whole file, but with the current
+        format only the blocks covering the range are read.
+
+        Parameters:
+            path -- the levels file to read.
+            starttime -- the start of the range in milliseconds.
+            stoptime -- the end of the range in milliseconds, or None to
+                        read until the end of the file.
+        """
+        levelslist = LevelsList()
+        try:
+            with open(path, "rb") as f:
+                header = self.__readheader(f)
+                if header:
+                    levelslist.__fromfile_v2(f, header, starttime, stoptime)
+        except (EOFError, IOError, ValueError, struct.error):
+            raise CorruptFileError()
+
+        if not header:
+            levelslist.fromfile(path)
+
+        levelslist = levelslist.slice_by_endtime(starttime, stoptime)
+        self.CreateChannels(len(levelslist.channels))
+        self.times = levelslist.times
+        self.channels = levelslist.channels
+        self.peaks = levelslist.peaks
+
+    #_____________________________________________________________________
+
+    def __readheader(self, f):
+        """
+        Reads the header of a levels file in the current format.
+
+        Returns:
+            a dictionary with the header fields, or None if the file
+            is in the old version 1 format. The file position is then
+            left at the start of the file.
+        """
+        data = f.read(struct.calcsize(self.HEADER_FORMAT))
+        if len(data) >= 8 and struct.unpack("<II", data[:8]) == (self.MAGIC_NUMBER, self.VERSION):
+            if len(data) < struct.calcsize(self.HEADER_FORMAT):
+                raise EOFError()
+            names = ("magic", "version", "length", "channels", "block_size",
+                     "delta_width", "flags", "blocks")
+            return dict(zip(names, struct.unpack(self.HEADER_FORMAT, data)))
+
+        f.seek(0)
+        return None
+
+    #_____________________________________________________________________
+
+    def __fromfile_v2(self, f, header, starttime=None, stoptime=None):
+        """
+        Reads the rest of a levels file in the current format, after the
+        header. If starttime is given, only the blocks which may contain
+        points between starttime and stoptime are read.
+        """
+        length = header["length"]
+        block_size = header["block_size"]
+        num_blocks = header["blocks"]
+        delta_type = "H" if header["delta_width"] == 2 else "I"
+        base = _read_le(f, num_blocks, "q")
+
+        first_block, last_block = 0, num_blocks
+        if starttime is not None:
+            first_block = max(bisect.bisect_right(base, starttime) - 1, 0)
+        if stoptime is not None:
+            last_block = max(bisect.bisect_left(base, stoptime), first_block)
+
+        start = first_block * block_size
+        count = min(last_block * block_size, length) - start
+        data_start = f.tell()
+
+        f.seek(data_start + start * header["delta_width"])
+        deltas = _read_le(f, count, delta_type)
+        self.CreateChannels(header["channels"], bool(header["flags"] & self.FLAG_PEAKS))
+        self.times = _undelta(base[first_block:last_block], deltas, block_size)
+
+        chan_start = data_start + length * header["delta_width"]
+        for index, chan in enumerate(self.channels + self.peaks):
+            f.seek(chan_start + (index * length + start) * 2)
+            chan.extend(_dequantize(_read_le(f, count, "H")))
+
+    #_____________________________________________________________________
+
+    def __frommapping_v2(self, path, header):
+        """
+        Maps the given levels file in the current format and points times
+        and channels at it. The quantized levels and the deltas are left
+        in the file, and are only decoded for the ranges which are used.
+        """
+        length = header["length"]
+        num_blocks = header["blocks"]
+        delta_width = header["delta_width"]
+        num_channels = header["channels"]
+        with_peaks = bool(header["flags"] & self.FLAG_PEAKS)
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        base_start = struct.calcsize(self.HEADER_FORMAT)
+        data_start = base_start + num_blocks * 8
+        chan_start = data_start + length * delta_width
+        num_values = num_channels * (2 if with_peaks else 1)
+        if len(mapping) < chan_start + num_values * length * 2:
+            raise EOFError()
+
+        def view(dtype, count, offset):
+            return numpy.frombuffer(mapping, dtype=dtype, count=count, offset=offset)
+
+        base = view(_LITTLE_ENDIAN_TYPES["q"], num_blocks, base_start)
+        deltas = view(_LITTLE_ENDIAN_TYPES["H" if delta_width == 2 else "I"], length, data_start)
+        values = [_MappedLevels(view(_LITTLE_ENDIAN_TYPES["H"], length, chan_start + index * length * 2))
+                  for index in range(num_values)]
+
+        self.CreateChannels(num_channels)
+        self.times = _MappedTimes(base, deltas, header["block_size"])
+        self.channels = values[:num_channels]
+        self.peaks = values[num_channels:]
+        self.__mapping = mapping
+        self.__mappedPath = os.path.abspath(path)
+
+    #_____________________________________________________________________
+
+    def __frommapping(self, path):
+        """
+        Maps the given version 1 levels file and points times and channels at it.
+
+        Returns:
+            False if the file can't be used in place (it was written with
+            another byte order), True otherwise.
+        """
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        itemsize = array(self.ARRAY_TYPE).itemsize
+        info = numpy.frombuffer(mapping, dtype=self.ARRAY_TYPE, count=4)
+        magic, version, length, num_channels = [int(x) for x in info]
+        if magic != self.MAGIC_NUMBER:
+            return False
+
+        assert version == 1
+        if len(mapping) < (4 + length * (num_channels + 1)) * itemsize:
+            raise EOFError()
+
+        def view(index):
+            offset = (4 + index * length) * itemsize
+            return numpy.frombuffer(mapping, dtype=self.ARRAY_TYPE, count=length, offset=offset)
+
+        self.CreateChannels(num_channels)
+        self.times = view(0)
+        self.channels = [view(i + 1) for i in range(num_channels)]
+        self.__mapping = mapping
+        self.__mappedPath = os.path.abspath(path)
+        return True
+
+    #_____________________________________________________________________
+
     def __fromfile(self,  path):
+        """
+        Reads a version 1 levels file, which is made of native longs.
+        """
         f = open(path,  "rb")
         info = array(self.ARRAY_TYPE)
         info.fromfile(f,  4)
@@ -118,9 +434,9 @@ class LevelsList:
                 raise CorruptFileError("unknown endianness in levels file")
             else:
                 byteswap = True
+                magic,  version,  length,  num_channels = info
 
-        #currently there is only one version
-        assert version == self.VERSION
+        assert version == 1
 
         self.times = array(self.ARRAY_TYPE)
         self.times.fromfile(f,  length)
@@ -131,31 +447,129 @@ class LevelsList:
         for chan in self.channels:
             chan.fromfile(f,  length)
             if byteswap:
-                self.times.byteswap()
+                chan.byteswap()
             assert len(self.times) == len(chan)
 
     #_____________________________________________________________________
 
     def tofile(self,  path):
-        f = open(path,  "wb")
-        info = array(self.ARRAY_TYPE)
-        info.append(self.MAGIC_NUMBER)
-        info.append(self.VERSION)
-        info.append(len(self.times))
-        info.append(len(self.channels))
+        """
+        Writes the levels to the given file in the current format:
+        a little endian header, the end time of the first point of each
+        block, the end time deltas and the 16 bit quantized levels of
+        each channel in turn, followed by the peaks of each channel.
+        """
+        if self.__mapping is not None and self.__mappedPath == os.path.abspath(path):
+            # nothing was edited since the file was mapped, it is already up to date
+            return
 
-        info.tofile(f)
-        self.times.tofile(f)
-        for chan in self.channels:
-            chan.tofile(f)
+        length = len(self.times)
+        block_size = self.BLOCK_SIZE
+        base = [self.times[i] for i in range(0, length, block_size)]
+        deltas = _delta(self.times, block_size)
+        delta_width = 2 if max(deltas, default=0) <= 0xFFFF else 4
+
+        flags = self.FLAG_PEAKS if self.peaks else 0
+        header = struct.pack(self.HEADER_FORMAT, self.MAGIC_NUMBER, self.VERSION, length,
+                             len(self.channels), block_size, delta_width, flags, len(base))
+
+        # write to a temporary file first, the old one might still be mapped by someone
+        with open(path + "~", "wb") as f:
+            f.write(header)
+            _write_le(f, base, "q")
+            _write_le(f, deltas, "H" if delta_width == 2 else "I")
+            for chan in self.channels + self.peaks:
+                _write_le(f, _quantize(chan), "H")
+        os.replace(path + "~", path)
 
     #_____________________________________________________________________
 
     def find_endtime_index(self, time):
+        if numpy is not None and isinstance(self.times, numpy.ndarray):
+            return int(numpy.searchsorted(self.times, time))
+        if isinstance(self.times, _MappedTimes):
+            return self.times.find(time)
         return bisect.bisect_left(self.times, time)
 
     #_____________________________________________________________________
 
+    def iter_from(self, index):
+        """
+        Iterates over (endtime, levels) pairs starting at the given index,
+        where levels is a tuple of the RMS level of each channel.
+        """
+        return zip(_iter_values(self.times, index),
+                   zip(*[_iter_values(chan, index) for chan in self.channels]))
+
+    #_____________________________________________________________________
+
+    def iter_channel(self, index, channel, peaks=False):
+        """
+        Iterates over (endtime, level) pairs of a single channel, starting
+        at the given index without touching any of the points before it.
+
+        Parameters:
+            index -- the index of the first point.
+            channel -- the channel number.
+            peaks -- True to iterate over the peak levels instead of RMS.
+        """
+        values = self.peaks[channel] if peaks else self.channels[channel]
+        return zip(_iter_values(self.times, index), _iter_values(values, index))
+
+    #_____________________________________________________________________
+
+    def get_tier(self, min_interval):
+        """
+        Obtain the coarsest level of detail which still has at most one
+        point every min_interval milliseconds, so that drawing it costs
+        the same regardless of the length of the audio.
+
+        Parameters:
+            min_interval -- the smallest wanted distance between two points
+                            in milliseconds.
+
+        Returns:
+            this LevelsList if no reduction is needed, otherwise a LevelsTier.
+        """
+        if len(self.times) < self.PYRAMID_FACTOR:
+            return self
+
+        # the average distance between two points of the full resolution list
+        interval = self.times[-1] / float(len(self.times))
+        factor = 1
+        depth = 0
+        while interval * factor * self.PYRAMID_FACTOR <= min_interval and \
+                len(self.times) > factor * self.PYRAMID_FACTOR:
+            factor *= self.PYRAMID_FACTOR
+            depth += 1
+
+        if depth == 0:
+            return self
+
+        self.__UpdateTiers(depth)
+        return self.tiers[depth - 1]
+
+    #_____________________________________________________________________
+
+    def __UpdateTiers(self, depth):
+        """
+        Builds or extends the peak pyramid up to the given depth. Only the
+        points added since the last call are reduced, so this is cheap while
+        a waveform is still loading.
+        """
+        while len(self.tiers) < depth:
+            self.tiers.append(LevelsTier(len(self.channels)))
+
+        source = self
+        for tier in self.tiers[:depth]:
+            if tier.consumed > len(source.times):
+                # the source has shrunk underneath us, start over
+                tier.clear()
+            tier.reduce(source, self.PYRAMID_FACTOR)
+            source = tier
+
+    #_____________________________________________________________________
+
     def slice_by_endtime(self, starttime, stoptime=None):
         if stoptime is None:
             stop_idx = len(self.times)
@@ -165,31 +579,105 @@ class LevelsList:
 
         start_idx = self.find_endtime_index(starttime)
         levelslist = LevelsList()
-        levelslist.times = self.times[start_idx:stop_idx]
+        levelslist.times = _copy_values(self.times[start_idx:stop_idx])
 
         # adjust the endtimes so they are relative to the new start time.
-        for idx, time in enumerate(levelslist.times):
-            levelslist.times[idx] = time - starttime
+        if numpy is not None:
+            _view(levelslist.times)[:] -= starttime
+        else:
+            for idx, time in enumerate(levelslist.times):
+                levelslist.times[idx] = time - starttime
 
-        levelslist.channels = []
-        for chan in self.channels:
-            levelslist.channels.append(chan[start_idx:stop_idx])
+        levelslist.channels = [_copy_values(chan[start_idx:stop_idx]) for chan in self.channels]
+        levelslist.peaks = [_copy_values(chan[start_idx:stop_idx]) for chan in self.peaks]
 
         return levelslist
 
     #_____________________________________________________________________
 
+    def scale_by_fade(self, fade_times, fade_values):
+        """
+        Creates a copy of this list with the levels of every channel
+        scaled by the piecewise linear curve through the given fade points.
+        Levels before the first or after the last fade point are scaled
+        by the value of that point.
+
+        Parameters:
+            fade_times -- ascending times of the fade points in milliseconds.
+            fade_values -- the volume at each fade point, between 0.0 and 1.0.
+
+        Returns:
+            a new LevelsList with the faded levels.
+        """
+        levelslist = LevelsList()
+        levelslist.times = _copy_values(self.times)
+        levelslist.channels = [_copy_values(chan) for chan in self.channels]
+        levelslist.peaks = [_copy_values(chan) for chan in self.peaks]
+        levelslist.refade(self, fade_times, fade_values)
+
+        return levelslist
+
+    #_____________________________________________________________________
+
+    def refade(self, source, fade_times, fade_values, starttime=0, stoptime=None):
+        """
+        Scales the levels of source by the fade curve again, but only
+        between two times, for when the fade points in between have changed.
+        This list must be the result of source.scale_by_fade(), the levels
+        outside of the span and its peak pyramid outside of the span are
+        left as they are.
+
+        Parameters:
+            source -- the LevelsList this list is a faded copy of.
+            fade_times -- ascending times of the fade points in milliseconds.
+            fade_values -- the volume at each fade point, between 0.0 and 1.0.
+            starttime -- the start of the changed span in milliseconds.
+            stoptime -- the end of the changed span in milliseconds,
+                        or None to go to the end of the list.
+        """
+        start = self.find_endtime_index(starttime)
+        if stoptime is None:
+            stop = len(self.times)
+        else:
+            # the point ending after stoptime still starts before it
+            stop = min(self.find_endtime_index(stoptime) + 1, len(self.times))
+        if start >= stop:
+            return
+
+        if numpy is not None:
+            gain = numpy.interp(_view_range(self.times, start, stop), fade_times, fade_values)
+            def fade(faded, chan):
+                _assign(faded, start, _view_range(chan, start, stop) * gain)
+        else:
+            gain = list(_interpolate(self.times[start:stop], fade_times, fade_values))
+            def fade(faded, chan):
+                faded[start:stop] = array(self.ARRAY_TYPE,
+                        [int(level * value) for level, value in zip(chan[start:stop], gain)])
+
+        for faded, chan in zip(self.channels, source.channels):
+            fade(faded, chan)
+        for faded, chan in zip(self.peaks, source.peaks):
+            fade(faded, chan)
+
+        # only the points of the pyramid made from the changed span are redone
+        below = self
+        for tier in self.tiers:
+            start, stop = tier.update(below, self.PYRAMID_FACTOR, start, stop)
+            below = tier
+
+    #_____________________________________________________________________
+
     def __iter__(self):
-        # FIXME: hard coded single channel
-        if not self.channels:
-            self.CreateChannels(1)
-        return zip(self.times,  self.channels[0])
+        """
+        Iterates over (endtime, levels) pairs, where levels is a tuple of
+        the RMS level of each channel, as iter_from() does.
+        """
+        return self.iter_from(0)
 
     #_____________________________________________________________________
 
     def __getitem__(self, index):
-        # FIXME: hard coded single channel
-        return (self.times[index], self.channels[0][index])
+        return (int(self.times[index]), tuple(int(chan[index]) for chan in self.channels))
 
     #_____________________________________________________________________
 
@@ -199,13 +687,504 @@ class LevelsList:
 
 #=========================================================================
 
-def add(list_one, list_two):
+class LevelsTier:
+    """
+    One level of the peak pyramid of a LevelsList. Each point holds the
+    maximum, minimum and RMS of a group of points from the level below,
+    along with the end time of the last point in the group. The maxima
+    come from the peak levels when the LevelsList has them.
+    """
+
+    def __init__(self, num_channels):
+        self.times = array(LevelsList.ARRAY_TYPE)
+        self.maxima = [array(LevelsList.ARRAY_TYPE) for i in range(num_channels)]
+        self.minima = [array(LevelsList.ARRAY_TYPE) for i in range(num_channels)]
+        self.rms = [array(LevelsList.ARRAY_TYPE) for i in range(num_channels)]
+        self.consumed = 0        # number of source points already reduced into this tier
+        self.partial = False     # True if the last point was made from an incomplete group
+
+    #_____________________________________________________________________
+
+    def clear(self):
+        for values in [self.times] + self.maxima + self.minima + self.rms:
+            del values[:]
+        self.consumed = 0
+        self.partial = False
+
+    #_____________________________________________________________________
+
+    def reduce(self, source, factor):
+        """
+        Appends the points of source which have not been reduced yet.
+
+        Parameters:
+            source -- the LevelsList or LevelsTier one level below this one.
+            factor -- the number of source points merged into each point.
+        """
+        if self.partial:
+            # the trailing group may have grown since it was reduced
+            for values in [self.times] + self.maxima + self.minima + self.rms:
+                values.pop()
+            self.consumed -= self.consumed % factor or factor
+            self.partial = False
+
+        length = len(source.times)
+        if self.consumed >= length:
+            return
+
+        times, maxima, minima, rms = self.__ReduceGroups(source, factor, self.consumed, length)
+        self.times.extend(times)
+        for chan in range(len(self.maxima)):
+            self.maxima[chan].extend(maxima[chan])
+            self.minima[chan].extend(minima[chan])
+            self.rms[chan].extend(rms[chan])
+
+        # a group ending in an incomplete source point has to be redone too
+        source_partial = isinstance(source, LevelsTier) and source.partial
+        self.partial = (length - self.consumed) % factor != 0 or source_partial
+        self.consumed = length
+
+    #_____________________________________________________________________
+
+    def update(self, source, factor, start, stop):
+        """
+        Reduces the groups of source points between start and stop again,
+        after their levels have been changed in place. Points of source
+        which have not been reduced yet are left for reduce().
+
+        Parameters:
+            source -- the LevelsList or LevelsTier one level below this one.
+            factor -- the number of source points merged into each point.
+            start -- index of the first changed source point.
+            stop -- index after the last changed source point.
+
+        Returns:
+            the (start, stop) range of the points of this tier which changed.
+        """
+        stop = min(stop, self.consumed)
+        first = start // factor
+        last = (stop + factor - 1) // factor
+        if first >= last:
+            return first, first
+
+        times, maxima, minima, rms = self.__ReduceGroups(source, factor, first * factor,
+                                                         min(last * factor, self.consumed))
+        for chan in range(len(self.maxima)):
+            self.maxima[chan][first:last] = maxima[chan]
+            self.minima[chan][first:last] = minima[chan]
+            self.rms[chan][first:last] = rms[chan]
+
+        return first, last
+
+    #_____________________________________________________________________
+
+    def __ReduceGroups(self, source, factor, start, stop):
+        """
+        Merges each group of factor source points from start to stop into
+        a single point. The last group may be smaller.
+
+        Returns:
+            the times of the new points, and their maxima, minima and RMS
+            levels as a list of arrays with one array per channel.
+        """
+        if isinstance(source, LevelsTier):
+            maxima, minima, rms = source.maxima, source.minima, source.rms
+        else:
+            minima = rms = source.channels
+            maxima = source.peaks or source.channels
+
+        channels = range(len(self.maxima))
+        times = array(LevelsList.ARRAY_TYPE)
+        newMaxima = [array(LevelsList.ARRAY_TYPE) for chan in channels]
+        newMinima = [array(LevelsList.ARRAY_TYPE) for chan in channels]
+        newRms = [array(LevelsList.ARRAY_TYPE) for chan in channels]
+
+        groups = (stop - start) // factor
+        if numpy is not None and groups:
+            # reduce all of the complete groups at once
+            end = start + groups * factor
+            _extend(times, _view_range(source.times, start, end)[factor - 1::factor])
+            for chan in channels:
+                _extend(newMaxima[chan], _view_range(maxima[chan], start, end).reshape(groups, factor).max(axis=1))
+                _extend(newMinima[chan], _view_range(minima[chan], start, end).reshape(groups, factor).min(axis=1))
+                squares = numpy.square(_view_range(rms[chan], start, end).astype(float)).reshape(groups, factor)
+                _extend(newRms[chan], numpy.sqrt(squares.mean(axis=1)))
+            start = end
+
+        while start < stop:
+            end = min(start + factor, stop)
+            times.append(source.times[end - 1])
+            for chan in channels:
+                newMaxima[chan].append(max(maxima[chan][start:end]))
+                newMinima[chan].append(min(minima[chan][start:end]))
+                squares = sum(float(x) * x for x in rms[chan][start:end])
+                newRms[chan].append(min(int(math.sqrt(squares / (end - start))), sys.maxsize))
+            start = end
+
+        return times, newMaxima, newMinima, newRms
+
+    #_____________________________________________________________________
+
+    def find_endtime_index(self, time):
+        return bisect.bisect_left(self.times, time)
+
+    #_____________________________________________________________________
+
+    @property
+    def channels(self):
+        # the same interface as a LevelsList, for drawing
+        return self.rms
+
+    #_____________________________________________________________________
+
+    @property
+    def peaks(self):
+        return self.maxima
+
+    #_____________________________________________________________________
+
+    def iter_from(self, index):
+        return zip(self.times[index:], zip(*[chan[index:] for chan in self.rms]))
+
+    #_____________________________________________________________________
+
+    def iter_channel(self, index, channel, peaks=False):
+        values = self.maxima[channel] if peaks else self.rms[channel]
+        return zip(self.times[index:], values[index:])
+
+    #_____________________________________________________________________
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    #_____________________________________________________________________
+
+    def __len__(self):
+        return len(self.times)
+
+    #_____________________________________________________________________
+
+#=========================================================================
+
+def add(list_one, list_two, basetime):
     levelslist = list_one.copy()
-    levelslist.extend(list_two)
+    levelslist.extend(basetime, list_two)
     return levelslist
 
 #=========================================================================
 
+def _view(values):
+    """
+    Returns a numpy array sharing its memory with the given array, so
+    that it can be modified in place with a single vectorized operation.
+    The view must not be kept around, the array can't be resized while
+    it is alive.
+    """
+    if isinstance(values, numpy.ndarray):
+        return values
+    if isinstance(values, _MappedValues):
+        # decodes all of it, _view_range() only decodes what is used
+        return values[0:len(values)]
+    if not len(values):
+        return numpy.zeros(0, dtype=LevelsList.ARRAY_TYPE)
+    return numpy.frombuffer(values, dtype=LevelsList.ARRAY_TYPE)
+
+#=========================================================================
+
+def _view_range(values, start, stop):
+    """
+    Returns a numpy array of the values from start to stop, like
+    _view(values)[start:stop], but only decoding that range of
+    values mapped from a levels file.
+    """
+    if isinstance(values, _MappedValues):
+        return values[start:stop]
+    return _view(values)[start:stop]
+
+#=========================================================================
+
+def _extend(values, ndarray):
+    """
+    Appends the contents of a numpy array to the given array, clipping
+    floating point results to the range of the array type.
+    """
+    if ndarray.dtype.kind == 'f':
+        # floats can round up past the largest integer which would overflow
+        ndarray = numpy.clip(ndarray, -_MAX_LEVEL_FLOAT, _MAX_LEVEL_FLOAT)
+    values.frombytes(numpy.ascontiguousarray(ndarray, dtype=LevelsList.ARRAY_TYPE).tobytes())
+
+if numpy is not None:
+    _MAX_LEVEL_FLOAT = numpy.nextafter(float(sys.maxsize), 0)
+
+#=========================================================================
+
+def _assign(values, start, ndarray):
+    """
+    Overwrites the given array from start on with the contents of a
+    numpy array, clipping floating point results like _extend().
+    """
+    if ndarray.dtype.kind == 'f':
+        ndarray = numpy.clip(ndarray, -_MAX_LEVEL_FLOAT, _MAX_LEVEL_FLOAT)
+    _view(values)[start:start + len(ndarray)] = ndarray
+
+#=========================================================================
+
+def _copy_values(values):
+    """
+    Returns a private, writable array('l') copy of an array or of a
+    numpy view into a mapped levels file.
+    """
+    if isinstance(values, array):
+        return copy.copy(values)
+    return array(LevelsList.ARRAY_TYPE, values.tobytes())
+
+#=========================================================================
+
+def _concat(values, other):
+    """
+    Appends an array, a numpy array or any other sequence of
+    numbers to the end of the given array.
+    """
+    if isinstance(other, _MappedValues):
+        _extend(values, _view(other))
+    elif numpy is not None and isinstance(other, numpy.ndarray):
+        _extend(values, other)
+    else:
+        values.extend(other)
+
+#=========================================================================
+
+def _iter_values(values, index):
+    """
+    Iterates over the values from index onwards as python integers.
+    """
+    if isinstance(values, array):
+        return iter(values[index:])
+    if isinstance(values, _MappedValues):
+        return values.iter_from(index)
+    # a numpy slice doesn't copy anything, and only the pages used are read
+    return map(int, values[index:])
+
+#=========================================================================
+
+_LITTLE_ENDIAN_TYPES = {"H" : "<u2", "I" : "<u4", "q" : "<i8"}
+
+def _write_le(f, values, typecode):
+    """
+    Writes the values to the file as little endian integers of the given array type.
+    """
+    if numpy is not None:
+        f.write(numpy.asarray(values).astype(_LITTLE_ENDIAN_TYPES[typecode]).tobytes())
+    else:
+        values = array(typecode, values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        values.tofile(f)
+
+#=========================================================================
+
+def _read_le(f, count, typecode):
+    """
+    Reads count little endian integers of the given array type from the file.
+    """
+    size = count * array(typecode).itemsize
+    data = f.read(size)
+    if len(data) < size:
+        raise EOFError()
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=_LITTLE_ENDIAN_TYPES[typecode])
+
+    values = array(typecode, data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+#=========================================================================
+
+def _delta(times, block_size):
+    """
+    Returns the difference between each end time and the previous one,
+    with the first delta of every block set to 0.
+    """
+    if numpy is not None:
+        deltas = numpy.diff(_view(times), prepend=0)
+        deltas[::block_size] = 0
+        return deltas
+
+    return [0 if i % block_size == 0 else times[i] - times[i - 1] for i in range(len(times))]
+
+#=========================================================================
+
+def _undelta(base, deltas, block_size):
+    """
+    Rebuilds the end times from the deltas of consecutive blocks and the
+    end time of the first point of each of them.
+    """
+    times = array(LevelsList.ARRAY_TYPE)
+    if numpy is not None:
+        if len(deltas):
+            summed = numpy.cumsum(deltas, dtype=LevelsList.ARRAY_TYPE)
+            offsets = numpy.asarray(base, dtype=LevelsList.ARRAY_TYPE) - summed[::block_size]
+            _extend(times, summed + numpy.repeat(offsets, block_size)[:len(deltas)])
+        return times
+
+    for index, delta in enumerate(deltas):
+        if index % block_size == 0:
+            times.append(base[index // block_size])
+        else:
+            times.append(times[-1] + delta)
+    return times
+
+#=========================================================================
+
+def _quantize(values):
+    """
+    Scales levels between 0 and sys.maxsize down to 16 bits.
+    """
+    if numpy is not None:
+        scaled = numpy.rint(_view(values) * (LevelsList.QUANTIZED_MAX / float(sys.maxsize)))
+        return numpy.clip(scaled, 0, LevelsList.QUANTIZED_MAX)
+
+    return [min(max((level * LevelsList.QUANTIZED_MAX + sys.maxsize // 2) // sys.maxsize, 0),
+                LevelsList.QUANTIZED_MAX) for level in values]
+
+#=========================================================================
+
+def _dequantize(values):
+    """
+    Scales 16 bit levels read from a file back up to the range of the array type.
+    """
+    levels = array(LevelsList.ARRAY_TYPE)
+    if numpy is not None:
+        _extend(levels, values * (sys.maxsize / float(LevelsList.QUANTIZED_MAX)))
+    else:
+        levels.extend(level * sys.maxsize // LevelsList.QUANTIZED_MAX for level in values)
+    return levels
+
+#=========================================================================
+
+def _interpolate(times, fade_times, fade_values):
+    """
+    Generator yielding the value of the piecewise linear curve through
+    the given fade points at each of the given (ascending) times.
+    """
+    index = 0
+    last = len(fade_times) - 1
+    for time in times:
+        while index < last and time > fade_times[index + 1]:
+            index += 1
+
+        if time <= fade_times[0]:
+            yield fade_values[0]
+        elif index >= last:
+            yield fade_values[-1]
+        else:
+            span = fade_times[index + 1] - fade_times[index]
+            rel = (time - fade_times[index]) / float(span) if span else 1.0
+            yield fade_values[index] + (fade_values[index + 1] - fade_values[index]) * rel
+
+#=========================================================================
+
+class _MappedValues:
+    """
+    A read only sequence of the values of a levels file in the current
+    format mapped into memory, which decodes only the values asked for.
+    Indexing gives a python integer and slicing a numpy array of the
+    array type, like a numpy view into a version 1 file would.
+    """
+
+    # the number of values decoded at a time while iterating
+    ITER_SIZE = 1024
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step > 0
+            if start >= stop:
+                return numpy.zeros(0, dtype=LevelsList.ARRAY_TYPE)
+            return self.decode(start, stop)[::step]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("levels index out of range")
+        return int(self.decode(index, index + 1)[0])
+
+    def decode(self, start, stop):
+        """
+        Returns:
+            the values from start to stop as a numpy array.
+        """
+        raise NotImplementedError
+
+    def iter_from(self, index):
+        """
+        Iterates over the values from index onwards as python integers,
+        decoding them a few at a time.
+        """
+        for start in range(index, len(self), self.ITER_SIZE):
+            yield from map(int, self.decode(start, min(start + self.ITER_SIZE, len(self))))
+
+    def tobytes(self):
+        return self[0:len(self)].tobytes()
+
+#=========================================================================
+
+class _MappedTimes(_MappedValues):
+    """
+    The end times of a mapped levels file, rebuilt from the end time of
+    the first point and the deltas of each block which is used.
+    """
+
+    def __init__(self, base, deltas, block_size):
+        self.base = base            # the end time of the first point of each block
+        self.deltas = deltas        # the end time deltas, 0 at the start of each block
+        self.block_size = block_size
+        self.ITER_SIZE = block_size    # iterate a block at a time
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def decode(self, start, stop):
+        first = start // self.block_size
+        last = (stop + self.block_size - 1) // self.block_size
+        offset = first * self.block_size
+        times = _undelta(self.base[first:last], self.deltas[offset:min(last * self.block_size, len(self))],
+                         self.block_size)
+        return _view(times)[start - offset:stop - offset]
+
+    def find(self, time):
+        """
+        Finds the index of the first end time not before time, like
+        bisect_left(), decoding only the block it is in.
+        """
+        block = max(int(numpy.searchsorted(self.base, time, side="right")) - 1, 0)
+        start = block * self.block_size
+        stop = min(start + self.block_size, len(self))
+        return start + int(numpy.searchsorted(self.decode(start, stop), time))
+
+#=========================================================================
+
+class _MappedLevels(_MappedValues):
+    """
+    The levels of one channel of a mapped levels file, scaled back up
+    from 16 bits when they are used.
+    """
+
+    def __init__(self, quantized):
+        self.quantized = quantized    # the 16 bit levels
+
+    def __len__(self):
+        return len(self.quantized)
+
+    def decode(self, start, stop):
+        return _view(_dequantize(self.quantized[start:stop]))
+
+#=========================================================================
+
 class CorruptFileError(EnvironmentError):
     pass
 
@@ -0,0 +1,102 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    mediaimporter.py
+#
+#    Copies imported audio files into the project's audio directory in the
+#    background, a few at a time, instead of blocking the interface until
+#    every file has been copied.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import Gio, GLib
+from .globals import Globals
+
+class MediaImporter:
+    """
+    Queue of the files waiting to be copied, and the copies in progress.
+    The copying is done by Gio.File.copy_async(), which clones the file or
+    uses copy_file_range() when the destination is on the same filesystem,
+    and otherwise copies it on one of the GIO worker threads.
+    """
+
+    def __init__(self, workers=2):
+        """
+        Creates a new instance of MediaImporter.
+
+        Parameters:
+            workers -- the number of files copied at the same time.
+        """
+        self.workers = max(1, workers)
+        self.queue = []            # (source, destination, progress, finished) waiting for a free worker, in order
+        self.running = {}        # Gio.Cancellable of each copy in progress -> its finished callback
+
+    #_____________________________________________________________________
+
+    def copy(self, source, destination, progress, finished):
+        """
+        Queues a file to be copied, and starts copying it right away if
+        a worker is free.
+
+        Parameters:
+            source -- the Gio.File to copy.
+            destination -- the Gio.File to copy it to.
+            progress -- function called with the fraction copied so far.
+            finished -- function called with True once the file is copied,
+                        or with False if the copy failed or was cancelled.
+        """
+        self.queue.append((source, destination, progress, finished))
+        self.__StartNext()
+
+    #_____________________________________________________________________
+
+    def cancel_all(self):
+        """
+        Forgets the queued files and cancels the copies in progress.
+        The finished callbacks of the cancelled copies are not called.
+        """
+        self.queue = []
+        for cancellable in list(self.running):
+            cancellable.cancel()
+        self.running = {}
+
+    #_____________________________________________________________________
+
+    def __StartNext(self):
+        """
+        Starts as many queued copies as there are free workers.
+        """
+        while self.queue and len(self.running) < self.workers:
+            source, destination, progress, finished = self.queue.pop(0)
+            cancellable = Gio.Cancellable()
+            self.running[cancellable] = finished
+
+            def on_progress(current, total, *user_data, progress=progress):
+                if total > 0:
+                    progress(current / float(total))
+
+            Globals.debug("Importing", source.get_uri())
+            source.copy_async(destination, Gio.FileCopyFlags.OVERWRITE, GLib.PRIORITY_DEFAULT,
+                              cancellable, on_progress, None, self.__OnCopied, cancellable)
+
+    #_____________________________________________________________________
+
+    def __OnCopied(self, source, result, cancellable):
+        """
+        Callback for when a copy has finished, failed or been cancelled.
+        """
+        try:
+            success = source.copy_finish(result)
+        except GLib.Error as e:
+            Globals.debug("Importing %s failed: %s" % (source.get_uri(), e.message))
+            success = False
+
+        finished = self.running.pop(cancellable, None)
+        if finished:
+            finished(success)
+        self.__StartNext()
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -5,6 +5,10 @@ import datetime
 import os
 import itertools
 import errno
+import contextlib
+import io
+import threading
+import traceback
 import xml.dom.minidom as xml
 from .utils import Utils
 import gzip
@@ -12,24 +16,46 @@ from .instrument import Instrument
 from .event import Event
 from .globals import Globals
 from .platform_utils import PlatformUtils
-from .projectutilities import ProjectUtilities
+from .projectutilities import ProjectUtilities, IncrementalRestore, SnapshotFormat
 from .settings import Settings
 from .transportmanager import TransportManager
 from .audiobackend import AudioBackend
 from .jokosherenums import BitDepthFormats
+from .waveformscheduler import WaveformScheduler
+from .mediaimporter import MediaImporter
+from .audiostore import AudioStore
+from .incrementalsave import IncrementalSave
+from .projectsnapshot import ProjectSnapshot
+from .exportrenderer import ExportRenderer
+from .levelmeter import LevelMeter
 class Project(GObject.GObject):
 
     """ The audio playback state enum values """
-    AUDIO_STOPPED, AUDIO_RECORDING, AUDIO_PLAYING, AUDIO_PAUSED, AUDIO_EXPORTING = range(5)
+    AUDIO_STOPPED, AUDIO_RECORDING, AUDIO_PLAYING, AUDIO_PAUSED = range(4)
+
+    """ The extension of the journal of changes made since the project was saved """
+    INCREMENTAL_SAVE_EXT = ".incremental"
+    """ The extension of the binary snapshot of the project file """
+    SNAPSHOT_EXT = ".snapshot"
+    """ The shares of opening a project taken by reading the file and by reading
+        the levels, when the events are set up while it is opened """
+    LOAD_FILE_SHARE = 0.5
+    LOAD_LEVELS_SHARE = 0.4
+    """ The properties saved in the project file """
+    SAVED_PARAMETERS = ["view_scale", "view_start", "name", "name_is_unset", "author", "volume",
+                        "transportMode", "bpm", "meter_nom", "meter_denom", "projectfile", "sample_rate", "bit_depth"]
 
     __gsignals__ = {
         "audio-state"        : ( GObject.SIGNAL_RUN_LAST | GObject.SIGNAL_DETAILED, GObject.TYPE_NONE, () ),
         "bpm"            : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "click-track"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_DOUBLE,) ),
+        "export-complete"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_STRING, GObject.TYPE_BOOLEAN, GObject.TYPE_STRING) ),
+        "export-progress"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_DOUBLE,) ),
         "gst-bus-error"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_STRING, GObject.TYPE_STRING) ),
         "incremental-save" : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "instrument"        : ( GObject.SIGNAL_RUN_LAST | GObject.SIGNAL_DETAILED, GObject.TYPE_NONE, (GObject.TYPE_PYOBJECT,) ),
         "name"            : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_STRING,) ),
+        "save-complete"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_STRING, GObject.TYPE_BOOLEAN) ),
         "time-signature"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "undo"            : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
         "view-start"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
@@ -56,9 +82,10 @@ class Project(GObject.GObject):
         self.view_scale = 25.0        #View scale as pixels per second
         self.view_start = 0.0            #View offset in seconds
         self.soloInstrCount = 0        #number of solo instruments (to know if others must be muted)
+        self.__saveThread = None        #the thread writing the project file in the background, if any
         self.audioState = self.AUDIO_STOPPED    #which audio state we are currently in
-        self.exportPending = False    # True if we are waiting to start an export
-        self.exportFilename = ""
+        self.exportFilenames = []    # the files of the last export
+        self.exportRenderer = None    # the ExportRenderer writing exportFilenames, while exporting
         self.bpm = 120
         self.meter_nom = 4        # time signature numerator
         self.meter_denom = 4        # time signature denominator
@@ -74,11 +101,18 @@ class Project(GObject.GObject):
 
         self.hasDoneIncrementalSave = False    # True if we have already written to the .incremental file from this project.
         self.isDoingIncrementalRestore = False # If we are currently restoring incremental save actions
+        self.__incrementalSave = None    # the IncrementalSave journal, created with the first action
 
         # populate these from default settings unless loaded from file
         # FIXME ensure these are used when recording and for playback
         self.sample_rate = Settings.get_settings().get_sample_rate() # digital audio samples per second
         self.bit_depth = Settings.get_settings().get_bit_depth() # bits used to store information about digital audio sample
+        # limits how many events generate their waveform at once
+        self.waveformScheduler = WaveformScheduler(Settings.get_settings().get_waveform_workers())
+        # copies imported files into the audio directory in the background
+        self.mediaImporter = MediaImporter(Settings.get_settings().get_import_workers())
+        # keeps each imported audio file once, however often it is imported
+        self.audioStore = AudioStore(self, Settings.get_settings().get_import_workers())
 
         # Variables for the undo/redo command system
         self.__unsavedChanges = False    #This boolean is to indicate if something which is not on the undo/redo stack needs to be saved
@@ -97,9 +131,9 @@ class Project(GObject.GObject):
         self.postAdderConvert = Gst.ElementFactory.make("audioconvert", None)
         self.masterSink = self.MakeProjectSink()
 
+        self.levelMeter = LevelMeter()
         self.levelElement = Gst.ElementFactory.make("level", "MasterLevel")
-        self.levelElement.set_property("interval", Gst.SECOND / 50)
-        self.levelElement.set_property("message", True)
+        self.levelMeter.add(self.levelElement, self)
 
         #Restrict adder's output caps due to adder bug 341431
         self.levelElementCaps = Gst.ElementFactory.make("capsfilter", "levelcaps")
@@ -148,7 +182,7 @@ class Project(GObject.GObject):
         # set up the bus message callbacks
         self.bus = self.mainpipeline.get_bus()
         self.bus.add_signal_watch()
-        self.Mhandler = self.bus.connect("message::element", self.__PipelineBusLevelCb)
+        self.Mhandler = self.bus.connect("message::element", self.levelMeter.on_bus_message)
         self.EOShandler = self.bus.connect("message::eos", self.stop)
         self.Errorhandler = self.bus.connect("message::error", self.__PipelineBusErrorCb)
 
@@ -216,13 +250,19 @@ class Project(GObject.GObject):
 
         return projectdir
 
-    def save_project_file(self, path=None, backup=False):
+    def save_project_file(self, path=None, backup=False, background=False):
         """
         Saves the Project and its children as an XML file
         to the path specified by file.
 
+        The XML document is built from the Project right away, so the
+        Project can be changed as soon as this returns. Writing the document
+        and the levels files happens on a worker thread if background is
+        True, and "save-complete" is emitted once the file is on disk.
+
         Parameters:
             path -- path to the Project file.
+            background -- True to write the file without blocking the GUI.
         """
 
         if not path:
@@ -262,14 +302,11 @@ class Project(GObject.GObject):
         #    self.__redoStack.extend(self.__savedRedoStack)
         #    self.__savedRedoStack = []
 
-            # delete the incremental file since its all safe on disk now
-        #    basepath, ext = os.path.splitext(self.projectfile)
-        #    incr_path = basepath + self.INCREMENTAL_SAVE_EXT
-        #    try:
-        #        if os.path.exists(incr_path):
-        #            os.remove(incr_path)
-        #    except OSError:
-        #        Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
+        # the actions journaled so far will be in the project file, so once it
+        # is safe on disk they are dropped from the incremental file
+        journalPosition = None
+        if not backup and self.__incrementalSave and path == self.projectfile:
+            journalPosition = self.__incrementalSave.get_position()
 
         doc = xml.Document()
         head = doc.createElement("JokosherProject")
@@ -280,8 +317,7 @@ class Project(GObject.GObject):
         params = doc.createElement("Parameters")
         head.appendChild(params)
 
-        items = ["view_scale", "view_start", "name", "name_is_unset", "author", "volume",
-                 "transportMode", "bpm", "meter_nom", "meter_denom", "projectfile", "sample_rate", "bit_depth"]
+        items = self.SAVED_PARAMETERS
 
         Utils.store_parameters_to_xml(self, doc, params, items)
 
@@ -305,27 +341,172 @@ class Project(GObject.GObject):
         #     redo.appendChild(actionXML)
         #     action.StoreToXML(doc, actionXML)
 
+        # the levels are written along with the project file
+        levelsFiles = []
+
         for instr in self.instruments:
-            instr.store_to_xml(doc, head)
+            instr.store_to_xml(doc, head, levels_files=levelsFiles)
 
         for instr in self.graveyard:
-            instr.store_to_xml(doc, head, graveyard=True)
+            instr.store_to_xml(doc, head, graveyard=True, levels_files=levelsFiles)
+
+        # a binary copy of the document, which is quicker to open
+        snapshot = None
+        if Settings.get_settings().get_project_snapshots():
+            snapshot = ProjectSnapshot.from_project(self)
+
+        # two saves must not write the same temporary file at once
+        if self.__saveThread:
+            self.__saveThread.join()
+            self.__saveThread = None
+
+        if background:
+            self.__saveThread = threading.Thread(target=self.__WriteProjectFile,
+                                                 args=(doc, path, levelsFiles, snapshot, journalPosition, True),
+                                                 name="ProjectSave")
+            self.__saveThread.daemon = True
+            self.__saveThread.start()
+        else:
+            self.__WriteProjectFile(doc, path, levelsFiles, snapshot, journalPosition, False)
+
+        #self.emit("undo")
+
+    def __WriteProjectFile(self, doc, path, levelsFiles, snapshot, journalPosition, background):
+        """
+        Writes the project XML document and the levels files to disk. The
+        document is streamed into the gzip file instead of being turned into
+        one big string first, and the file only replaces the old one once it
+        is safely on disk.
+
+        Parameters:
+            doc -- the XML document of the Project.
+            path -- path to the Project file.
+            levelsFiles -- list of (LevelsList, path) pairs to write.
+            snapshot -- the body of the ProjectSnapshot to write once the
+                        file is saved, or None to only remove the old one.
+            journalPosition -- how much of the incremental file is in the
+                        document, or None to leave the incremental file alone.
+            background -- True if this is running on a worker thread.
+        """
+        success = True
+        for levels_list, levels_path in levelsFiles:
+            try:
+                levels_list.tofile(levels_path)
+            except (IOError, OSError) as e:
+                Globals.debug("Cannot write levels file", levels_path, e)
 
         try:
             #append "~" in case the saving fails
-            gzipfile = gzip.GzipFile(path +"~", "wb")
-            gzipfile.write(doc.toprettyxml(encoding="utf8"))
-            gzipfile.close()
+            with open(path + "~", "wb") as rawfile:
+                with gzip.GzipFile(fileobj=rawfile, mode="wb") as gzipfile:
+                    writer = io.TextIOWrapper(gzipfile, encoding="utf-8")
+                    doc.writexml(writer, addindent="\t", newl="\n", encoding="utf8")
+                    writer.flush()
+                    writer.detach()
+                rawfile.flush()
+                os.fsync(rawfile.fileno())
         except Exception as e:
-            print(e)
-            os.remove(path + "~")
+            Globals.debug("Saving project failed:", e)
+            success = False
+            if os.path.exists(path + "~"):
+                os.remove(path + "~")
         else:
             #if the saving doesn't fail, move it to the proper location
-            if os.path.exists(path):
-                os.remove(path)
-            os.rename(path + "~", path)
+            os.replace(path + "~", path)
 
-        #self.emit("undo")
+            snapshotPath = self.get_snapshot_path(path)
+            try:
+                if snapshot:
+                    ProjectSnapshot.write(snapshotPath, path, snapshot)
+                elif os.path.exists(snapshotPath):
+                    os.remove(snapshotPath)
+            except OSError as e:
+                Globals.debug("Cannot write project snapshot", snapshotPath, e)
+
+        if background:
+            GObject.idle_add(self.__EmitSaveComplete, path, success, journalPosition)
+        else:
+            self.__EmitSaveComplete(path, success, journalPosition)
+
+    #_____________________________________________________________________
+
+    def __EmitSaveComplete(self, path, success, journalPosition):
+        """
+        Compacts the incremental file and emits "save-complete" from the main loop.
+        """
+        # the project may have been closed while it was being written
+        if success and journalPosition is not None and self.__incrementalSave:
+            self.__incrementalSave.compact(journalPosition)
+        if success:
+            # the saved events don't need the audio which isn't used anymore
+            self.audioStore.collect_garbage()
+        self.emit("save-complete", path, success)
+        #Stop idle_add from calling us again
+        return False
+
+    #_____________________________________________________________________
+
+    def get_incremental_save_path(self):
+        """
+        Returns:
+            the path to the incremental file of this Project.
+        """
+        path, ext = os.path.splitext(self.projectfile)
+        return path + self.INCREMENTAL_SAVE_EXT
+
+    #_____________________________________________________________________
+
+    def get_frozen_path(self):
+        """
+        Returns:
+            the directory of the frozen files of the Instruments, next to
+            the Project file. It is created if it doesn't exist.
+        """
+        path = os.path.join(os.path.dirname(self.projectfile), "frozen")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    #_____________________________________________________________________
+
+    def get_snapshot_path(self, projectfile=None):
+        """
+        Parameters:
+            projectfile -- the project file the snapshot belongs to,
+                        or None for the file of this Project.
+
+        Returns:
+            the path to the binary snapshot of the project file.
+        """
+        path, ext = os.path.splitext(projectfile or self.projectfile)
+        return path + self.SNAPSHOT_EXT
+
+    #_____________________________________________________________________
+
+    def SaveIncrementalAction(self, action):
+        """
+        Appends an action to the incremental file, so that the change
+        can be restored if the Project is not saved before Jokosher quits.
+
+        Parameters:
+            action -- a dictionary made by one of the IncrementalSave.*Action() methods.
+        """
+        if self.isDoingIncrementalRestore or not self.projectfile:
+            return
+
+        if not self.__incrementalSave:
+            self.__incrementalSave = IncrementalSave(self.get_incremental_save_path())
+
+        try:
+            self.__incrementalSave.append(action)
+        except (IOError, OSError) as e:
+            Globals.debug("Writing to .incremental failed:", e)
+            return
+
+        self.hasDoneIncrementalSave = True
+        self.emit("incremental-save")
+
+    #_____________________________________________________________________
 
     def add_instruments(self, instrTuples):
         """
@@ -373,6 +554,7 @@ class Project(GObject.GObject):
         self.instruments.append(instr)
 
         self.emit("instrument::added", instr)
+        self.SaveIncrementalAction(IncrementalSave.InstrumentAction(instr))
         return instr
 
     def generate_unique_id(self, id=None,  reserve=True):
@@ -425,17 +607,47 @@ class Project(GObject.GObject):
         return app.project
 
     @classmethod
-    def load_project_file(cls, uri):
+    def load_project_file(cls, uri, progress=None):
         """
         Loads a Project from a saved file on disk.
 
         Parameters:
             uri -- the filesystem location of the Project file to load.
                     Currently only file:// URIs are considered valid.
+            progress -- function called with the fraction of the
+                    Project loaded so far.
 
         Returns:
             the loaded Project object.
         """
+        steps = cls.load_project_file_steps(uri)
+        while True:
+            try:
+                stage, fraction = next(steps)
+            except StopIteration as e:
+                return e.value
+            if progress:
+                progress(fraction)
+
+    @classmethod
+    def load_project_file_steps(cls, uri):
+        """
+        Loads a Project from a saved file on disk a step at a time, so that
+        the main loop can run in between. ProjectLoader runs the steps from
+        the main loop, load_project_file() runs them all at once.
+
+        Parameters:
+            uri -- the filesystem location of the Project file to load.
+                    Currently only file:// URIs are considered valid.
+
+        Returns:
+            a generator of (stage, fraction) tuples, with one of
+            ProjectUtilities.LOAD_STAGES and the fraction of the Project
+            loaded so far, which returns the loaded Project object once
+            it is exhausted. Closing the generator before then closes the
+            partly loaded Project. OpenProjectError is raised by the step
+            which fails.
+        """
 
         (scheme, domain, projectfile, params, query, fragment) = parse.urlparse(uri, "file", False)
         if scheme != "file":
@@ -450,21 +662,24 @@ class Project(GObject.GObject):
             raise OpenProjectError(4, projectfile)
 
         try:
-            try:
-                gzipfile = gzip.open(projectfile, 'rt', encoding="utf-8")
-                doc = xml.parse(gzipfile)
-            except IOError as e:
-                if e.message == "Not a gzipped file":
-                    # starting from 0.10, we accept both gzipped xml and plain xml
-                    file_ = open(projectfile, "r")
-                    doc = xml.parse(file_)
-                else:
-                    raise e
+            version = ProjectUtilities.read_project_version(projectfile)
         except Exception as e:
             Globals.debug(e.__class__, e)
             # raise "This file doesn't unzip" message
             raise OpenProjectError(2, projectfile)
 
+        # only used if it was made from the project file as it is now
+        snapshot = None
+        if Settings.get_settings().get_project_snapshots():
+            path, ext = os.path.splitext(projectfile)
+            snapshot = ProjectSnapshot.read(path + cls.SNAPSHOT_EXT, projectfile)
+
+        #only open projects with the proper version number
+        if not snapshot and version not in ProjectUtilities.JOKOSHER_STREAMING_FORMAT and \
+                version not in ProjectUtilities.JOKOSHER_VERSION_FORMAT:
+            # raise a "this project was created in an incompatible version of Jokosher" message
+            raise OpenProjectError(3, version)
+
         project = Project()
         project.projectfile = projectfile
         projectdir = os.path.split(projectfile)[0]
@@ -476,33 +691,79 @@ class Project(GObject.GObject):
             if not os.path.exists(project.levels_path):
                 os.mkdir(project.levels_path)
         except OSError:
+            project.close_project()
             raise OpenProjectError(0)
 
-        #only open projects with the proper version number
-        version = None
-        if doc and doc.firstChild:
-            version = doc.firstChild.getAttribute("version")
+        # changes made after the last save are restored from the incremental file
+        incrementalPath = project.get_incremental_save_path()
+        restoring = os.path.exists(incrementalPath)
+        project.isDoingIncrementalRestore = restoring
 
-        if version in ProjectUtilities.JOKOSHER_VERSION_FORMAT:
-            loaderClass = ProjectUtilities.JOKOSHER_VERSION_FORMAT[version]
-            Globals.debug("Loading project file version", version)
-            try:
-                loaderClass(project, doc)
-            except:
-                tb = traceback.format_exc()
-                Globals.debug("Loading project failed", tb)
-                raise OpenProjectError(5, tb)
+        # the loaders leave setting up the events to the levels and pipeline stages
+        setupEvents = not Settings.get_settings().get_lazy_event_loading()
+        fileShare = cls.LOAD_FILE_SHARE if setupEvents else 1.0
 
-            # if version != Globals.VERSION:
-                #if we're loading an old version copy the project so that it is not overwritten when the user clicks save
-            #     withoutExt = os.path.splitext(projectfile)[0]
-            #     shutil.copy(projectfile, "%s.%s.jokosher" % (withoutExt, version))
+        Globals.debug("Loading project file version", version)
+        try:
+            yield ProjectUtilities.STAGE_PARSING, 0.0
+            if snapshot:
+                Globals.debug("Loading project snapshot")
+                loader = SnapshotFormat(project, snapshot, stepwise=True)
+            elif version in ProjectUtilities.JOKOSHER_STREAMING_FORMAT:
+                loaderClass = ProjectUtilities.JOKOSHER_STREAMING_FORMAT[version]
+                loader = loaderClass(project, projectfile, stepwise=True)
+            else:
+                loaderClass = ProjectUtilities.JOKOSHER_VERSION_FORMAT[version]
+                xmlFile, rawFile = ProjectUtilities.open_project_xml(projectfile)
+                with rawFile, xmlFile:
+                    doc = xml.parse(xmlFile)
+                loader = loaderClass(project, doc, stepwise=True)
+
+            for stage, fraction in loader.Steps():
+                yield stage, fraction * fileShare
+
+            if restoring:
+                Globals.debug("Restoring incremental save", incrementalPath)
+                for stage, fraction in IncrementalRestore(project, incrementalPath, stepwise=True).Steps():
+                    yield stage, fileShare
+                project.isDoingIncrementalRestore = False
+
+            if setupEvents:
+                events = [event for instr in project.instruments for event in instr.events]
+                for instr in project.instruments:
+                    # the compositions are committed once, in the pipeline stage
+                    instr.begin_composition_batch()
+                for index, event in enumerate(events):
+                    event.materialize()
+                    yield ProjectUtilities.STAGE_LEVELS, \
+                          fileShare + cls.LOAD_LEVELS_SHARE * (index + 1) / len(events)
+
+                for index, instr in enumerate(project.instruments):
+                    instr.end_composition_batch()
+                    yield ProjectUtilities.STAGE_PIPELINE, \
+                          fileShare + cls.LOAD_LEVELS_SHARE + \
+                          (1.0 - fileShare - cls.LOAD_LEVELS_SHARE) * (index + 1) / len(project.instruments)
+        except GeneratorExit:
+            Globals.debug("Loading project cancelled")
+            project.close_project()
+            raise
+        except Exception:
+            tb = traceback.format_exc()
+            Globals.debug("Loading project failed", tb)
+            project.close_project()
+            raise OpenProjectError(5, tb)
+
+        # if version != Globals.VERSION:
+            #if we're loading an old version copy the project so that it is not overwritten when the user clicks save
+        #     withoutExt = os.path.splitext(projectfile)[0]
+        #     shutil.copy(projectfile, "%s.%s.jokosher" % (withoutExt, version))
+
+        if restoring:
+            # compacted by the next save, like actions appended from now on
+            project.__incrementalSave = IncrementalSave(incrementalPath)
 
-            project.projectfile = projectfile
-            return project
-        else:
-            # raise a "this project was created in an incompatible version of Jokosher" message
-            raise OpenProjectError(3, version)
+        project.projectfile = projectfile
+        return project
 
     def MakeProjectSink(self):
         """
@@ -568,33 +829,6 @@ class Project(GObject.GObject):
 
     #_____________________________________________________________________
 
-    def __PipelineBusLevelCb(self, bus, message):
-        """
-        Handles GStreamer bus messages about the currently reported level
-        for the Project or any of the Instruments.
-
-        Parameters:
-            bus -- reserved for GStreamer callbacks, don't use it explicitly.
-            message -- reserved for GStreamer callbacks, don't use it explicitly.
-
-        Returns:
-            True -- TODO
-        """
-        struct = message.get_structure()
-
-        if struct and struct.get_name() == "level":
-            if not message.src is self.levelElement:
-                for instr in self.instruments:
-                    if message.src is instr.levelElement:
-                        instr.SetLevel(Utils.DbToFloat(struct["decay"][0]))
-                        break
-            else:
-                self.SetLevel(Utils.DbToFloat(struct["decay"][0]))
-
-        return True
-
-    #_____________________________________________________________________
-
     def __PipelineBusErrorCb(self, bus, message):
         """
         Handles GStreamer error messages.
@@ -621,7 +855,6 @@ class Project(GObject.GObject):
         Parameters:
             newAudioState -- determines the Project audio state to set when playback commences:
                             AUDIO_PAUSED or AUDIO_PLAYING = move the graphical indicator along playback.
-                            AUDIO_EXPORTING = perform playback without moving the graphical bar.
             recording -- determines if the Project should only playback or playback and record:
                         True = playback and record.
                         False = playback only.
@@ -632,6 +865,9 @@ class Project(GObject.GObject):
         Globals.debug("play() in Project.py")
         Globals.debug("current state:", self.mainpipeline.get_state(0)[1].value_name)
 
+        # the events which will be heard have to be set up first
+        self.materialize_events(self.transport.GetPosition())
+
         for ins in self.instruments:
             ins.PrepareController()
 
@@ -712,8 +948,6 @@ class Project(GObject.GObject):
             self.emit("audio-state::stop")
         elif newState == self.AUDIO_RECORDING:
             self.emit("audio-state::record")
-        elif newState == self.AUDIO_EXPORTING:
-            self.exportPending = False
 
     def PrepareClick(self):
         """
@@ -775,6 +1009,22 @@ class Project(GObject.GObject):
                 length = max(length, size)
         return length
 
+    def materialize_events(self, start=0.0):
+        """
+        Sets up the events which were loaded lazily and would be played
+        from the given time on.
+
+        Parameters:
+            start -- time in seconds from which the Project is played.
+        """
+        for instr in self.instruments:
+            with instr.batch_composition():
+                for event in instr.events:
+                    if event.start + event.duration >= start:
+                        event.materialize()
+
+    #_____________________________________________________________________
+
     def GetIsPlaying(self):
         """
         Returns true if the Project is not in the stopped state,
@@ -794,10 +1044,9 @@ class Project(GObject.GObject):
 
     def GetIsExporting(self):
         """
-        Returns true if the Project is not in the stopped state,
-        because paused, playing and recording are all forms of playing.
+        Returns true if the Project is being exported.
         """
-        return self.audioState == self.AUDIO_EXPORTING
+        return self.exportRenderer is not None
 
     def DumpDotFile(self):
         basepath, ext = os.path.splitext(self.projectfile)
@@ -1041,6 +1290,7 @@ class Project(GObject.GObject):
 
         instr = instrs[0]
         instr.remove_and_unlink_playbackbin()
+        self.levelMeter.remove(instr.levelElement)
 
         self.graveyard.append(instr)
         self.instruments.remove(instr)
@@ -1053,6 +1303,7 @@ class Project(GObject.GObject):
 
         self.temp = id
         self.emit("instrument::removed", instr)
+        self.SaveIncrementalAction(IncrementalSave.DeleteInstrumentAction(instr))
 
     def DeleteInstrumentsOrEvents(self, instrumentOrEventList):
         """
@@ -1062,26 +1313,47 @@ class Project(GObject.GObject):
             instrumentList -- a list of Instrument instances to be removed.
         """
         #undoAction = self.NewAtomicUndoAction()
-        for instrOrEvent in instrumentOrEventList:
-            if isinstance(instrOrEvent, Instrument):
-                self.DeleteInstrument(instrOrEvent.id) #, _undoAction_=undoAction)
-            elif isinstance(instrOrEvent, Event):
-                instrOrEvent.instrument.DeleteEvent(instrOrEvent.id) #, _undoAction_=undoAction)
+        with contextlib.ExitStack() as stack:
+            # commit each composition once, after all of its events are removed
+            for instr in set(x.instrument for x in instrumentOrEventList if isinstance(x, Event)):
+                stack.enter_context(instr.batch_composition())
+
+            for instrOrEvent in instrumentOrEventList:
+                if isinstance(instrOrEvent, Instrument):
+                    self.DeleteInstrument(instrOrEvent.id) #, _undoAction_=undoAction)
+                elif isinstance(instrOrEvent, Event):
+                    instrOrEvent.instrument.DeleteEvent(instrOrEvent.id) #, _undoAction_=undoAction)
 
     def close_project(self):
         """
         Closes down this Project.
         """
 
+        # a half written export is of no use to anyone
+        self.terminate_export()
+        for instr in self.instruments:
+            instr.freezer.cancel()
+
+        # let a background save finish before files are deleted
+        if self.__saveThread:
+            self.__saveThread.join()
+            self.__saveThread = None
+
         # when closing the file, the user chooses to either save, or discard
         # in either case, we don't need the incremental save file anymore
-        # path, ext = os.path.splitext(self.projectfile)
-        # filename = path + self.INCREMENTAL_SAVE_EXT
-        # try:
-        #     if os.path.exists(filename):
-        #         os.remove(filename)
-        # except OSError:
-        #     Globals.debug("Removal of .incremental failed! Next load we will try to restore unrestorable state!")
+        if self.__incrementalSave:
+            self.__incrementalSave.remove()
+            self.__incrementalSave = None
+
+        # the copies are deleted below, so stop writing them
+        self.audioStore.close()
+        self.mediaImporter.cancel_all()
+
+        # don't start generating any more waveforms for this project
+        self.waveformScheduler.clear()
+        for instr in self.instruments:
+            for event in instr.events:
+                event.StopGenerateWaveform(False)
 
         for file in self.deleteOnCloseAudioFiles:
             if os.path.exists(file):
@@ -1090,6 +1362,7 @@ class Project(GObject.GObject):
         self.deleteOnCloseAudioFiles = []
 
         self.mainpipeline.set_state(Gst.State.NULL)
+        self.levelMeter.clear()
 
     def export(self, filename, encodeBin, samplerate=None, bitrate=None):
         """
@@ -1104,88 +1377,121 @@ class Project(GObject.GObject):
             samplerate -- the sample rate to output (optional, uses project default if blank).
             bitrate -- the target bit rate to encode at (optional, uses encoder default if blank).
         """
+        self.export_targets([(filename, encodeBin, samplerate, bitrate)])
 
-        if samplerate:
-            encodeBin = "audioresample ! audio/x-raw,F32LE,rate=%d ! audioconvert ! %s" % (samplerate, encodeBin)
-        if bitrate:
-            encodeBin %= {'bitrate' : bitrate}
-
-        #try to create encoder/muxer first, before modifying the main pipeline.
-        try:
-            self.encodebin = Gst.parse_bin_from_description(encodeBin, True)
-        except GObject.GError as e:
-            if e.code == Gst.ParseError.NO_SUCH_ELEMENT:
-                error_no = ProjectManager.ProjectExportException.MISSING_ELEMENT
-            else:
-                error_no = ProjectManager.ProjectExportException.INVALID_ENCODE_BIN
-            raise ProjectManager.ProjectExportException(error_no, e.message)
-
-        #stop playback because some elements will be removed from the pipeline
-        self.stop()
-
-        #remove and unlink the alsasink
-        self.playbackbin.remove(self.masterSink)
-        self.playbackbin.remove(self.levelElement)
-
-        self.postAdderConvert.unlink(self.levelElement)
-        self.levelElement.unlink(self.masterSink)
-
-        #create filesink
-        self.outfile = Gst.ElementFactory.make("filesink", "export_file")
-        self.outfile.set_property("location", filename)
-        self.playbackbin.add(self.outfile)
-
-        self.playbackbin.add(self.encodebin)
-        self.postAdderConvert.link(self.encodebin)
-        self.encodebin.link(self.outfile)
+    def export_targets(self, targets, stems=None):
+        """
+        Exports to several files at once. The Project is mixed only once,
+        and the mix is encoded for all the files side by side.
 
-        #disconnect the bus message handler so the levels don't change
-        self.bus.disconnect(self.Mhandler)
-        self.bus.disconnect(self.EOShandler)
-        self.EOShandler = self.bus.connect("message::eos", self.terminate_export)
+        Parameters:
+            targets -- a list of (filename, encodeBin, samplerate, bitrate)
+                    tuples, each taking the parameters of export().
+            stems -- a list of (instrument, filename, encodeBin, samplerate,
+                    bitrate) tuples, to export the Instrument on its own,
+                    after its volume and pan, in the same render as the mix.
+        """
+        stems = stems or []
+        if self.GetIsExporting() or not (targets or stems):
+            return
 
-        self.exportPending = True
-        self.exportFilename = filename
-        #start the pipeline!
-        self.Play(newAudioState=self.AUDIO_EXPORTING)
+        #create all the encoders/muxers first, so none is started if one of them fails.
+        encoders = [(filename, self.__MakeEncodeBin(encodeBin, samplerate, bitrate))
+                    for filename, encodeBin, samplerate, bitrate in targets]
+        stemEncoders = {}
+        for instr, filename, encodeBin, samplerate, bitrate in stems:
+            stemEncoders.setdefault(instr, []).append((filename, self.__MakeEncodeBin(encodeBin, samplerate, bitrate)))
+
+        # the export is rendered in a pipeline of its own, so the Project
+        # can still be played and edited while it is written
+        self.exportRenderer = ExportRenderer(self, encoders, stemEncoders)
+        self.exportRenderer.connect("progress", self.__ExportProgressCb)
+        self.exportRenderer.connect("finished", self.__ExportFinishedCb)
+        self.exportFilenames = self.exportRenderer.get_filenames()
+        self.exportRenderer.start()
         self.emit("audio-state::export-start")
 
-    def terminate_export(self, bus=None, message=None):
+    def export_stems(self, directory, encodeBin, extension, samplerate=None, bitrate=None, mix=True):
         """
-        GStreamer End Of Stream handler. It is connected to eos on
-        mainpipeline while export is taking place.
+        Exports every Instrument to a file of its own, and the mix as well
+        if mix is True, in a single render.
 
         Parameters:
-            bus -- reserved for GStreamer callbacks, don't use it explicitly.
-            message -- reserved for GStreamer callbacks, don't use it explicitly.
+            directory -- the directory to write the files to. They are named
+                    after the Project and the Instruments.
+            encodeBin -- the gst-launch syntax string of the encoder, as for export().
+            extension -- the extension of the files, without the dot.
+            samplerate -- the sample rate to output (optional, uses project default if blank).
+            bitrate -- the target bit rate to encode at (optional, uses encoder default if blank).
+            mix -- True to export the mix of all the Instruments too.
         """
+        def filename(name):
+            name = name.replace(os.sep, "_")
+            return os.path.join(directory, "%s.%s" % (name, extension))
 
-        if not self.GetIsExporting():
-            return
+        projectName = self.name or "mix"
+        targets = []
+        if mix:
+            targets.append((filename(projectName), encodeBin, samplerate, bitrate))
+        stems = [(instr, filename("%s - %d %s" % (projectName, index + 1, instr.name)), encodeBin, samplerate, bitrate)
+                 for index, instr in enumerate(self.instruments)]
+        self.export_targets(targets, stems)
 
-        #stop playback because some elements will be removed from the pipeline
-        self.Stop()
+    def __MakeEncodeBin(self, encodeBin, samplerate, bitrate):
+        """
+        Creates the encoder/muxer of an export.
 
-        self.bus.disconnect(self.EOShandler)
-        self.Mhandler = self.bus.connect("message::element", self.__PipelineBusLevelCb)
-        self.EOShandler = self.bus.connect("message::eos", self.Stop)
+        Parameters:
+            encodeBin -- the gst-launch syntax string of the encoder, as for export().
+            samplerate -- the sample rate to output, or None.
+            bitrate -- the target bit rate to encode at, or None.
 
-        #remove the filesink and encoder
-        self.playbackbin.remove(self.outfile)
-        self.playbackbin.remove(self.encodebin)
-        self.postAdderConvert.unlink(self.encodebin)
+        Returns:
+            the encoder as a Gst.Bin. Raises ProjectExportException if it
+            could not be created.
+        """
+        if samplerate:
+            encodeBin = "audioresample ! audio/x-raw,format=F32LE,rate=%d ! audioconvert ! %s" % (samplerate, encodeBin)
+        if bitrate:
+            encodeBin %= {'bitrate' : bitrate}
 
-        #dispose of the elements
-        self.outfile.set_state(Gst.State.NULL)
-        self.encodebin.set_state(Gst.State.NULL)
-        del self.outfile, self.encodebin
+        try:
+            return Gst.parse_bin_from_description(encodeBin, True)
+        except GObject.GError as e:
+            if e.code == Gst.ParseError.NO_SUCH_ELEMENT:
+                error_no = ProjectExportException.MISSING_ELEMENT
+            else:
+                error_no = ProjectExportException.INVALID_ENCODE_BIN
+            raise ProjectExportException(error_no, e.message)
 
-        #re-add all the alsa playback elements
-        self.playbackbin.add(self.masterSink, self.levelElement)
-        self.postAdderConvert.link(self.levelElement)
-        self.levelElement.link(self.masterSink)
+    def terminate_export(self):
+        """
+        Stops an export which is still being rendered, and deletes the
+        part of the file written so far.
+        """
+        if self.exportRenderer:
+            self.exportRenderer.cancel()
+
+    def __ExportProgressCb(self, renderer, fraction):
+        """
+        Passes on how much of the export has been rendered.
+        """
+        self.emit("export-progress", fraction)
 
+    def __ExportFinishedCb(self, renderer, success, message):
+        """
+        Called when the export has been written, has failed or has been
+        cancelled. "export-complete" is emitted for each of its files.
+
+        Parameters:
+            renderer -- the ExportRenderer which has finished.
+            success -- True if the whole file has been written.
+            message -- the error message if the export failed, None otherwise.
+        """
+        self.exportRenderer = None
         self.emit("audio-state::export-stop")
+        for filename in self.exportFilenames:
+            self.emit("export-complete", filename, success, message)
 
     def SetTransportMode(self, val):
         """
@@ -1198,6 +1504,54 @@ class Project(GObject.GObject):
         """
         self.transport.SetMode(val)
 
+class ProjectExportException(Exception):
+    """
+    This class will get created when exporting a Project fails.
+    It's used for handling errors.
+    """
+
+    """ Error codes """
+    MISSING_ELEMENT, INVALID_ENCODE_BIN = range(2)
+
+    def __init__(self, errno, message=None):
+        """
+        Creates a new instance of ProjectExportException.
+
+        Parameters:
+            errno -- number indicating the type of error:
+                    MISSING_ELEMENT = an element of the encoder isn't installed.
+                    INVALID_ENCODE_BIN = the encoder description can't be parsed.
+            message -- a string with more specific information about the error.
+        """
+        Exception.__init__(self)
+        self.errno = errno
+        self.message = message
+
+class OpenProjectError(EnvironmentError):
+    """
+    This class will get created when opening a Project fails.
+    It's used for handling errors.
+    """
+    def __init__(self, errno, info=None):
+        """
+        Creates a new instance of OpenProjectError.
+
+        Parameters:
+            errno -- number indicating the type of error:
+                    0 = unable to read/write to audio or levels directory.
+                    1 = invalid uri passed for the Project file.
+                    2 = unable to unzip the Project.
+                    3 = Project created by a different version of Jokosher.
+                    4 = Project file doesn't exist.
+                    5 = the Project file could not be loaded.
+            info -- the version of Jokosher that created the Project with
+                    error 3, the traceback with error 5, the path or the
+                    uri scheme otherwise.
+        """
+        EnvironmentError.__init__(self)
+        self.errno = errno
+        self.info = info
+
 class CreateProjectError(Exception):
     """
     This class will get created when creating a Project fails.
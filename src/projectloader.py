@@ -0,0 +1,123 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    projectloader.py
+#
+#    Opens a project from the main loop a few steps at a time, so that the
+#    window keeps responding, shows how far it has got and can cancel it.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject
+from .globals import Globals
+from .project import Project, OpenProjectError
+from .projectutilities import ProjectUtilities
+import time
+
+class ProjectLoader(GObject.GObject):
+    """
+    Runs the steps of Project.load_project_file_steps() from idle
+    callbacks, for at most TIME_SLICE at a time, and reports the stage and
+    fraction reached after each run.
+
+    Signals:
+        "progress" -- the stage, one of ProjectUtilities.LOAD_STAGES, and the
+                      fraction of the Project loaded so far.
+        "finished" -- the Project has been loaded, it is passed along.
+        "error" -- loading failed, the OpenProjectError is passed along.
+        "cancelled" -- cancel() was called before the Project was loaded.
+    """
+
+    """ How long each idle callback may spend loading, in seconds """
+    TIME_SLICE = 0.02
+
+    __gsignals__ = {
+        "progress"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_STRING, GObject.TYPE_DOUBLE) ),
+        "finished"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_PYOBJECT,) ),
+        "error"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_PYOBJECT,) ),
+        "cancelled"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, () ),
+    }
+
+    def __init__(self, uri):
+        """
+        Creates a new instance of ProjectLoader.
+
+        Parameters:
+            uri -- the filesystem location of the Project file to load.
+        """
+        GObject.GObject.__init__(self)
+        self.uri = uri
+        self.stage = ProjectUtilities.STAGE_PARSING    # the stage reached so far
+        self.fraction = 0.0            # the fraction of the Project loaded so far
+        self.steps = None            # the generator of the loading steps, while loading
+        self.idleSource = None        # the idle callback running the steps, while loading
+
+    #_____________________________________________________________________
+
+    def start(self):
+        """
+        Starts loading the Project once the main loop is idle.
+        """
+        if self.steps:
+            return
+        self.steps = Project.load_project_file_steps(self.uri)
+        self.idleSource = GObject.idle_add(self.__RunSteps)
+
+    #_____________________________________________________________________
+
+    def cancel(self):
+        """
+        Stops loading the Project, and closes the part already loaded.
+        Does nothing once the Project has been loaded.
+        """
+        if not self.steps:
+            return
+        Globals.debug("Cancelling opening", self.uri)
+        GObject.source_remove(self.idleSource)
+        self.idleSource = None
+        steps, self.steps = self.steps, None
+        steps.close()
+        self.emit("cancelled")
+
+    #_____________________________________________________________________
+
+    def is_loading(self):
+        """
+        Returns:
+            True if the Project is being loaded.
+        """
+        return self.steps is not None
+
+    #_____________________________________________________________________
+
+    def __RunSteps(self):
+        """
+        Runs steps until TIME_SLICE is used up, the Project is loaded or
+        loading it fails.
+        """
+        end = time.monotonic() + self.TIME_SLICE
+        try:
+            while time.monotonic() < end:
+                self.stage, self.fraction = next(self.steps)
+        except StopIteration as e:
+            self.steps = None
+            self.idleSource = None
+            self.emit("progress", self.stage, 1.0)
+            self.emit("finished", e.value)
+            #Stop idle_add from calling us again
+            return False
+        except OpenProjectError as e:
+            self.steps = None
+            self.idleSource = None
+            self.emit("error", e)
+            #Stop idle_add from calling us again
+            return False
+
+        self.emit("progress", self.stage, self.fraction)
+        # a "progress" handler may have cancelled the loading
+        return self.steps is not None
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -0,0 +1,324 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    projectsnapshot.py
+#
+#    A binary copy of the contents of a project file, written next to it on
+#    every save, which can be read back much faster than the XML when the
+#    project is opened again.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject
+from .globals import Globals
+from array import array
+import hashlib
+import json
+import os
+import struct
+import sys
+
+class ProjectSnapshot:
+    """
+    The instruments and events of a project, flattened into tables.
+    The events are fixed size records, their strings are kept once in a
+    string table and their fade points in two arrays, so reading them
+    back is a handful of unpacks instead of parsing an element for every
+    property. The header holds the modification time, size and hash of
+    the project file the snapshot was made with, and a snapshot is only
+    used while the project file still matches it.
+    """
+
+    MAGIC = b"JOKOSNAP"
+    """ Increased whenever the layout or Event.SAVED_PARAMETERS change """
+    VERSION = 1
+
+    """ magic, version, project file mtime, project file size, project file hash """
+    HEADER = struct.Struct("<8sHdQ20s")
+    """ the length of each section following the header """
+    SECTION = struct.Struct("<Q")
+    """ instrument index, id, start, duration, offset, flags, the string indexes
+        of name, file, filelabel and levels_file, first fade point, fade point count """
+    EVENT = struct.Struct("<iidddBIIIIII")
+    """ the string index used for None """
+    NO_STRING = 0xFFFFFFFF
+
+    """ the bits of the event flags """
+    FLAG_SELECTED, FLAG_LOADING, FLAG_RECORDING, FLAG_DEAD = (1 << 0, 1 << 1, 1 << 2, 1 << 3)
+
+    """ The number of bytes of the project file hashed at a time """
+    HASH_CHUNK_SIZE = 1 << 20
+    """ Effect properties which belong to the element rather than to the effect """
+    SKIPPED_EFFECT_PROPERTIES = ("name", "parent")
+
+    def __init__(self):
+        """
+        Creates a new, empty instance of ProjectSnapshot.
+        """
+        self.project = {}        # the saved properties of the project, with "notes"
+        self.instruments = []    # dictionaries with the id, dead, parameters and effects of each instrument
+        self.events = []        # (instrument index, id, parameters, dead, fade points dict) of every event
+
+    #_____________________________________________________________________
+
+    @classmethod
+    def from_project(cls, project):
+        """
+        Flattens the instruments and events of a Project, as they are
+        going to be written to its project file.
+
+        Parameters:
+            project -- the Project to take the snapshot of.
+
+        Returns:
+            the body of the snapshot as bytes, or None if the Project holds
+            values which a snapshot can't store.
+        """
+        strings = {}
+        stringList = []
+        def string_index(value):
+            if value is None:
+                return cls.NO_STRING
+            if value not in strings:
+                strings[value] = len(stringList)
+                stringList.append(value)
+            return strings[value]
+
+        instruments = []
+        events = bytearray()
+        fadeTimes = array("d")
+        fadeValues = array("d")
+
+        instrumentLists = ((project.instruments, False), (project.graveyard, True))
+        for instrList, instrDead in instrumentLists:
+            for instr in instrList:
+                effects = []
+                for effect in instr.effects:
+                    effects.append((effect.get_factory().get_name(), cls.get_effect_settings(effect)))
+
+                instrIndex = len(instruments)
+                instruments.append({
+                    "id" : instr.id,
+                    "dead" : instrDead,
+                    "parameters" : {key : getattr(instr, key) for key in instr.SAVED_PARAMETERS},
+                    "effects" : effects,
+                })
+
+                for eventList, eventDead in ((instr.events, False), (instr.graveyard, True)):
+                    for event in eventList:
+                        flags = 0
+                        if event.isSelected:
+                            flags |= cls.FLAG_SELECTED
+                        if event.isLoading:
+                            flags |= cls.FLAG_LOADING
+                        if event.isRecording:
+                            flags |= cls.FLAG_RECORDING
+                        if eventDead:
+                            flags |= cls.FLAG_DEAD
+
+                        fadePoints = sorted(event._Event__fadePointsDict.items())
+                        events += cls.EVENT.pack(instrIndex, event.id,
+                                                 event.start, event.duration, event.offset, flags,
+                                                 string_index(event.name), string_index(event.file),
+                                                 string_index(event.filelabel), string_index(event.levels_file),
+                                                 len(fadeTimes), len(fadePoints))
+                        fadeTimes.extend(time for time, volume in fadePoints)
+                        fadeValues.extend(volume for time, volume in fadePoints)
+
+        projectParams = {key : getattr(project, key) for key in project.SAVED_PARAMETERS}
+        projectParams["notes"] = project.notes
+        try:
+            tables = json.dumps({"project" : projectParams, "instruments" : instruments}).encode("utf-8")
+            encodedStrings = [value.encode("utf-8") for value in stringList]
+        except (TypeError, ValueError, AttributeError) as e:
+            Globals.debug("Cannot take a snapshot of the project:", e)
+            return None
+
+        stringOffsets = array("Q", [0])
+        for value in encodedStrings:
+            stringOffsets.append(stringOffsets[-1] + len(value))
+
+        sections = [tables, cls.__ArrayToBytes(stringOffsets), b"".join(encodedStrings),
+                    bytes(events), cls.__ArrayToBytes(fadeTimes), cls.__ArrayToBytes(fadeValues)]
+        return b"".join(cls.SECTION.pack(len(section)) + section for section in sections)
+
+    #_____________________________________________________________________
+
+    @classmethod
+    def write(cls, path, projectfile, body):
+        """
+        Writes a snapshot made by from_project() for a project file which
+        has just been saved.
+
+        Parameters:
+            path -- the snapshot file to write.
+            projectfile -- path to the saved project file.
+            body -- the bytes returned by from_project().
+        """
+        stat = os.stat(projectfile)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, stat.st_mtime, stat.st_size,
+                                 cls.__HashFile(projectfile))
+        with open(path + "~", "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(path + "~", path)
+
+    #_____________________________________________________________________
+
+    @classmethod
+    def read(cls, path, projectfile):
+        """
+        Reads a snapshot, if it was made from the current project file.
+
+        Parameters:
+            path -- the snapshot file to read.
+            projectfile -- path to the project file the snapshot belongs to.
+
+        Returns:
+            a ProjectSnapshot, or None if there is no snapshot or it is
+            out of date.
+        """
+        try:
+            with open(path, "rb") as f:
+                header = f.read(cls.HEADER.size)
+                if len(header) != cls.HEADER.size:
+                    return None
+                magic, version, mtime, size, digest = cls.HEADER.unpack(header)
+                if magic != cls.MAGIC or version != cls.VERSION:
+                    return None
+
+                # the cheap checks first, so that hashing is usually only done once
+                stat = os.stat(projectfile)
+                if stat.st_mtime != mtime or stat.st_size != size:
+                    return None
+                if cls.__HashFile(projectfile) != digest:
+                    return None
+
+                body = f.read()
+        except OSError:
+            return None
+
+        snapshot = cls()
+        try:
+            snapshot.__Parse(memoryview(body))
+        except (struct.error, ValueError, KeyError, IndexError, TypeError) as e:
+            Globals.debug("Ignoring corrupt project snapshot", path, e)
+            return None
+
+        return snapshot
+
+    #_____________________________________________________________________
+
+    def __Parse(self, body):
+        sections = []
+        position = 0
+        while position < len(body):
+            length, = self.SECTION.unpack_from(body, position)
+            position += self.SECTION.size
+            if position + length > len(body):
+                raise ValueError("truncated section")
+            sections.append(body[position:position + length])
+            position += length
+
+        tables, stringOffsets, stringData, events, fadeTimes, fadeValues = sections
+
+        tables = json.loads(bytes(tables).decode("utf-8"))
+        self.project = tables["project"]
+        self.instruments = tables["instruments"]
+
+        stringOffsets = self.__BytesToArray("Q", stringOffsets)
+        stringData = bytes(stringData)
+        strings = [stringData[stringOffsets[i]:stringOffsets[i + 1]].decode("utf-8")
+                   for i in range(len(stringOffsets) - 1)]
+        def string(index):
+            return None if index == self.NO_STRING else strings[index]
+
+        fadeTimes = self.__BytesToArray("d", fadeTimes)
+        fadeValues = self.__BytesToArray("d", fadeValues)
+
+        for (instrIndex, id, start, duration, offset, flags, name, file, filelabel,
+                levels_file, fadeStart, fadeCount) in self.EVENT.iter_unpack(events):
+            if not 0 <= instrIndex < len(self.instruments):
+                raise IndexError("event of a missing instrument")
+            parameters = {
+                "start" : start,
+                "duration" : duration,
+                "isSelected" : bool(flags & self.FLAG_SELECTED),
+                "name" : string(name),
+                "offset" : offset,
+                "file" : string(file),
+                "filelabel" : string(filelabel),
+                "levels_file" : string(levels_file),
+                "isLoading" : bool(flags & self.FLAG_LOADING),
+                "isRecording" : bool(flags & self.FLAG_RECORDING),
+            }
+            fadePoints = dict(zip(fadeTimes[fadeStart:fadeStart + fadeCount],
+                                  fadeValues[fadeStart:fadeStart + fadeCount]))
+            self.events.append((instrIndex, id, parameters, bool(flags & self.FLAG_DEAD), fadePoints))
+
+    #_____________________________________________________________________
+
+    @classmethod
+    def get_effect_settings(cls, effect):
+        """
+        Collects the settings of an effect, the properties which can be set
+        on a new element and stored as JSON. The name and the parent belong
+        to the element, not to the effect, construct only properties can't
+        be set again, and properties holding objects are left out.
+
+        Parameters:
+            effect -- the GStreamer element of the effect.
+
+        Returns:
+            a dictionary of property names -> values.
+        """
+        propsdict = {}
+        for prop in GObject.list_properties(effect):
+            if prop.name in cls.SKIPPED_EFFECT_PROPERTIES:
+                continue
+            if not prop.flags & GObject.PARAM_READABLE or not prop.flags & GObject.PARAM_WRITABLE:
+                continue
+            if prop.flags & GObject.PARAM_CONSTRUCT_ONLY:
+                continue
+            value = effect.get_property(prop.name)
+            if value is None or isinstance(value, (bool, int, float, str)):
+                propsdict[prop.name] = value
+            else:
+                Globals.debug("Leaving out effect property", prop.name, "of", effect.get_name(),
+                              ":", repr(value))
+        return propsdict
+
+    #_____________________________________________________________________
+
+    @classmethod
+    def __HashFile(cls, path):
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.digest()
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def __ArrayToBytes(values):
+        # snapshots are always little endian
+        if sys.byteorder == "big":
+            values = array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def __BytesToArray(typecode, data):
+        values = array(typecode)
+        values.frombytes(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -1,24 +1,52 @@
 import ast
+import gzip
+import os
+import xml.etree.ElementTree as ElementTree
 from .instrument import Instrument
 from .utils import Utils
 from .event import Event
 from .globals import Globals
+from .settings import Settings
+from .incrementalsave import IncrementalSave
 
 class FormatOneZero:
     LOADING_VERSION = "1.0"
 
-    def __init__(self, project, xmlDoc):
+    def __init__(self, project, xmlDoc, stepwise=False):
         """
         Loads a Jokosher version 1.0 Project file into
         the given Project object using the given XML document.
 
         Parameters:
             project -- the Project instance to apply loaded properties to.
-            xmlDoc -- the XML file document to read data from.
+            xmlDoc -- the XML file document to read data from, None for
+                      the subclasses which read the Project from elsewhere.
+            stepwise -- True to only get ready, and leave the loading to
+                        the caller, which iterates over Steps() and sets
+                        up the events afterwards.
         """
         self.project = project
         self.xmlDoc = xmlDoc
+        # leave setting up events until they are needed, or until the
+        # incremental file has been restored on top of them
+        self.lazy = Settings.get_settings().get_lazy_event_loading() or \
+                    self.project.isDoingIncrementalRestore or stepwise
 
+        if not stepwise:
+            for step in self.Steps():
+                pass
+
+    #_____________________________________________________________________
+
+    def Steps(self):
+        """
+        Loads the Project a piece at a time.
+
+        Returns:
+            a generator of (stage, fraction) tuples, with one of
+            ProjectUtilities.LOAD_STAGES and the fraction of the
+            file loaded so far.
+        """
         # A project being opened is either:
         # --> A 0.11 or earlier project (all of which required a name on creation).
         # --> A project created by Jokosher >0.11 which will load the name_is_unset
@@ -58,18 +86,26 @@ class FormatOneZero:
         #                 self.LoadUndoAction(action, actionNode)
         #                 stack.append(action)
 
-        for instrElement in self.xmlDoc.getElementsByTagName("Instrument"):
+        instrElements = self.xmlDoc.getElementsByTagName("Instrument")
+        deadInstrElements = self.xmlDoc.getElementsByTagName("DeadInstrument")
+        count = float(len(instrElements) + len(deadInstrElements) or 1)
+        loaded = 0
+
+        for instrElement in instrElements:
             try:
                 id = int(instrElement.getAttribute("id"))
             except ValueError:
                 id = None
             instr = Instrument(self.project, None, None, None, id)
-            self.LoadInstrument(instr, instrElement)
+            with instr.batch_composition():
+                self.LoadInstrument(instr, instrElement)
             self.project.instruments.append(instr)
             if instr.isSolo:
                 self.project.soloInstrCount += 1
+            loaded += 1
+            yield ProjectUtilities.STAGE_INSTRUMENTS, loaded / count
 
-        for instrElement in self.xmlDoc.getElementsByTagName("DeadInstrument"):
+        for instrElement in deadInstrElements:
             try:
                 id = int(instrElement.getAttribute("id"))
             except ValueError:
@@ -78,6 +114,8 @@ class FormatOneZero:
             self.LoadInstrument(instr, instrElement)
             self.project.graveyard.append(instr)
             instr.remove_and_unlink_playbackbin()
+            loaded += 1
+            yield ProjectUtilities.STAGE_INSTRUMENTS, loaded / count
 
     #_____________________________________________________________________
 
@@ -97,19 +135,15 @@ class FormatOneZero:
 
         for effect in globaleffect:
             elementname = str(effect.getAttribute("element"))
-            Globals.debug("Loading effect:", elementname)
-            gstElement = instr.AddEffect(elementname)
-
             propsdict = Utils.load_dictionary_from_xml(effect)
-            for key, value in propsdict.iteritems():
-                gstElement.set_property(key, value)
+            self.LoadEffect(instr, elementname, propsdict)
 
         for ev in xmlNode.getElementsByTagName("Event"):
             try:
                 id = int(ev.getAttribute("id"))
             except ValueError:
                 id = None
-            event = Event(instr, None, id)
+            event = Event(instr, None, id, lazy=True)
             self.LoadEvent(event, ev)
             instr.events.append(event)
 
@@ -118,10 +152,38 @@ class FormatOneZero:
                 id = int(ev.getAttribute("id"))
             except ValueError:
                 id = None
-            event = Event(instr, None, id)
+            event = Event(instr, None, id, lazy=True)
             self.LoadEvent(event, ev, True)
             instr.graveyard.append(event)
 
+        self.FinishInstrument(instr)
+
+    #_____________________________________________________________________
+
+    def LoadEffect(self, instr, elementname, propsdict):
+        """
+        Adds a saved effect to an Instrument.
+
+        Parameters:
+            instr -- the Instrument instance to add the effect to.
+            elementname -- the name of the GStreamer element of the effect.
+            propsdict -- dictionary of the saved properties of the element.
+        """
+        Globals.debug("Loading effect:", elementname)
+        gstElement = instr.AddEffect(elementname)
+
+        for key, value in propsdict.items():
+            gstElement.set_property(key, value)
+
+    #_____________________________________________________________________
+
+    def FinishInstrument(self, instr):
+        """
+        Sets up an Instrument after all of its properties and events are loaded.
+
+        Parameters:
+            instr -- the loaded Instrument instance.
+        """
         # FIXME
         #load image from file based on unique type
         instr.pixbuf = Instrument.getCachedInstrumentPixbuf(instr.instrType)
@@ -183,24 +245,503 @@ class FormatOneZero:
             if event._Event__fadePointsDict is None:
                 event._Event__fadePointsDict = {}
 
+        self.FinishEvent(event, isDead)
+
+    #_____________________________________________________________________
+
+    def FinishEvent(self, event, isDead=False):
+        """
+        Sets up the source and levels of an Event after all of its properties
+        are loaded, unless that is left until the Event is first needed.
+
+        Parameters:
+            event -- the loaded Event instance, created lazily.
+            isDead -- True if the Event is in the graveyard.
+        """
+        if not isDead and not self.lazy:
+            event.materialize()
+
+class StreamingFormatOneZero(FormatOneZero):
+    """
+    Loads the same files as FormatOneZero, but reads the XML a piece at a
+    time instead of building the whole document first. Instruments and
+    events are set up as soon as their elements have been read, and the
+    elements are thrown away afterwards, so large projects load faster
+    and don't need the whole document in memory.
+    """
+
+    def __init__(self, project, projectfile, stepwise=False):
+        """
+        Loads a Jokosher version 1.0 Project file into
+        the given Project object, streaming it from disk.
+
+        Parameters:
+            project -- the Project instance to apply loaded properties to.
+            projectfile -- path to the project file to read.
+            stepwise -- see FormatOneZero.__init__.
+        """
+        self.projectfile = projectfile
+        super().__init__(project, None, stepwise)
+
+    #_____________________________________________________________________
+
+    def Steps(self):
+        """
+        Loads the Project an element at a time.
+
+        Returns:
+            a generator of (stage, fraction) tuples, see FormatOneZero.Steps().
+        """
+        # see FormatOneZero.Steps
+        self.project.name_is_unset = False
+
+        xmlFile, rawFile = ProjectUtilities.open_project_xml(self.projectfile)
+        try:
+            size = os.fstat(rawFile.fileno()).st_size
+            yield from self.__Parse(xmlFile, lambda: rawFile.tell() / float(size or 1))
+        finally:
+            xmlFile.close()
+            rawFile.close()
+
+    #_____________________________________________________________________
+
+    def __Parse(self, xmlFile, getFraction):
+        """
+        Reads the elements of the project file in order.
+
+        Parameters:
+            xmlFile -- file object of the XML document.
+            getFraction -- function returning the fraction of the file read so far.
+        """
+        path = []            # the elements which have been opened but not closed
+        instr = None        # the Instrument whose element is open
+
+        for action, element in ElementTree.iterparse(xmlFile, events=("start", "end")):
+            if action == "start":
+                if len(path) == 1 and element.tag in ("Instrument", "DeadInstrument"):
+                    # the events need their instrument when they are created
+                    instr = Instrument(self.project, None, None, None, self.__GetId(element))
+                    # the composition is committed once all of its events are read
+                    instr.begin_composition_batch()
+                path.append(element)
+                continue
+
+            path.pop()
+            parent = path[-1] if path else None
+            depth = len(path)
+
+            stage = ProjectUtilities.STAGE_PARSING
+            if depth == 1 and element.tag == "Parameters":
+                self.LoadProjectParameters(element)
+            elif depth == 1 and element.tag == "Notes":
+                # notes are encoded using repr() to preserver \n and \t.
+                self.project.notes = ast.literal_eval(element.get("text"))
+            elif depth == 1 and element.tag in ("Instrument", "DeadInstrument"):
+                self.FinishInstrument(instr)
+                instr.end_composition_batch()
+                if element.tag == "Instrument":
+                    self.project.instruments.append(instr)
+                    if instr.isSolo:
+                        self.project.soloInstrCount += 1
+                else:
+                    self.project.graveyard.append(instr)
+                    instr.remove_and_unlink_playbackbin()
+                instr = None
+                stage = ProjectUtilities.STAGE_INSTRUMENTS
+            elif depth == 2 and instr and element.tag == "Parameters":
+                Utils.load_params_from_element(instr, element)
+                stage = ProjectUtilities.STAGE_INSTRUMENTS
+            elif depth == 2 and instr and element.tag == "GlobalEffect":
+                propsdict = Utils.load_dictionary_from_element(element)
+                self.LoadEffect(instr, str(element.get("element")), propsdict)
+                stage = ProjectUtilities.STAGE_INSTRUMENTS
+            elif depth == 2 and instr and element.tag in ("Event", "DeadEvent"):
+                isDead = element.tag == "DeadEvent"
+                event = Event(instr, None, self.__GetId(element), lazy=True)
+                self.LoadEventElement(event, element, isDead)
+                if isDead:
+                    instr.graveyard.append(event)
+                else:
+                    instr.events.append(event)
+                stage = ProjectUtilities.STAGE_EVENTS
+            else:
+                # children of the elements above are read along with them
+                continue
+
+            # everything in the element has been loaded now
+            if parent is not None:
+                parent.remove(element)
+
+            yield stage, getFraction()
+
+    #_____________________________________________________________________
+
+    def __GetId(self, element):
+        try:
+            return int(element.get("id"))
+        except (TypeError, ValueError):
+            return None
+
+    #_____________________________________________________________________
+
+    def LoadProjectParameters(self, element):
+        """
+        Restores the properties of the Project.
+
+        Parameters:
+            element -- the Parameters element of the project.
+        """
+        Utils.load_params_from_element(self.project, element)
+
+        # fallback for transport mode
+        if not self.project.transportMode:
+            self.project.transportMode = 1
+
+        # Hack to set the transport mode
+        self.project.transport.SetMode(self.project.transportMode)
+
+    #_____________________________________________________________________
+
+    def LoadEventElement(self, event, element, isDead=False):
+        """
+        Restores an Event from its ElementTree element.
+
+        Parameters:
+            event -- the Event instance to apply loaded properties to.
+            element -- the Event or DeadEvent element to retreive data from.
+            isDead -- True if the Event is in the graveyard.
+        """
+        Utils.load_params_from_element(event, element.find("Parameters"))
+
+        xmlPoints = element.find("FadePoints")
+        if xmlPoints is None:
+            Globals.debug("Missing FadePoints in Event XML")
+        else:
+            event._Event__fadePointsDict = Utils.load_dictionary_from_element(xmlPoints)
+
+        self.FinishEvent(event, isDead)
+
+    #_____________________________________________________________________
+
+#=========================================================================
+
+class SnapshotFormat(FormatOneZero):
+    """
+    Loads a Project from the ProjectSnapshot of its project file, which
+    gives the same Project as loading the project file itself.
+    """
+
+    def __init__(self, project, snapshot, stepwise=False):
+        """
+        Loads the contents of a ProjectSnapshot into the given Project object.
+
+        Parameters:
+            project -- the Project instance to apply loaded properties to.
+            snapshot -- the ProjectSnapshot read for the project file.
+            stepwise -- see FormatOneZero.__init__.
+        """
+        self.snapshot = snapshot
+        super().__init__(project, None, stepwise)
+
+    #_____________________________________________________________________
+
+    def Steps(self):
+        """
+        Loads the Project an instrument or event at a time.
+
+        Returns:
+            a generator of (stage, fraction) tuples, see FormatOneZero.Steps().
+        """
+        snapshot = self.snapshot
+
+        # see FormatOneZero.Steps
+        self.project.name_is_unset = False
 
-        if not isDead:
-            if event.isLoading or event.isRecording:
-                event.GenerateWaveform()
+        params = dict(snapshot.project)
+        self.project.notes = params.pop("notes", "")
+        for key, value in params.items():
+            setattr(self.project, key, value)
+
+        # fallback for transport mode
+        if not self.project.transportMode:
+            self.project.transportMode = 1
+
+        # Hack to set the transport mode
+        self.project.transport.SetMode(self.project.transportMode)
+
+        # the instruments are created, then the events, then both are finished
+        count = float(2 * len(snapshot.instruments) + len(snapshot.events) or 1)
+        loaded = 0
+
+        instruments = []
+        for instrTable in snapshot.instruments:
+            instr = Instrument(self.project, None, None, None, instrTable["id"])
+            for key, value in instrTable["parameters"].items():
+                setattr(instr, key, value)
+            for elementname, propsdict in instrTable["effects"]:
+                self.LoadEffect(instr, elementname, propsdict)
+            instruments.append(instr)
+            loaded += 1
+            yield ProjectUtilities.STAGE_INSTRUMENTS, loaded / count
+
+        for instrIndex, id, parameters, isDead, fadePoints in snapshot.events:
+            instr = instruments[instrIndex]
+            event = Event(instr, None, id, lazy=True)
+            for key, value in parameters.items():
+                setattr(event, key, value)
+            event._Event__fadePointsDict = fadePoints
+            if isDead:
+                instr.graveyard.append(event)
+            else:
+                instr.events.append(event)
+            loaded += 1
+            yield ProjectUtilities.STAGE_EVENTS, loaded / count
+
+        for instr, instrTable in zip(instruments, snapshot.instruments):
+            with instr.batch_composition():
+                for event in instr.events:
+                    self.FinishEvent(event)
+                for event in instr.graveyard:
+                    self.FinishEvent(event, True)
+            self.FinishInstrument(instr)
+
+            if instrTable["dead"]:
+                self.project.graveyard.append(instr)
+                instr.remove_and_unlink_playbackbin()
             else:
-                levels_path = event.GetAbsLevelsFile()
-                try:
-                    event.levels_list.fromfile(levels_path)
-                except LevelsList.CorruptFileError:
-                    Globals.debug("Cannot load levels from file", levels_path)
-                if not event.levels_list:
-                    event.GenerateWaveform()
-            event._Event__UpdateAudioFadePoints()
-            event.CreateFilesource()
+                self.project.instruments.append(instr)
+                if instr.isSolo:
+                    self.project.soloInstrCount += 1
+            loaded += 1
+            yield ProjectUtilities.STAGE_INSTRUMENTS, loaded / count
+
+    #_____________________________________________________________________
+
+#=========================================================================
+
+class IncrementalRestore(FormatOneZero):
+    """
+    Replays the actions of an .incremental file on top of a Project which
+    has just been loaded from its project file. The loaders leave all of
+    the events unmaterialized while there is an incremental file, so every
+    event is only set up once, in its restored state.
+    """
+
+    def __init__(self, project, path, stepwise=False):
+        """
+        Restores the changes made to a Project since it was last saved.
+
+        Parameters:
+            project -- the loaded Project instance to apply the actions to.
+            path -- the .incremental file of the project.
+            stepwise -- see FormatOneZero.__init__.
+        """
+        self.path = path
+        super().__init__(project, None, stepwise)
+
+    #_____________________________________________________________________
+
+    def Steps(self):
+        """
+        Replays the actions one at a time.
+
+        Returns:
+            a generator of (stage, fraction) tuples, see FormatOneZero.Steps().
+            The number of actions isn't known in advance, so the fraction
+            is only 1.0 once they have all been replayed.
+        """
+        handlers = {
+            "event" : self.RestoreEvent,
+            "delete-event" : self.RestoreDeleteEvent,
+            "instrument" : self.RestoreInstrument,
+            "delete-instrument" : self.RestoreDeleteInstrument,
+        }
+
+        for action in IncrementalSave.read(self.path):
+            handler = handlers.get(action.get("action"))
+            if not handler:
+                Globals.debug("Unknown incremental save action:", action.get("action"))
+                continue
+            try:
+                handler(action)
+            except (KeyError, TypeError, ValueError) as e:
+                Globals.debug("Cannot restore incremental save action:", action, e)
+            yield ProjectUtilities.STAGE_EVENTS, 0.0
+
+        self.project.soloInstrCount = len([x for x in self.project.instruments if x.isSolo])
+        for instr in self.project.instruments:
+            with instr.batch_composition():
+                self.FinishInstrument(instr)
+                for event in instr.events:
+                    self.FinishEvent(event)
+
+        self.project.hasDoneIncrementalSave = True
+        yield ProjectUtilities.STAGE_EVENTS, 1.0
+
+    #_____________________________________________________________________
+
+    def __FindInstrument(self, id):
+        for instrList in (self.project.instruments, self.project.graveyard):
+            for instr in instrList:
+                if instr.id == id:
+                    return instrList, instr
+        return None, None
+
+    #_____________________________________________________________________
+
+    def __FindEvent(self, instr, id):
+        for eventList in (instr.events, instr.graveyard):
+            for event in eventList:
+                if event.id == id:
+                    return eventList, event
+        return None, None
+
+    #_____________________________________________________________________
+
+    def RestoreInstrument(self, action):
+        """
+        Adds an Instrument, or brings an existing one up to date.
+
+        Parameters:
+            action -- the action made by IncrementalSave.InstrumentAction().
+        """
+        instrList, instr = self.__FindInstrument(action["id"])
+        if not instr:
+            instr = Instrument(self.project, None, None, None, action["id"])
+            self.project.instruments.append(instr)
+        elif instrList is self.project.graveyard:
+            self.project.graveyard.remove(instr)
+            self.project.instruments.append(instr)
+            instr.add_and_link_playbackbin()
+
+        for key, value in action["parameters"].items():
+            if key in Instrument.SAVED_PARAMETERS:
+                setattr(instr, key, value)
+
+    #_____________________________________________________________________
+
+    def RestoreDeleteInstrument(self, action):
+        """
+        Moves an Instrument to the graveyard.
+
+        Parameters:
+            action -- the action made by IncrementalSave.DeleteInstrumentAction().
+        """
+        instrList, instr = self.__FindInstrument(action["id"])
+        if instrList is self.project.instruments:
+            self.project.instruments.remove(instr)
+            self.project.graveyard.append(instr)
+            instr.remove_and_unlink_playbackbin()
+
+    #_____________________________________________________________________
+
+    def RestoreEvent(self, action):
+        """
+        Adds an Event, or brings an existing one up to date.
+
+        Parameters:
+            action -- the action made by IncrementalSave.EventAction().
+        """
+        instrList, instr = self.__FindInstrument(action["instrument"])
+        if not instr:
+            Globals.debug("Cannot restore event of missing instrument", action["instrument"])
+            return
+
+        params = action["parameters"]
+        eventList, event = self.__FindEvent(instr, action["id"])
+        if not event:
+            event = Event(instr, None, action["id"], lazy=True)
+            instr.events.append(event)
+        else:
+            if eventList is instr.graveyard:
+                instr.graveyard.remove(event)
+                instr.events.append(event)
+            # the levels file still has the levels from before a split or join
+            if not event.isLoading and (params.get("offset", event.offset) != event.offset or \
+                    params.get("duration", event.duration) != event.duration):
+                event.levelsOutOfDate = True
+
+        for key, value in params.items():
+            if key in Event.SAVED_PARAMETERS:
+                setattr(event, key, value)
+        event._Event__fadePointsDict = {time : volume for time, volume in action["fadePoints"]}
+
+    #_____________________________________________________________________
+
+    def RestoreDeleteEvent(self, action):
+        """
+        Moves an Event to the graveyard.
+
+        Parameters:
+            action -- the action made by IncrementalSave.DeleteEventAction().
+        """
+        instrList, instr = self.__FindInstrument(action["instrument"])
+        if not instr:
+            return
+        eventList, event = self.__FindEvent(instr, action["id"])
+        if eventList is instr.events:
+            instr.events.remove(event)
+            instr.graveyard.append(event)
+
+    #_____________________________________________________________________
+
+#=========================================================================
 
 class ProjectUtilities:
 
+    """ The stages of opening a project, in the order they start in """
+    LOAD_STAGES = (STAGE_PARSING, STAGE_INSTRUMENTS, STAGE_EVENTS, STAGE_LEVELS, STAGE_PIPELINE) = \
+                  ("parsing", "instruments", "events", "levels", "pipeline")
+
     JOKOSHER_VERSION_FORMAT = {
         "1.0": FormatOneZero,
     }
 
+    """ Loaders which stream the project file instead of reading it into a DOM """
+    JOKOSHER_STREAMING_FORMAT = {
+        "1.0": StreamingFormatOneZero,
+    }
+
+    """ The first bytes of a gzipped file """
+    GZIP_MAGIC = b"\x1f\x8b"
+
+    @classmethod
+    def open_project_xml(cls, projectfile):
+        """
+        Opens a project file for reading its XML. Starting from 0.10,
+        both gzipped and plain XML are accepted.
+
+        Parameters:
+            projectfile -- path to the project file.
+
+        Returns:
+            a binary file object of the XML, and the file object of the
+            file on disk underneath it. Both have to be closed.
+        """
+        rawFile = open(projectfile, "rb")
+        if rawFile.read(len(cls.GZIP_MAGIC)) == cls.GZIP_MAGIC:
+            rawFile.seek(0)
+            return gzip.GzipFile(fileobj=rawFile), rawFile
+
+        rawFile.seek(0)
+        return rawFile, rawFile
+
+    @classmethod
+    def read_project_version(cls, projectfile):
+        """
+        Reads the version of a project file without reading the rest of it.
+
+        Parameters:
+            projectfile -- path to the project file.
+
+        Returns:
+            the version string, or None if the file has no version.
+        """
+        xmlFile, rawFile = cls.open_project_xml(projectfile)
+        try:
+            for action, element in ElementTree.iterparse(xmlFile, events=("start",)):
+                return element.get("version")
+        finally:
+            xmlFile.close()
+            rawFile.close()
+
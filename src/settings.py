@@ -508,6 +508,27 @@ class Settings:
     def get_bit_depth(self):
         return self.gsettings.get_string('bit-depth')
 
+    def get_waveform_workers(self):
+        return self.gsettings.get_int('waveform-workers')
+
+    def get_import_workers(self):
+        return self.gsettings.get_int('import-workers')
+
+    def get_levels_cache_size(self):
+        return self.gsettings.get_int('levels-cache-size')
+
+    def get_waveform_cache_size(self):
+        return self.gsettings.get_int('waveform-cache-size')
+
+    def get_lazy_event_loading(self):
+        return self.gsettings.get_boolean('lazy-event-loading')
+
+    def get_project_snapshots(self):
+        return self.gsettings.get_boolean('project-snapshots')
+
+    def get_metering_rate(self):
+        return self.gsettings.get_int('metering-rate')
+
     def get_recent_projects(self):
         return self.gsettings.get_strv('recent-projects')
 
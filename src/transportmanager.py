@@ -79,8 +79,7 @@ class TransportManager(GObject.GObject):
 
     def Play(self, newAudioState):
         """
-        Called when play button has been pressed (or whilst exporting
-        in which case, newAudioState will be set to AUDIO_EXPORTING).
+        Called when play button has been pressed.
 
         Parameters:
             newAudioState -- new audio state to set the Project to.
@@ -99,10 +98,9 @@ class TransportManager(GObject.GObject):
             #clear stopPosition in case it has been set by previous SeekTo()
             self.stopPosition = 0
         self.pipeline.set_state(Gst.State.PLAYING)
-        #for normal playback then we need to start the timeout that will
-        #control the movement of the playhead
-        if not self.project.GetIsExporting():
-            self.StartUpdateTimeout()
+        #start the timeout that will control the movement of the playhead,
+        #exports are rendered in a pipeline of their own
+        self.StartUpdateTimeout()
 
     #_____________________________________________________________________
 
@@ -364,6 +362,8 @@ class TransportManager(GObject.GObject):
         #make sure we cant seek to before the beginning
         pos = max(0, pos)
         if self.isPlaying or self.isPaused:
+            # the events after pos may not be set up yet
+            self.project.materialize_events(pos)
             #if stopPos is set then pass it to gstreamer here anc clear
             if stopPos:
                 self.pipeline.seek( 1.0, Gst.Format.TIME, Gst.SeekFlags.FLUSH,
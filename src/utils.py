@@ -56,45 +56,27 @@ class Utils():
         node.setAttribute(valueAttr, str(value))
 
     @classmethod
-    def CalculateAudioLevelFromStructure(cls, structure):
+    def DecibelsToLevels(cls, decibels):
         """
-        Calculates an average for all channel levels.
+        Converts a batch of channel levels in decibels, as found in the rms
+        and peak fields of level messages, to integer levels.
 
         Parameters:
-            channelLevels -- list of levels from each channel.
+            decibels -- list of levels in decibels, which may include
+                        negative infinity for silence.
 
         Returns:
-            an average level, also taking into account negative infinity numbers,
-            which will be discarded in the average.
+            a list of integer levels between 0 (DECIBEL_RANGE decibels or
+            more below full scale) and sys.maxsize (full scale), in the
+            same order as decibels.
         """
-        # FIXME: currently everything is being averaged to a single channel
-        channelLevels = structure.get_value("rms")
-
-        negInf = -1E+5000
-        peaktotal = 0
-        for peak in channelLevels:
-            print(peak)
-            #if peak > 0.001:
-            #    print channelLevels
-            #don't add -inf values cause 500 + -inf is still -inf
-            if peak != negInf:
-                peaktotal += peak
-            else:
-                peaktotal -= cls.DECIBEL_RANGE
-
-        peaktotal /= len(channelLevels)
-
-        peaktotal += cls.DECIBEL_RANGE
-        #convert to an integer
-        peaktotal = min(peaktotal, cls.DECIBEL_RANGE)
-        peaktotal = max(peaktotal, -cls.DECIBEL_RANGE)
-        peakint = int((peaktotal / cls.DECIBEL_RANGE) * sys.maxsize)
+        levels = []
+        for level in decibels:
+            # -inf and anything below the range are silence
+            level = min(max(level + cls.DECIBEL_RANGE, 0), cls.DECIBEL_RANGE)
+            levels.append(min(int((level / cls.DECIBEL_RANGE) * sys.maxsize), sys.maxsize))
 
-        endtime = structure.get_value("endtime")
-        #convert number from Gst.SECOND (i.e. nanoseconds) to milliseconds
-        endtime_millis = int(endtime / cls.NANO_TO_MILLI_DIVISOR)
-
-        return (endtime_millis, [peakint])
+        return levels
 
     @classmethod
     def GdkRectangle(cls, x, y, width, height):
@@ -259,6 +241,69 @@ class Utils():
 
         return dictionary
 
+    @classmethod
+    def load_params_from_element(cls, obj, parentElement):
+        """
+        The same as load_params_from_xml, for an ElementTree element
+        such as the ones read by the streaming project loader.
+
+        Parameters:
+            parentElement -- ElementTree element with the parameters.
+        """
+        for element in parentElement:
+            setattr(obj, element.tag, cls.load_variable_from_element(element))
+
+    @classmethod
+    def load_variable_from_element(cls, element, typeAttr="type", valueAttr="value"):
+        """
+        The same as load_variable_from_node, for an ElementTree element.
+
+        Parameters:
+            element -- ElementTree element from which the variable is loaded.
+            typeAttr -- string of the attribute name that the
+                        variable's type will be saved under.
+            valueAttr -- string of the attribute name that the
+                        variable's value will be saved under.
+
+        Returns:
+            the loaded variable.
+        """
+        varType = element.get(typeAttr)
+        value = element.get(valueAttr, "")
+        if varType == "int":
+            variable = int(value)
+        elif varType == "float":
+            variable = float(value)
+        elif varType == "bool":
+            variable = (value == "True")
+        elif varType == "NoneType":
+            variable = None
+        else:
+            variable = value
+
+        return variable
+
+    @classmethod
+    def load_dictionary_from_element(cls, parentElement):
+        """
+        The same as load_dictionary_from_xml, for an ElementTree element.
+
+        Parameters:
+            parentElement -- ElementTree element from which the dictionary is loaded.
+
+        Returns:
+            a dictionary with the loaded values in (type, value) format.
+        """
+        dictionary = {}
+        for element in parentElement:
+            if "keytype" in element.attrib and "keyvalue" in element.attrib:
+                key = cls.load_variable_from_element(element, "keytype", "keyvalue")
+            else:
+                key = element.tag
+            dictionary[key] = cls.load_variable_from_element(element, "type", "value")
+
+        return dictionary
+
     @classmethod
     def DbToFloat(cls, f):
         """
@@ -0,0 +1,231 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    waveformanalyser.py
+#
+#    Calculates the levels of an audio file as fast as it can be decoded.
+#    Instead of waiting for one level message per interval on the main loop,
+#    decoded audio is pulled out of an appsink in large buffers on a worker
+#    thread and the levels are calculated a whole buffer at a time.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import GObject
+from gi.repository import Gst
+from .globals import Globals
+from .levelslist import LevelsList
+from .utils import Utils
+import threading
+import time
+import sys
+
+try:
+    import numpy
+except ImportError:
+    # without numpy Event falls back to the level element
+    numpy = None
+
+class WaveformAnalyser(GObject.GObject):
+    """
+    Analyses an audio file on a worker thread. All the signals are emitted
+    from the main loop, so handlers don't need to care about threads.
+    """
+
+    __gsignals__ = {
+        "progress"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_DOUBLE,) ),
+        "finished"    : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_PYOBJECT, GObject.TYPE_DOUBLE) ),
+        "error"        : ( GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, (GObject.TYPE_STRING,) )
+    }
+
+    """
+    Signals:
+        "progress" -- the amount of audio analysed so far, in seconds.
+        "finished" -- the analysis is complete. Passes the LevelsList and
+                      the length of the file in seconds.
+        "error" -- the file could not be decoded. Passes the error message.
+    """
+
+    """ The least number of seconds between two progress signals """
+    PROGRESS_INTERVAL = 0.25
+    """ How long to wait for a decoded sample before checking for errors, in nanoseconds """
+    PULL_TIMEOUT = Gst.SECOND // 10
+
+    def __init__(self, path, interval):
+        """
+        Creates a new instance of WaveformAnalyser.
+
+        Parameters:
+            path -- the audio file to analyse.
+            interval -- the length of audio covered by each level, in seconds.
+        """
+        GObject.GObject.__init__(self)
+
+        self.path = path
+        self.interval = interval
+        self.thread = None
+        self.__cancelled = False
+
+        pipe = "filesrc name=src ! decodebin ! audioconvert ! " \
+               "audio/x-raw,format=F32LE,layout=interleaved ! appsink name=sink sync=false"
+        self.pipeline = Gst.parse_launch(pipe)
+        self.pipeline.get_by_name("src").set_property("location", path)
+        self.sink = self.pipeline.get_by_name("sink")
+
+    #_____________________________________________________________________
+
+    @classmethod
+    def is_available(cls):
+        """
+        Returns:
+            True if the levels can be analysed offline (numpy is installed).
+        """
+        return numpy is not None
+
+    #_____________________________________________________________________
+
+    def start(self):
+        """
+        Starts decoding and analysing the file on a worker thread.
+        """
+        self.thread = threading.Thread(target=self.__run, name="WaveformAnalyser")
+        self.thread.daemon = True
+        self.thread.start()
+
+    #_____________________________________________________________________
+
+    def cancel(self):
+        """
+        Stops the analysis. No more signals will be emitted after this.
+        """
+        self.__cancelled = True
+        # this unblocks the worker if it is waiting for a sample
+        self.pipeline.set_state(Gst.State.NULL)
+
+    #_____________________________________________________________________
+
+    def __run(self):
+        """
+        The body of the worker thread.
+        """
+        levels = LevelsList()
+        pending = None        # decoded frames not yet making up a whole interval
+        frames = 0            # number of frames already turned into levels
+        rate = 0
+        lastProgress = 0
+
+        bus = self.pipeline.get_bus()
+        error = None
+
+        self.pipeline.set_state(Gst.State.PLAYING)
+        while not self.__cancelled:
+            # an error doesn't end the stream, so don't wait for samples forever
+            sample = self.sink.emit("try-pull-sample", self.PULL_TIMEOUT)
+            if sample is None:
+                error = bus.pop_filtered(Gst.MessageType.ERROR)
+                if error or self.sink.get_property("eos"):
+                    break
+                continue
+
+            structure = sample.get_caps().get_structure(0)
+            rate = structure.get_value("rate")
+            channels = structure.get_value("channels")
+
+            buffer = sample.get_buffer()
+            success, info = buffer.map(Gst.MapFlags.READ)
+            if not success:
+                continue
+            data = numpy.frombuffer(info.data, dtype="<f4").reshape(-1, channels)
+            pending = data.copy() if pending is None else numpy.concatenate((pending, data))
+            buffer.unmap(info)
+
+            window = max(int(rate * self.interval), 1)
+            whole = (len(pending) // window) * window
+            if whole:
+                self.__AppendLevels(levels, pending[:whole], window, frames, rate)
+                frames += whole
+                pending = pending[whole:]
+
+            now = time.time()
+            if now - lastProgress > self.PROGRESS_INTERVAL:
+                lastProgress = now
+                GObject.idle_add(self.__EmitIfRunning, "progress", frames / float(rate))
+
+        if self.__cancelled:
+            return
+
+        if error:
+            error, debug = error.parse_error()
+            Globals.debug("WaveformAnalyser error:", str(error), str(debug))
+            self.pipeline.set_state(Gst.State.NULL)
+            GObject.idle_add(self.__EmitIfRunning, "error", "%s\n%s" % (error, debug))
+            return
+
+        # the level element also sends a last, shorter level at the end of the stream
+        if pending is not None and len(pending):
+            self.__AppendLevels(levels, pending, len(pending), frames, rate)
+            frames += len(pending)
+
+        success, duration = self.pipeline.query_duration(Gst.Format.TIME)
+        length = duration / float(Gst.SECOND) if success and duration > 0 else 0.0
+        if not length and rate:
+            length = frames / float(rate)
+
+        self.pipeline.set_state(Gst.State.NULL)
+        GObject.idle_add(self.__EmitIfRunning, "finished", levels, length)
+
+    #_____________________________________________________________________
+
+    def __AppendLevels(self, levels, data, window, start, rate):
+        """
+        Calculates the RMS and peak level of each channel, for every window
+        of frames in data, and appends them to the levels list.
+
+        Parameters:
+            levels -- the LevelsList to append to.
+            data -- array of frames, each with one sample per channel.
+                    Its length must be a multiple of window.
+            window -- the number of frames in each level.
+            start -- the number of frames before data, used for the end times.
+            rate -- the sample rate of the audio.
+        """
+        count = len(data) // window
+        windows = data.reshape(count, window, data.shape[1])
+
+        ends = start + window * numpy.arange(1, count + 1)
+        times = (ends * 1000) // rate
+        rms = numpy.sqrt(numpy.mean(numpy.square(windows, dtype=numpy.float64), axis=1))
+        peak = numpy.max(numpy.abs(windows), axis=1)
+
+        # the end times must keep increasing, even with windows under a millisecond
+        last = levels.times[-1] if len(levels) else 0
+        keep = times > numpy.concatenate(([last], times[:-1]))
+        times, rms, peak = times[keep], rms[keep], peak[keep]
+
+        levels.append_block(times, self.__ToLevels(rms).T, self.__ToLevels(peak).T)
+
+    #_____________________________________________________________________
+
+    def __ToLevels(self, amplitudes):
+        """
+        The same conversion as Utils.DecibelsToLevels, from linear amplitudes.
+        """
+        with numpy.errstate(divide="ignore"):
+            decibels = 20 * numpy.log10(amplitudes)
+        scaled = numpy.clip(decibels + Utils.DECIBEL_RANGE, 0, Utils.DECIBEL_RANGE)
+        return scaled * (sys.maxsize / float(Utils.DECIBEL_RANGE))
+
+    #_____________________________________________________________________
+
+    def __EmitIfRunning(self, signal, *args):
+        """
+        Emits the signal from the main loop, unless the analysis has been cancelled.
+        """
+        if not self.__cancelled:
+            self.emit(signal, *args)
+        #Stop idle_add from calling us again
+        return False
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -0,0 +1,122 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    waveformscheduler.py
+#
+#    Limits how many events of a project generate their waveform at the same
+#    time. Every waveform is decoded from the whole audio file, so starting
+#    all of them at once only makes them compete for the CPU and the disk.
+#
+#-------------------------------------------------------------------------------
+
+from .globals import Globals
+import os
+
+class WaveformScheduler:
+    """
+    Queue of the events waiting to generate their waveform, and the set of
+    events currently doing so.
+    """
+
+    def __init__(self, workers=0):
+        """
+        Creates a new instance of WaveformScheduler.
+
+        Parameters:
+            workers -- the number of waveforms generated at the same time,
+                       0 to use the number of processors.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = []            # events waiting for a free worker, in order
+        self.running = {}        # events generating their waveform -> corrupt signal handler
+
+    #_____________________________________________________________________
+
+    def schedule(self, event):
+        """
+        Queues an event to generate its waveform, and starts it right
+        away if a worker is free.
+
+        Parameters:
+            event -- the Event which needs its waveform generated.
+        """
+        if event in self.queue or event in self.running:
+            return
+
+        self.queue.append(event)
+        self.__StartNext()
+
+    #_____________________________________________________________________
+
+    def prioritise(self, event):
+        """
+        Moves a queued event to the front of the queue, for example because
+        it has become visible.
+
+        Parameters:
+            event -- the Event to generate next.
+        """
+        if event in self.queue and self.queue[0] is not event:
+            self.queue.remove(event)
+            self.queue.insert(0, event)
+
+    #_____________________________________________________________________
+
+    def remove(self, event):
+        """
+        Removes an event from the queue, or frees its worker if it was
+        already generating its waveform. The event is expected to stop
+        its own loading pipeline.
+
+        Parameters:
+            event -- the Event which has finished or been cancelled.
+        """
+        if event in self.queue:
+            self.queue.remove(event)
+
+        if event in self.running:
+            event.disconnect(self.running.pop(event))
+            self.__StartNext()
+
+    #_____________________________________________________________________
+
+    def is_queued(self, event):
+        """
+        Returns:
+            True if the event is waiting for a free worker.
+        """
+        return event in self.queue
+
+    #_____________________________________________________________________
+
+    def clear(self):
+        """
+        Forgets all of the queued events, without starting any of them.
+        """
+        self.queue = []
+
+    #_____________________________________________________________________
+
+    def __StartNext(self):
+        """
+        Starts as many queued events as there are free workers.
+        """
+        while self.queue and len(self.running) < self.workers:
+            event = self.queue.pop(0)
+            # a file which can't be decoded never finishes, so free its worker
+            self.running[event] = event.connect("corrupt", self.__OnEventCorrupt)
+            Globals.debug("Generating waveform for event", event.id)
+            event.start_waveform_generation()
+
+    #_____________________________________________________________________
+
+    def __OnEventCorrupt(self, event, message):
+        """
+        Callback for when a running event fails to decode its file.
+        """
+        self.remove(event)
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -0,0 +1,112 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    waveformtilecache.py
+#
+#    Keeps the rendered waveforms of all the events in fixed width tiles,
+#    so that scrolling, or going back to a zoom level which was used
+#    recently, only has to paint tiles which are already drawn.
+#
+#-------------------------------------------------------------------------------
+
+from gi.repository import Gio
+from collections import OrderedDict
+
+class WaveformTileCache:
+    """
+    Cairo surfaces of waveform tiles, shared by every EventViewer so that
+    all of them together stay within one memory budget. When the budget
+    is exceeded the least recently used tiles are dropped.
+    """
+
+    """ The width of every tile in pixels """
+    TILE_WIDTH = 256
+    """ The number of bytes used by each pixel of an ARGB32 surface """
+    BYTES_PER_PIXEL = 4
+
+    def __init__(self, max_size):
+        """
+        Creates a new instance of WaveformTileCache.
+
+        Parameters:
+            max_size -- the largest total size of the tiles in bytes.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.tiles = OrderedDict()    # (owner, view_scale, index, height) -> surface, least recently used first
+
+    #_____________________________________________________________________
+
+    @staticmethod
+    def get_cache():
+        app = Gio.Application.get_default()
+        return app.waveform_tiles
+
+    #_____________________________________________________________________
+
+    def lookup(self, owner, view_scale, index, height):
+        """
+        Obtain a tile which has been drawn before.
+
+        Parameters:
+            owner -- the object which drew the tile, usually an EventViewer.
+            view_scale -- the zoom level the tile was drawn at.
+            index -- the position of the tile, counting from the left in TILE_WIDTHs.
+            height -- the height of the tile in pixels.
+
+        Returns:
+            the cairo.ImageSurface of the tile, or None if it isn't cached.
+        """
+        key = (owner, view_scale, index, height)
+        surface = self.tiles.get(key)
+        if surface is not None:
+            self.tiles.move_to_end(key)
+        return surface
+
+    #_____________________________________________________________________
+
+    def store(self, owner, view_scale, index, height, surface):
+        """
+        Adds a tile to the cache, and drops the least recently used
+        tiles if the cache has become too big.
+
+        Parameters:
+            owner -- the object which drew the tile, usually an EventViewer.
+            view_scale -- the zoom level the tile was drawn at.
+            index -- the position of the tile, counting from the left in TILE_WIDTHs.
+            height -- the height of the tile in pixels.
+            surface -- the cairo.ImageSurface of the tile.
+        """
+        key = (owner, view_scale, index, height)
+        if key in self.tiles:
+            self.size -= self.__GetSurfaceSize(self.tiles.pop(key))
+
+        self.tiles[key] = surface
+        self.size += self.__GetSurfaceSize(surface)
+
+        # always keep the newest tile, or it would be drawn again right away
+        while self.size > self.max_size and len(self.tiles) > 1:
+            oldKey, oldSurface = self.tiles.popitem(last=False)
+            self.size -= self.__GetSurfaceSize(oldSurface)
+
+    #_____________________________________________________________________
+
+    def invalidate(self, owner):
+        """
+        Drops all the tiles of an owner, at every zoom level.
+
+        Parameters:
+            owner -- the object whose waveform has changed or which is destroyed.
+        """
+        for key in [key for key in self.tiles if key[0] is owner]:
+            self.size -= self.__GetSurfaceSize(self.tiles.pop(key))
+
+    #_____________________________________________________________________
+
+    def __GetSurfaceSize(self, surface):
+        return surface.get_width() * surface.get_height() * self.BYTES_PER_PIXEL
+
+    #_____________________________________________________________________
+
+#=========================================================================
@@ -41,6 +41,15 @@ class JokosherWindow(Adw.ApplicationWindow):
     mixer_button = Gtk.Template.Child()
     scale_show_button = Gtk.Template.Child()
 
+    # what is shown while each stage of opening a project runs
+    LOADING_STAGE_TEXT = {
+        "parsing" : "Reading project file",
+        "instruments" : "Loading instruments",
+        "events" : "Loading events",
+        "levels" : "Loading waveforms",
+        "pipeline" : "Setting up playback",
+    }
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # set up project
@@ -76,6 +85,8 @@ class JokosherWindow(Adw.ApplicationWindow):
         self.project_dialog.props.vexpand = True
         self.project_dialog.props.valign = Gtk.Align.FILL
 
+        self.loading_pane = None
+        self.app.connect("project::loading", self.on_project_loading)
         self.app.connect("project::open", self.on_project_open)
         self.app.connect("project::close", self.on_project_close)
         self.app.connect("project::dialog", self.on_project_dialog)
@@ -128,6 +139,43 @@ class JokosherWindow(Adw.ApplicationWindow):
         add_instrument_dialog.show()
         #self.project.add_instrument("None", "None")
 
+    def on_project_loading(self, application):
+        loader = application.projectLoader
+        self.remove_loading_pane()
+
+        # progress of opening the project, with a way to stop it
+        self.loading_pane = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.general_box.append(self.loading_pane)
+        self.loading_pane.set_margin_top(10)
+        self.loading_pane.set_margin_start(10)
+        self.loading_pane.set_margin_end(10)
+        self.loading_pane.set_margin_bottom(10)
+        self.loading_progress = Gtk.ProgressBar.new()
+        self.loading_progress.set_show_text(True)
+        self.loading_progress.set_text(self.LOADING_STAGE_TEXT[loader.stage])
+        self.loading_progress.props.hexpand = True
+        self.loading_progress.props.valign = Gtk.Align.CENTER
+        self.loading_pane.append(self.loading_progress)
+        self.loading_button = Gtk.Button.new_with_label("Cancel")
+        self.loading_button.set_margin_start(10)
+        self.loading_pane.append(self.loading_button)
+        self.loading_button.connect("clicked", lambda button: loader.cancel())
+
+        loader.connect("progress", self.on_project_loading_progress)
+        loader.connect("finished", lambda loader, project: self.remove_loading_pane())
+        loader.connect("cancelled", lambda loader: self.remove_loading_pane())
+        # the application shows the error in a dialog
+        loader.connect("error", lambda loader, error: self.remove_loading_pane())
+
+    def on_project_loading_progress(self, loader, stage, fraction):
+        self.loading_progress.set_fraction(fraction)
+        self.loading_progress.set_text("%s (%d%%)" % (self.LOADING_STAGE_TEXT[stage], fraction * 100))
+
+    def remove_loading_pane(self):
+        if self.loading_pane:
+            self.general_box.remove(self.loading_pane)
+            self.loading_pane = None
+
     def on_project_open(self, application):
         # if project dialog is still shown, remove it, we are opening from menu
         if self.project_dialog:
@@ -0,0 +1,23 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    conftest.py
+#
+#    Imports the source directory as the jokosher package, the way it is
+#    installed, so that the tests can import its modules.
+#
+#-------------------------------------------------------------------------------
+
+import importlib.util
+import os
+import sys
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+
+if "jokosher" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("jokosher", os.path.join(SOURCE, "__init__.py"),
+                                                  submodule_search_locations=[SOURCE])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["jokosher"] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,55 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    test_instrument.py
+#
+#-------------------------------------------------------------------------------
+
+from types import SimpleNamespace
+import pytest
+
+gi = pytest.importorskip("gi")
+gi.require_version("Gst", "1.0")
+gi.require_version("GstController", "1.0")
+gi.require_version("Gdk", "4.0")
+from gi.repository import Gst
+
+from jokosher.instrument import Instrument
+
+Gst.init(None)
+
+#_____________________________________________________________________
+
+@pytest.mark.skipif(not Gst.ElementFactory.find("nlecomposition"), reason="needs the GStreamer nle plugin")
+def test_render_an_instrument_with_an_effect():
+    effect = Gst.ElementFactory.make("identity", "effect_0")
+    effect.set_property("sleep-time", 7)
+    # effects live in the effects bin of the playback pipeline, which is their parent
+    effectsBin = Gst.Bin.new("effects")
+    effectsBin.add(effect)
+
+    instrument = SimpleNamespace(id=1, volume=1.0, pan=0.0, events=[], effects=[effect],
+                                 project=SimpleNamespace(volume=1.0),
+                                 freezer=SimpleNamespace(frozenFile=None, frozenLength=0),
+                                 get_fade_points=lambda: [(0.0, 0.99), (0.5, 0.99)])
+    renderBin = Instrument.make_render_bin(instrument, 0.5)
+
+    [effectCopy] = [element for element in renderBin.iterate_elements()
+                    if element.get_factory().get_name() == "identity"]
+    assert effectCopy.get_parent() is renderBin
+    assert effectCopy.get_property("sleep-time") == 7
+    assert effect.get_parent() is effectsBin
+
+    pipeline = Gst.Pipeline.new("render")
+    sink = Gst.ElementFactory.make("fakesink", None)
+    sink.set_property("sync", False)
+    pipeline.add(renderBin)
+    pipeline.add(sink)
+    assert renderBin.link(sink)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    assert message is not None
+    assert message.type == Gst.MessageType.EOS
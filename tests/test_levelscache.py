@@ -0,0 +1,32 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    test_levelscache.py
+#
+#-------------------------------------------------------------------------------
+
+import pytest
+
+pytest.importorskip("gi")
+
+from jokosher import levelslist
+from jokosher.levelscache import LevelsCache
+from jokosher.levelslist import LevelsList
+
+#_____________________________________________________________________
+
+@pytest.mark.skipif(levelslist.numpy is None, reason="needs numpy")
+def test_lookup_maps_the_cached_levels(tmp_path):
+    levels_list = LevelsList()
+    for i in range(3000):
+        levels_list.append((i + 1) * 100, [i * 1000, i * 2000])
+
+    cache = LevelsCache(str(tmp_path), 1 << 20)
+    key = cache.get_key("0" * 40, 0.01, "stereo")
+    cache.store(key, levels_list)
+    cached = cache.lookup(key)
+
+    assert cached.is_mapped()
+    assert len(cached) == len(levels_list)
+    assert list(cached.times) == list(levels_list.times)
@@ -0,0 +1,111 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    test_levelslist.py
+#
+#-------------------------------------------------------------------------------
+
+import os
+import threading
+import pytest
+
+from jokosher import levelslist
+from jokosher.levelslist import LevelsList
+
+# levels files are only mapped into memory with numpy
+needs_numpy = pytest.mark.skipif(levelslist.numpy is None, reason="needs numpy")
+
+def make_levels(count, start=0):
+    levels_list = LevelsList()
+    for i in range(count):
+        levels_list.append(start + (i + 1) * 100, [i % 1000, (i * 7) % 1000], [i % 900, (i * 3) % 900])
+    return levels_list
+
+#_____________________________________________________________________
+
+def test_copy_is_independent():
+    levels_list = make_levels(10)
+    snapshot = levels_list.copy()
+    levels_list.extend(levels_list.times[-1], make_levels(5))
+    levels_list.refade(levels_list.copy(), [0, 2000], [0.0, 1.0])
+
+    assert len(snapshot) == 10
+    assert list(snapshot) == list(make_levels(10))
+
+#_____________________________________________________________________
+
+@needs_numpy
+def test_fromfile_maps_the_current_format(tmp_path):
+    path = str(tmp_path / "levels.leveldata")
+    make_levels(3000).tofile(path)
+    decoded = LevelsList()
+    decoded.fromfile(path, mapped=False)
+    levels_list = LevelsList()
+    levels_list.fromfile(path, mapped=True)
+
+    assert levels_list.is_mapped()
+    assert not decoded.is_mapped()
+    assert list(levels_list) == list(decoded)
+    assert levels_list.find_endtime_index(150050) == decoded.find_endtime_index(150050)
+    assert list(levels_list.get_tier(1000)) == list(decoded.get_tier(1000))
+    assert list(levels_list.slice_by_endtime(1000, 200000)) == list(decoded.slice_by_endtime(1000, 200000))
+
+#_____________________________________________________________________
+
+@needs_numpy
+def test_copy_of_mapped_levels_shares_the_file(tmp_path):
+    path = str(tmp_path / "levels.leveldata")
+    make_levels(3000).tofile(path)
+    levels_list = LevelsList()
+    levels_list.fromfile(path, mapped=True)
+    expected = list(levels_list)
+    snapshot = levels_list.copy()
+    assert levels_list.is_mapped()
+    assert snapshot.is_mapped()
+
+    # editing replaces the mapped values, the snapshot keeps the file's
+    levels_list.append(levels_list.times[-1] + 100, [1, 1], [1, 1])
+    assert not levels_list.is_mapped()
+    assert snapshot.is_mapped()
+    assert list(snapshot) == expected
+    assert len(levels_list) == 3001
+
+    # the unchanged snapshot isn't written over its own file
+    mtime = os.stat(path).st_mtime_ns
+    snapshot.tofile(path)
+    assert os.stat(path).st_mtime_ns == mtime
+
+#_____________________________________________________________________
+
+def test_levels_changed_while_a_background_save_writes_them(tmp_path):
+    """
+    Project.save_project_file(background=True) copies the levels on the
+    main thread and writes the copies on a worker, while the main thread
+    goes on joining, splitting and refading the same events.
+    """
+    levels_list = make_levels(20000)
+    snapshot = levels_list.copy()
+    expected = str(tmp_path / "expected.leveldata")
+    snapshot.tofile(expected)
+
+    written = str(tmp_path / "written.leveldata")
+    errors = []
+    def save():
+        try:
+            for i in range(20):
+                snapshot.tofile(written)
+        except Exception as e:
+            errors.append(e)
+
+    saveThread = threading.Thread(target=save)
+    saveThread.start()
+    more = make_levels(500)
+    while saveThread.is_alive():
+        levels_list.extend(levels_list.times[-1], more)
+        levels_list.append_time_delta(100, [5, 5], [5, 5])
+    saveThread.join()
+
+    assert not errors
+    with open(expected, "rb") as f1, open(written, "rb") as f2:
+        assert f1.read() == f2.read()
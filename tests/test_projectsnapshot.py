@@ -0,0 +1,65 @@
+#
+#    THIS FILE IS PART OF THE JOKOSHER PROJECT AND LICENSED UNDER THE GPL. SEE
+#    THE 'COPYING' FILE FOR DETAILS
+#
+#    test_projectsnapshot.py
+#
+#-------------------------------------------------------------------------------
+
+import pytest
+
+gi = pytest.importorskip("gi")
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+
+from jokosher.projectsnapshot import ProjectSnapshot
+
+Gst.init(None)
+
+class FakeInstrument:
+    SAVED_PARAMETERS = ["name", "volume"]
+
+    def __init__(self, id, effects):
+        self.id = id
+        self.name = "Guitar"
+        self.volume = 0.5
+        self.effects = effects
+        self.events = []
+        self.graveyard = []
+
+class FakeProject:
+    SAVED_PARAMETERS = ["name"]
+
+    def __init__(self, instruments):
+        self.name = "Snapshot"
+        self.notes = ""
+        self.instruments = instruments
+        self.graveyard = []
+
+#_____________________________________________________________________
+
+def test_round_trip_with_an_effect(tmp_path):
+    effect = Gst.ElementFactory.make("identity", "effect_0")
+    effect.set_property("sleep-time", 7)
+    # the parent is a writable Gst.Object property which JSON can't store
+    pipeline = Gst.Pipeline.new("pipeline")
+    pipeline.add(effect)
+
+    body = ProjectSnapshot.from_project(FakeProject([FakeInstrument(1, [effect])]))
+    assert body is not None
+
+    projectfile = str(tmp_path / "project.jokosher")
+    with open(projectfile, "w") as f:
+        f.write("<JokosherProject/>")
+    path = str(tmp_path / "project.jokosher.snapshot")
+    ProjectSnapshot.write(path, projectfile, body)
+
+    snapshot = ProjectSnapshot.read(path, projectfile)
+    assert snapshot is not None
+    [instrument] = snapshot.instruments
+    assert instrument["id"] == 1
+    [(elementname, propsdict)] = instrument["effects"]
+    assert elementname == "identity"
+    assert propsdict["sleep-time"] == 7
+    assert "name" not in propsdict
+    assert "parent" not in propsdict